@@ -0,0 +1,165 @@
+"""
+Cluster-First, Route-Second Decomposition
+Splits a large map into capacity-feasible clusters around the depot and solves each as its own small VRP
+"""
+
+import math
+import time
+import numpy as np
+from data.models import Instance, build_neighbor_index
+from algorithms.route_cost import calc_total_distance
+from runner import run_jobs
+
+# locations per cluster, small enough for the OR-Tools metaheuristics to converge within a second
+CLUSTER_SIZE = 100
+
+
+def decompose(model, algorithm="gls", time_limit=1, cluster_size=CLUSTER_SIZE, method="sweep", workers=1,
+              improve=None, improve_time_limit=None, fallback="nn", coords=None, seed=0, **options):
+  """
+  Partitions the locations into clusters of about cluster_size (see partition), gives every cluster enough
+  vehicles for its demand and solves each cluster with the registered algorithm, on workers processes.
+  time_limit is the wall-clock budget of all cluster solves together: each cluster gets its share of it
+  for the number of rounds the workers need. A cluster the algorithm finds no solution for within its share
+  is solved with the fallback algorithm instead, unless fallback is None.
+  The cluster routes are mapped back to the vehicles and locations of the model. If improve names a
+  registered OR-Tools solver, it is warm-started from the stitched routes for improve_time_limit seconds
+  (default time_limit) to move locations between clusters.
+  coords default to model["coords"]. Returns (routes, stats); routes are None if a cluster found no solution
+  """
+  coords = np.asarray(model["coords"] if coords is None else coords)
+  clusters = partition(model, coords, cluster_size, method, seed)
+  vehicles = allocate_vehicles(model, clusters)
+
+  rounds = math.ceil(len(clusters) / max(1, workers))
+  cluster_time_limit = time_limit / rounds if time_limit is not None else None
+  jobs = [{"model": cluster_model(model, coords, nodes, vehicle_ids), "algorithm": algorithm,
+           "time_limit": cluster_time_limit, "fallback": fallback, "options": options}
+          for nodes, vehicle_ids in zip(clusters, vehicles)]
+  start = time.perf_counter()
+  results = run_jobs(solve_cluster, jobs, workers)
+  stats = {"clusters": len(clusters), "cluster_wall_times": [result["wall_time"] for result in results],
+           "fallback_clusters": sum(result["fallback"] for result in results),
+           "decomposed_wall_time": time.perf_counter() - start}
+
+  depot = model["depot"]
+  routes = [[depot, depot] for _ in range(model["num_vehicles"])]
+  for nodes, vehicle_ids, result in zip(clusters, vehicles, results):
+    if result["routes"] is None:
+      stats["failed_clusters"] = stats.get("failed_clusters", 0) + 1
+      continue
+    # sub-model location 0 is the depot, location i the i-th location of the cluster
+    sub_locations = np.concatenate(([depot], nodes))
+    for vehicle_id, route in zip(vehicle_ids, result["routes"]):
+      routes[vehicle_id] = [int(sub_locations[location]) for location in route]
+  if stats.get("failed_clusters"):
+    return None, stats
+
+  served = sum(len(route) - 2 for route in routes)
+  stats["unserved"] = len(model["distance_matrix"]) - 1 - served
+  stats["decomposed_cost"] = calc_total_distance(routes, model["distance_matrix"])
+  if improve is not None and stats["unserved"] == 0:
+    from algorithms.registry import solve
+    improved = solve(improve, model, improve_time_limit if improve_time_limit is not None else time_limit,
+                     initial_routes=routes)
+    stats["improve_wall_time"] = improved.wall_time
+    if improved.routes is not None and improved.cost < stats["decomposed_cost"]:
+      routes = improved.routes
+  return routes, stats
+
+
+def partition(model, coords, cluster_size=CLUSTER_SIZE, method="sweep", seed=0):
+  """
+  Returns the clusters of non-depot locations as a list of index arrays.
+  "sweep" orders the locations by their angle around the depot and cuts the sweep into equal runs;
+  "kmeans" groups them by k-means on the coordinates
+  """
+  depot = model["depot"]
+  locations = np.delete(np.arange(len(coords)), depot)
+  num_clusters = max(1, math.ceil(len(locations) / cluster_size))
+  if num_clusters == 1:
+    return [locations]
+
+  offsets = coords[locations].astype(np.float64) - coords[depot]
+  if method == "sweep":
+    angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+    # start the sweep at the widest empty angle so no cluster wraps around it
+    order = np.argsort(angles)
+    gaps = np.diff(np.concatenate((angles[order], [angles[order][0] + 2 * np.pi])))
+    order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+    return [locations[run] for run in np.array_split(order, num_clusters)]
+  if method == "kmeans":
+    from scipy.cluster.vq import kmeans2
+    _, labels = kmeans2(offsets, num_clusters, minit="++", seed=seed)
+    return [locations[labels == label] for label in range(num_clusters) if (labels == label).any()]
+  raise ValueError("unknown partition method: " + str(method))
+
+
+def allocate_vehicles(model, clusters):
+  """
+  Returns the vehicle ids given to each cluster. Vehicles are handed out largest first, each to the
+  cluster with the highest demand per unit of capacity given so far, so the fleet is split in proportion
+  to demand. Raises ValueError if some cluster does not get enough capacity for its demand
+  """
+  demands = np.asarray(model["demands"])
+  capacities = np.asarray(model["vehicle_capacities"])
+  cluster_demands = np.array([demands[nodes].sum() for nodes in clusters], dtype=np.float64)
+  given = np.zeros(len(clusters))
+  vehicles = [[] for _ in clusters]
+
+  for vehicle_id in np.argsort(-capacities, kind="stable"):
+    cluster = int(np.argmax(cluster_demands / (given + 1)))
+    vehicles[cluster].append(int(vehicle_id))
+    given[cluster] += capacities[vehicle_id]
+  if (given < cluster_demands).any():
+    raise ValueError("the fleet cannot cover the demand of every cluster")
+  return vehicles
+
+
+def cluster_model(model, coords, nodes, vehicle_ids):
+  """
+  Returns the sub-model of one cluster: the depot as location 0 followed by the cluster's locations,
+  served by the given vehicles
+  """
+  depot = model["depot"]
+  locations = np.concatenate(([depot], nodes))
+  distance_matrix = model["distance_matrix"][locations[:, None], locations[None, :]]
+  return Instance(
+    coords=coords[locations],
+    distance_matrix=distance_matrix,
+    neighbors=build_neighbor_index(distance_matrix),
+    demands=np.asarray(model["demands"])[locations],
+    vehicle_capacities=np.asarray(model["vehicle_capacities"])[vehicle_ids],
+    num_vehicles=len(vehicle_ids),
+    depot=0,
+  )
+
+
+def solve_cluster(job):
+  """
+  Solves one cluster sub-model with a registered algorithm, or the fallback algorithm if that finds
+  no solution. Run by run_jobs
+  """
+  from algorithms.registry import solve
+  result = solve(job["algorithm"], job["model"], job["time_limit"], **job["options"])
+  wall_time, fallback = result.wall_time, False
+  if result.routes is None and job["fallback"] is not None:
+    result = solve(job["fallback"], job["model"], job["time_limit"])
+    wall_time, fallback = wall_time + result.wall_time, True
+  return {"routes": result.routes, "wall_time": wall_time, "fallback": fallback}
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.registry import solve
+  for num_locations in (400, 1000):
+    num_vehicles = int(num_locations * 0.75)
+    model, coords = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=0)
+    direct = solve("gls", model, time_limit=2)
+    for method in ("sweep", "kmeans"):
+      start = time.perf_counter()
+      routes, stats = decompose(model, "gls", time_limit=2, method=method)
+      print('{}L {}: {} clusters, cost {} in {:.2f}s (unserved {}), direct gls {}'.format(
+        num_locations, method, stats["clusters"], stats["decomposed_cost"], time.perf_counter() - start,
+        stats["unserved"], direct.cost))
@@ -0,0 +1,210 @@
+"""
+Incremental Re-Optimization
+Updates a solved model for added, removed and changed stops without rebuilding it, inserts the new stops
+into the existing routes and repairs them locally
+"""
+
+import time
+import numpy as np
+from data.models import (Instance, DistanceOracle, compact_dtype, minkowski_distances, build_neighbor_index,
+                         build_coordinate_neighbor_index, distance_array)
+from algorithms.kernels import pad_routes, widen
+from algorithms.route_cost import calc_total_distance
+from algorithms.two_opt import two_opt_search
+from algorithms.local_search import inter_route_search
+
+
+def reoptimize(model, routes, added_coords=None, added_demands=None, removed=None, demands=None,
+               vehicle_capacities=None, repair_time_limit=0.02, coords=None, p=1):
+  """
+  Applies a change to a solved model and its routes: new stops at added_coords with added_demands, the removed
+  locations, a {location: demand} dict of changed demands and a new list of vehicle_capacities (one per
+  vehicle, so it can also add or remove vehicles). Locations are numbered as in the old model.
+  Stops that no longer fit their vehicle are taken out of their routes; they and the new stops are put back by
+  cheapest feasible insertion. The touched routes are then repaired with 2-opt and inter-route moves of the
+  touched stops for at most repair_time_limit seconds.
+  Returns (model, routes, stats); the new model numbers the kept locations in their old order followed by
+  the added ones, stats["mapping"] maps every old location to its new number (-1 if removed) and
+  stats["unserved"] lists the stops no vehicle had room for
+  """
+  start = time.perf_counter()
+  new_model, mapping = update_model(model, added_coords, added_demands, removed, demands, vehicle_capacities,
+                                    coords, p)
+  num_added = len(new_model["distance_matrix"]) - int((mapping >= 0).sum())
+  routes, displaced, changed = remap_routes(new_model, routes, mapping)
+  updated = time.perf_counter()
+
+  added = np.arange(len(new_model["distance_matrix"]) - num_added, len(new_model["distance_matrix"]))
+  pending = displaced + added.tolist()
+  routes, touched, unserved = cheapest_insertion(new_model, routes, pending)
+  touched |= changed
+  inserted = time.perf_counter()
+
+  routes = repair(new_model, routes, touched, [location for location in pending if location not in unserved],
+                  repair_time_limit)
+  stats = {"mapping": mapping, "added": added.tolist(), "displaced": displaced, "unserved": unserved,
+           "touched_routes": sorted(touched), "cost": calc_total_distance(routes, new_model["distance_matrix"]),
+           "update_time": updated - start, "insertion_time": inserted - updated,
+           "repair_time": time.perf_counter() - inserted, "elapsed": time.perf_counter() - start}
+  return new_model, routes, stats
+
+
+def update_model(model, added_coords=None, added_demands=None, removed=None, demands=None, vehicle_capacities=None,
+                 coords=None, p=1):
+  """
+  Returns (new model, mapping) for the change described in reoptimize. Only the distances from the added
+  locations are computed; the kept part of a dense matrix is copied over and a DistanceOracle is rebuilt on the
+  new coordinates. coords default to model["coords"] and p is the Minkowski norm of a dense matrix.
+  mapping[old location] is the new number of a kept location and -1 for a removed one
+  """
+  coords = np.asarray(model["coords"] if coords is None else coords)
+  num_locations = len(coords)
+  depot = model["depot"]
+  removed = np.unique(np.asarray([] if removed is None else removed, dtype=np.int64))
+  if depot in removed:
+    raise ValueError("the depot cannot be removed")
+  keep = np.setdiff1d(np.arange(num_locations), removed)
+  mapping = np.full(num_locations, -1, dtype=np.int64)
+  mapping[keep] = np.arange(len(keep))
+
+  added_coords = np.asarray([] if added_coords is None else added_coords, dtype=np.int64).reshape(-1, 2)
+  added_demands = np.asarray([] if added_demands is None else added_demands, dtype=np.int64)
+  if len(added_demands) != len(added_coords):
+    raise ValueError("every added location needs one demand")
+  new_coords = np.concatenate((coords[keep].astype(np.int64), added_coords))
+  new_coords = new_coords.astype(compact_dtype(np.abs(new_coords).max(initial=0), signed=True))
+
+  matrix = model["distance_matrix"]
+  if isinstance(matrix, DistanceOracle):
+    distance_matrix = DistanceOracle(new_coords, p=matrix.p)
+    neighbors = build_coordinate_neighbor_index(new_coords, p=matrix.p)
+  else:
+    matrix = np.asarray(matrix)
+    kept = len(keep)
+    # distances from the added locations to every location, the added ones included
+    block = minkowski_distances(new_coords[kept:, None, :], new_coords[None, :, :], p)
+    dtype = np.result_type(matrix.dtype, compact_dtype(block.max(initial=0)))
+    distance_matrix = np.empty((len(new_coords), len(new_coords)), dtype=dtype)
+    distance_matrix[:kept, :kept] = matrix[np.ix_(keep, keep)] if len(removed) else matrix
+    distance_matrix[kept:, :] = block
+    distance_matrix[:, kept:] = block.T
+    neighbors = build_neighbor_index(distance_matrix)
+
+  old_demands = np.asarray(model["demands"][:num_locations], dtype=np.int64).copy()
+  for location, demand in (demands or {}).items():
+    old_demands[location] = demand
+  if vehicle_capacities is None:
+    vehicle_capacities = model["vehicle_capacities"]
+  new_model = Instance(coords=new_coords, distance_matrix=distance_matrix, neighbors=neighbors,
+                       demands=np.concatenate((old_demands[keep], added_demands)),
+                       vehicle_capacities=vehicle_capacities, num_vehicles=len(vehicle_capacities),
+                       depot=int(mapping[depot]))
+  return new_model, mapping
+
+
+def remap_routes(model, routes, mapping):
+  """
+  Renumbers the old routes for the new model, dropping removed locations, and gives every vehicle of the new
+  model a route. Stops of vehicles that no longer exist, and stops a vehicle no longer has room for
+  (the ones saving the most distance first), are taken out of the routes.
+  Returns (routes, displaced stops, indices of the routes that lost stops)
+  """
+  depot = model["depot"]
+  demands = np.asarray(model["demands"])
+  capacities = np.asarray(model["vehicle_capacities"])
+  distance_matrix = distance_array(model["distance_matrix"])
+  new_routes, displaced, changed = [], [], set()
+  for vehicle, route in enumerate(routes):
+    length = len(route)
+    route = [int(location) for location in mapping[np.asarray(route, dtype=np.int64)] if location >= 0]
+    if vehicle >= model["num_vehicles"]:
+      displaced += route[1:-1]
+      continue
+    load = int(demands[route].sum())
+    while load > capacities[vehicle]:
+      stops = np.asarray(route)
+      savings = (widen(distance_matrix[stops[:-2], stops[1:-1]]) + distance_matrix[stops[1:-1], stops[2:]]
+                 - distance_matrix[stops[:-2], stops[2:]])
+      k = int(np.argmax(savings)) + 1
+      displaced.append(route.pop(k))
+      load -= int(demands[displaced[-1]])
+    if len(route) < length:
+      changed.add(vehicle)
+    new_routes.append(route)
+  new_routes += [[depot, depot] for _ in range(model["num_vehicles"] - len(new_routes))]
+  return new_routes, displaced, changed
+
+
+def cheapest_insertion(model, routes, locations):
+  """
+  Inserts the locations, largest demand first, each where it adds the least distance among the routes
+  with room for it, scoring every position of every route at once.
+  Returns (routes, indices of the routes changed, locations no route had room for)
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  demands = np.asarray(model["demands"], dtype=np.int64)
+  capacities = np.asarray(model["vehicle_capacities"], dtype=np.int64)
+  routes = [list(route) for route in routes]
+  loads = np.array([demands[route].sum() for route in routes], dtype=np.int64)
+  touched, unserved = set(), []
+
+  for location in sorted(locations, key=lambda location: -demands[location]):
+    padded, lengths = pad_routes(routes)
+    before, after = padded[:, :-1], padded[:, 1:]
+    costs = (widen(distance_matrix[before, location]) + distance_matrix[location, after]
+             - distance_matrix[before, after]).astype(np.float64)
+    valid = (np.arange(padded.shape[1] - 1) < (lengths - 1)[:, None]) & \
+            (loads + demands[location] <= capacities)[:, None]
+    costs[~valid] = np.inf
+    r, k = np.unravel_index(int(np.argmin(costs)), costs.shape)
+    if not np.isfinite(costs[r, k]):
+      unserved.append(int(location))
+      continue
+    routes[r].insert(k + 1, int(location))
+    loads[r] += demands[location]
+    touched.add(int(r))
+  return routes, touched, unserved
+
+
+def repair(model, routes, touched, locations, time_limit):
+  """
+  Runs 2-opt on the touched routes and inter-route moves of the given locations within time_limit seconds
+  """
+  deadline = time.perf_counter() + time_limit
+  touched = sorted(touched)
+  improved, _ = two_opt_search(model, [routes[r] for r in touched], time_limit=time_limit)
+  for r, route in zip(touched, improved):
+    routes[r] = route
+  if not locations:
+    return routes
+  routes, _ = inter_route_search(model, routes, time_limit=max(0.0, deadline - time.perf_counter()),
+                                 locations=locations)
+  return routes
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model, minkowski_distance_matrix
+  from algorithms.registry import solve
+  model, coords = create_model(1000, 200, 50, [20] * 50, seed=0)
+  routes = solve("local_search", model, 1).routes
+  rng = np.random.default_rng(1)
+  reoptimize(model, routes, added_coords=rng.integers(0, 1000, size=(1, 2)), added_demands=[1])
+  for num_added, num_removed in [(1, 0), (0, 1), (5, 5), (20, 10)]:
+    removed = rng.choice(np.arange(1, 200), size=num_removed, replace=False)
+    changed = {int(location): 3 for location in rng.choice(np.arange(1, 200), size=3, replace=False)}
+    new_model, new_routes, stats = reoptimize(
+      model, routes, added_coords=rng.integers(0, 1000, size=(num_added, 2)), added_demands=[2] * num_added,
+      removed=removed, demands=changed)
+    served = sorted(location for route in new_routes for location in route[1:-1])
+    assert served == sorted(set(range(1, len(new_model["distance_matrix"]))) - set(stats["unserved"]))
+    assert all(np.asarray(new_model["demands"])[route].sum() <= capacity
+               for route, capacity in zip(new_routes, new_model["vehicle_capacities"]))
+    assert (new_model["distance_matrix"] == minkowski_distance_matrix(new_model["coords"])).all()
+    start = time.perf_counter()
+    scratch = solve("local_search", new_model, 1)
+    print('+{} -{} stops: {:.1f} ms (update {:.1f}, insert {:.1f}, repair {:.1f}), cost {} vs {} from scratch '
+          'in {:.0f} ms, unserved {}'.format(
+            num_added, num_removed, stats["elapsed"] * 1000, stats["update_time"] * 1000,
+            stats["insertion_time"] * 1000, stats["repair_time"] * 1000, stats["cost"], scratch.cost,
+            (time.perf_counter() - start) * 1000, stats["unserved"]))
@@ -0,0 +1,376 @@
+"""
+Kernels
+Route costs and 2-opt move scoring over whole arrays, shared by the heuristics and the benchmark.
+The move scans are compiled with numba when it is installed and fall back to NumPy otherwise
+"""
+
+import itertools
+import time
+import numpy as np
+from data.models import distance_array
+
+# the numba-compiled scan, built on first use since importing numba is slow (False if it is not installed)
+compiled_two_opt_move = None
+# the numba-compiled nearest neighbour construction, built like compiled_two_opt_move
+compiled_nearest_neighbor = None
+
+# tolerance for float distance matrices (e.g. the sqrt(2) test models)
+EPSILON = 1e-9
+
+
+def widen(distances):
+  """
+  Returns distances as int64 (or float64 for float matrices), so sums and differences of compact
+  unsigned distances cannot wrap around
+  """
+  return np.asarray(distances, dtype=np.result_type(distances.dtype, np.int64))
+
+
+def pad_routes(routes):
+  """
+  Returns the routes as one (routes, longest route) int64 array, each row padded with its last location,
+  and the length of every route
+  """
+  lengths = np.fromiter(map(len, routes), dtype=np.int64, count=len(routes))
+  total = int(lengths.sum())
+  if total == 0:
+    return np.zeros((len(routes), 0), dtype=np.int64), lengths
+  flat = np.fromiter(itertools.chain.from_iterable(routes), dtype=np.int64, count=total)
+  ends = np.cumsum(lengths)
+  rows = np.repeat(np.arange(len(routes)), lengths)
+  columns = np.arange(total) - np.repeat(ends - lengths, lengths)
+  # empty routes are padded with location 0 and masked out by their length anyway
+  last = np.where(lengths > 0, flat[np.maximum(ends - 1, 0)], 0)
+  padded = np.repeat(last[:, None], int(lengths.max()), axis=1)
+  padded[rows, columns] = flat
+  return padded, lengths
+
+
+def route_cost(route, distance_matrix):
+  """
+  Returns the length of a single route, summed in 64 bits
+  """
+  distance_matrix = distance_array(distance_matrix)
+  route = np.asarray(route)
+  dtype = np.result_type(distance_matrix.dtype, np.int64)
+  if len(route) < 2:
+    return dtype.type(0)
+  return distance_matrix[route[:-1], route[1:]].sum(dtype=dtype)
+
+
+def route_costs(routes, distance_matrix):
+  """
+  Returns the length of every route as an int64 (or float64) array, from a single gather of all their edges
+  """
+  distance_matrix = distance_array(distance_matrix)
+  padded, lengths = pad_routes(routes)
+  dtype = np.result_type(distance_matrix.dtype, np.int64)
+  if padded.shape[1] < 2:
+    return np.zeros(len(routes), dtype=dtype)
+  edges = distance_matrix[padded[:, :-1], padded[:, 1:]]
+  # padding edges are masked rather than relying on a zero diagonal
+  valid = np.arange(padded.shape[1] - 1) < (lengths - 1)[:, None]
+  return np.where(valid, edges, 0).sum(axis=1, dtype=dtype)
+
+
+def total_cost(routes, distance_matrix):
+  """
+  Returns the total length of the routes as a NumPy scalar
+  """
+  costs = route_costs(routes, distance_matrix)
+  return costs.sum(dtype=costs.dtype)
+
+
+def edge_total_cost(routes, distance_matrix):
+  """
+  Returns the total length of the routes as a NumPy scalar by looking up one edge at a time, which is cheaper
+  than padding the routes into an array when they have few stops. distance_matrix must be an array
+  """
+  total = np.result_type(distance_matrix.dtype, np.int64).type(0)
+  for route in routes:
+    for k in range(len(route) - 1):
+      total += distance_matrix[route[k], route[k + 1]]
+  return total
+
+
+def candidate_positions(route, neighbors, positions, i):
+  """
+  Returns the sorted positions j > i for which reversing route[i..j] creates an edge
+  from route[i-1] or route[i] to one of its nearest neighbours
+  """
+  js = np.concatenate((positions[neighbors[route[i - 1]]], positions[neighbors[route[i]]] - 1))
+  return np.unique(js[js > i])
+
+
+def move_deltas(distance_matrix, route, edges, i, js):
+  """
+  Returns the change in route length of reversing route[i..j] for every j in js
+  """
+  return (widen(distance_matrix[route[i - 1], route[js]]) + distance_matrix[route[i], route[js + 1]]
+          - edges[i - 1] - edges[js])
+
+
+def two_opt_move(distance_matrix, route, edges, start, strategy="first", neighbors=None, positions=None,
+                 deadline=None):
+  """
+  Scans the 2-opt moves reversing route[i..j] for i from start on and returns (i, j, delta, evaluated, finished).
+  "first" returns the first improving move, "best" the best one; i is -1 if no move improves the route.
+  With neighbors, only the candidate_positions of each i are scanned. finished is False if the deadline
+  passed during the scan, which only the NumPy scan checks: a compiled scan always finishes
+  """
+  scan = compiled_scan() if isinstance(distance_matrix, np.ndarray) else None
+  if scan is not None:
+    use_neighbors = neighbors is not None
+    if not use_neighbors:
+      neighbors, positions = NO_NEIGHBORS, NO_POSITIONS
+    i, j, evaluated = scan(distance_matrix, route, edges, start, strategy == "best", neighbors, positions,
+                           use_neighbors, EPSILON)
+    if i < 0:
+      return -1, -1, 0, evaluated, True
+    # the compiled scan compares float64 deltas; the applied delta is recomputed in the matrix dtype
+    return i, j, move_deltas(distance_matrix, route, edges, i, np.array([j]))[0], evaluated, True
+  return numpy_two_opt_move(distance_matrix, route, edges, start, strategy, neighbors, positions, deadline)
+
+
+def prepare_two_opt_move(distance_matrix, neighbors=None, positions=None):
+  """
+  Compiles the scan of two_opt_move for the array types of a search ahead of it (nothing to do once they are
+  compiled or without numba), so that the search's own timing does not include the compile time.
+  Returns the seconds spent
+  """
+  begin = time.perf_counter()
+  if isinstance(distance_matrix, np.ndarray) and compiled_scan() is not None:
+    # a route that stays at the depot scores every move at 0 and finds none
+    route = np.zeros(5, dtype=np.int64)
+    edges = widen(distance_matrix[route[:-1], route[1:]])
+    two_opt_move(distance_matrix, route, edges, 1, "first", neighbors, positions)
+  return time.perf_counter() - begin
+
+
+def numpy_two_opt_move(distance_matrix, route, edges, start, strategy="first", neighbors=None, positions=None,
+                       deadline=None):
+  """
+  two_opt_move scoring all moves of one i at a time with move_deltas
+  """
+  num_locations = len(route)
+  best_delta, best_move, evaluated = -EPSILON, (-1, -1), 0
+  for i in range(start, num_locations - 2):
+    if deadline is not None and time.perf_counter() > deadline:
+      return -1, -1, 0, evaluated, False
+    if neighbors is None:
+      js = np.arange(i + 1, num_locations - 1)
+    else:
+      js = candidate_positions(route, neighbors, positions, i)
+      if js.size == 0:
+        continue
+    deltas = move_deltas(distance_matrix, route, edges, i, js)
+    evaluated += len(js)
+
+    if strategy == "first":
+      improving = np.flatnonzero(deltas < -EPSILON)
+      if improving.size:
+        return i, int(js[improving[0]]), deltas[improving[0]], evaluated, True
+    else:
+      k = int(np.argmin(deltas))
+      if deltas[k] < best_delta:
+        best_delta, best_move = deltas[k], (i, int(js[k]))
+  if best_move[0] < 0:
+    return -1, -1, 0, evaluated, True
+  return best_move[0], best_move[1], best_delta, evaluated, True
+
+
+def scan_two_opt_moves(distance_matrix, route, edges, start, best, neighbors, positions, use_neighbors, epsilon):
+  """
+  The loop compiled by numba for two_opt_move: returns (i, j, moves evaluated), i is -1 if no move improves
+  """
+  num_locations = len(route)
+  best_delta, best_i, best_j, evaluated = -epsilon, -1, -1, 0
+  js = np.empty(2 * neighbors.shape[1] if use_neighbors else num_locations, dtype=np.int64)
+  for i in range(start, num_locations - 2):
+    count = 0
+    if use_neighbors:
+      for k in range(neighbors.shape[1]):
+        j = positions[neighbors[route[i - 1], k]]
+        if j > i:
+          js[count] = j
+          count += 1
+        j = positions[neighbors[route[i], k]] - 1
+        if j > i:
+          js[count] = j
+          count += 1
+      js[:count].sort()
+    else:
+      for j in range(i + 1, num_locations - 1):
+        js[count] = j
+        count += 1
+
+    a, b = route[i - 1], route[i]
+    previous = -1
+    for k in range(count):
+      j = js[k]
+      if j == previous:
+        continue
+      previous = j
+      evaluated += 1
+      delta = (float(distance_matrix[a, route[j]]) + float(distance_matrix[b, route[j + 1]])
+               - edges[i - 1] - edges[j])
+      if delta < best_delta:
+        best_delta, best_i, best_j = delta, i, j
+        if not best:
+          return best_i, best_j, evaluated
+  return best_i, best_j, evaluated
+
+
+# stand-ins for the neighbour arrays, so the compiled scan keeps a single signature per matrix dtype
+NO_NEIGHBORS = np.zeros((0, 0), dtype=np.int64)
+NO_POSITIONS = np.zeros(0, dtype=np.int64)
+
+
+def compiled_scan():
+  """
+  Returns scan_two_opt_moves compiled by numba, or None if numba is not installed
+  """
+  global compiled_two_opt_move
+  if compiled_two_opt_move is None:
+    try:
+      import numba
+      compiled_two_opt_move = numba.njit(cache=True, nogil=True)(scan_two_opt_moves)
+    except ImportError:
+      compiled_two_opt_move = False
+  return compiled_two_opt_move or None
+
+
+def build_nearest_neighbor(distance_matrix, demands, capacities, depot, num_vehicles, start_node, neighbors,
+                           use_neighbors):
+  """
+  The loop compiled by numba for nearest_neighbor: builds the routes vehicle by vehicle, moving to the nearest
+  unvisited location that fits (ties to the lowest index), the first vehicle to start_node first if it is not -1
+  and fits. With use_neighbors the k nearest candidates are tried first, as in next_locations.
+  Returns the visited locations in order and the end of each vehicle's stops in them
+  """
+  num_locations = distance_matrix.shape[0]
+  # the unvisited locations, a visited one is swapped out with the last so a scan only covers the rest
+  pool = np.empty(num_locations - 1, dtype=np.int64)
+  slot = np.full(num_locations, -1, dtype=np.int64)
+  unvisited = 0
+  for location in range(num_locations):
+    if location != depot:
+      pool[unvisited] = location
+      slot[location] = unvisited
+      unvisited += 1
+  smallest_demand = demands[pool[:unvisited]].min() if unvisited else 0
+  stops = np.empty(num_locations, dtype=np.int64)
+  route_ends = np.zeros(num_vehicles, dtype=np.int64)
+  count = 0
+  for vehicle in range(num_vehicles):
+    curr, remaining = depot, capacities[vehicle]
+    first = True
+    # a vehicle with less room than the smallest unvisited demand can stop without scanning
+    while unvisited > 0 and remaining >= smallest_demand:
+      nearest = -1
+      if vehicle == 0 and first and start_node >= 0 and demands[start_node] <= remaining:
+        nearest = start_node
+      else:
+        if use_neighbors:
+          last = neighbors[curr, neighbors.shape[1] - 1]
+          for k in range(neighbors.shape[1]):
+            candidate = neighbors[curr, k]
+            if slot[candidate] >= 0 and demands[candidate] <= remaining:
+              # a candidate tied with the farthest listed one may hide an equally close, lower indexed location
+              if distance_matrix[curr, candidate] < distance_matrix[curr, last]:
+                nearest = candidate
+              break
+        if nearest < 0:
+          best = np.inf
+          for k in range(unvisited):
+            location = pool[k]
+            if demands[location] <= remaining:
+              distance = distance_matrix[curr, location]
+              if distance < best or (distance == best and location < nearest):
+                best, nearest = distance, location
+      first = False
+      if nearest < 0:
+        break
+      stops[count] = nearest
+      count += 1
+      unvisited -= 1
+      moved = pool[unvisited]
+      pool[slot[nearest]] = moved
+      slot[moved] = slot[nearest]
+      slot[nearest] = -1
+      remaining -= demands[nearest]
+      curr = nearest
+      if demands[nearest] == smallest_demand and unvisited:
+        smallest_demand = demands[pool[:unvisited]].min()
+    route_ends[vehicle] = count
+  return stops[:count], route_ends
+
+
+def compiled_construction():
+  """
+  Returns build_nearest_neighbor compiled by numba, or None if numba is not installed
+  """
+  global compiled_nearest_neighbor
+  if compiled_nearest_neighbor is None:
+    try:
+      import numba
+      compiled_nearest_neighbor = numba.njit(cache=True, nogil=True)(build_nearest_neighbor)
+    except ImportError:
+      compiled_nearest_neighbor = False
+  return compiled_nearest_neighbor or None
+
+
+def loop_total_distance(routes, distance_matrix):
+  """
+  The original element-by-element route cost, kept for the micro-benchmark
+  """
+  total = 0
+  for route in routes:
+    for k in range(len(route) - 1):
+      total += int(distance_matrix[route[k], route[k + 1]])
+  return total
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.route_cost import calc_total_distance
+
+  def timed(function, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+      start = time.perf_counter()
+      result = function(*args)
+      best = min(best, time.perf_counter() - start)
+    return result, best
+
+  print('numba', 'installed' if compiled_scan() is not None else 'not installed')
+  for num_locations in (10, 100, 1000, 10000):
+    num_vehicles = max(1, num_locations // 10)
+    model, _ = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=0)
+    matrix = model["distance_matrix"]
+    rng = np.random.default_rng(0)
+    routes = [[0] + part.tolist() + [0] for part in np.array_split(rng.permutation(np.arange(1, num_locations)),
+                                                                    num_vehicles)]
+    loop, loop_time = timed(loop_total_distance, routes, matrix)
+    per_route, per_route_time = timed(lambda: sum(np.asarray(matrix)[np.asarray(r)[:-1], np.asarray(r)[1:]]
+                                                  .sum(dtype=np.int64) for r in routes))
+    padded, padded_time = timed(total_cost, routes, matrix)
+    chosen, chosen_time = timed(calc_total_distance, routes, matrix)
+    assert loop == per_route == padded == edge_total_cost(routes, matrix) == chosen
+    print('{:>5}L cost of {} routes: loop {:.2e}s, per-route gather {:.2e}s, padded {:.2e}s ({:.1f}x loop), '
+          'calc_total_distance {:.2e}s ({:.1f}x loop)'.format(num_locations, num_vehicles, loop_time, per_route_time,
+                                                              padded_time, loop_time / padded_time, chosen_time,
+                                                              loop_time / chosen_time))
+
+    route = np.array([0] + rng.permutation(np.arange(1, num_locations)).tolist() + [0])
+    edges = widen(matrix[route[:-1], route[1:]])
+    (numpy_move, numpy_time) = timed(numpy_two_opt_move, matrix, route, edges, 1, "best")
+    line = '{:>5}L best move over a full route: numpy {:.2e}s ({:.0f} moves/s)'.format(
+      num_locations, numpy_time, numpy_move[3] / numpy_time)
+    if compiled_scan() is not None:
+      two_opt_move(matrix, route, edges, 1, "best")
+      compiled_move, compiled_time = timed(two_opt_move, matrix, route, edges, 1, "best")
+      assert compiled_move[:2] == numpy_move[:2] and compiled_move[2] == numpy_move[2]
+      line += ', compiled {:.2e}s ({:.0f}x)'.format(compiled_time, numpy_time / compiled_time)
+    print(line)
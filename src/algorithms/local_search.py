@@ -0,0 +1,268 @@
+"""
+Inter-Route Local Search
+Capacity-aware relocate, swap, 2-opt* and cross-exchange moves between the routes of a solution
+"""
+
+import itertools
+import time
+import numpy as np
+from data.models import DistanceOracle
+from algorithms.two_opt import EPSILON, record_improvement, out_of_budget
+from instrumentation import count
+
+OPERATORS = ("relocate", "swap", "two_opt_star", "cross")
+
+# up to this many locations the distance matrix is copied to nested lists, which Python indexes fastest
+LIST_MAX_LOCATIONS = 2000
+
+
+class RouteCache:
+  """
+  The routes being improved with, per route, the load of every prefix and the total length,
+  and the route and position of every location, so that moves can be scored in O(1)
+  """
+
+  def __init__(self, routes, distance, demands, num_locations):
+    self.distance = distance
+    self.demands = demands
+    self.routes = [[int(location) for location in route] for route in routes]
+    self.route_of = [-1] * num_locations
+    self.position = [0] * num_locations
+    self.prefix = [None] * len(routes)
+    self.lengths = [0] * len(routes)
+    for r in range(len(routes)):
+      self.refresh(r)
+
+  def refresh(self, r):
+    """
+    Recomputes the cached values of route r after it changed
+    """
+    route = self.routes[r]
+    self.prefix[r] = list(itertools.accumulate(self.demands[location] for location in route))
+    self.lengths[r] = sum(self.distance(a, b) for a, b in zip(route, route[1:]))
+    for k in range(1, len(route) - 1):
+      self.route_of[route[k]] = r
+      self.position[route[k]] = k
+
+  def load(self, r):
+    return self.prefix[r][-1]
+
+  def total(self):
+    return sum(self.lengths)
+
+
+def inter_route_search(model, routes, operators=OPERATORS, max_iterations=None, time_limit=None, use_neighbors=True,
+                       segment_length=3, locations=None):
+  """
+  First-improvement local search over moves between two routes:
+  relocate (move a location next to a location of another route), swap (exchange two locations),
+  two_opt_star (exchange the route tails after two locations) and cross (exchange segments of up to
+  segment_length locations). Only moves that keep both routes within their vehicle capacity are applied.
+  With a neighbour index and use_neighbors set, only moves creating an edge between a location and one of
+  its nearest neighbours are tried. Routes keep their vehicle; the order within a route is left to two_opt.
+  Stops at a local optimum, after max_iterations improving moves, or after time_limit seconds.
+  locations limits the search to moves of the given locations (default all of them).
+  Returns the new routes and a stats dict in the format of two_opt_search, with the improving moves
+  applied per operator in stats["moves"]
+  """
+  for operator in operators:
+    if operator not in MOVES:
+      raise ValueError("unknown inter-route operator: " + str(operator))
+
+  num_locations = len(model["distance_matrix"])
+  distance = scalar_distance(model["distance_matrix"])
+  demands = np.asarray(model["demands"][:num_locations]).tolist()
+  capacities = np.asarray(model["vehicle_capacities"]).tolist()
+  cache = RouteCache(routes, distance, demands, num_locations)
+  depot = model["depot"]
+  if use_neighbors and "neighbors" in model:
+    candidates = np.asarray(model["neighbors"]).tolist()
+  else:
+    candidates = [list(range(num_locations))] * num_locations
+
+  start = time.perf_counter()
+  deadline = start + time_limit if time_limit is not None else None
+  stats = {"moves_evaluated": 0, "improvements": 0, "local_optimum": True, "started": start,
+           "cost": cache.total(), "moves": {operator: 0 for operator in operators}}
+  stats["trace"] = [(0.0, stats["cost"])]
+  moves = [(operator, MOVES[operator]) for operator in operators]
+  locations = range(num_locations) if locations is None else [int(location) for location in locations]
+
+  improved = True
+  while improved and not out_of_budget(stats["improvements"], max_iterations, deadline, stats):
+    improved = False
+    for u in locations:
+      if u == depot or cache.route_of[u] < 0:
+        continue
+      if out_of_budget(stats["improvements"], max_iterations, deadline, stats):
+        break
+      if improve_location(cache, capacities, u, candidates[u], moves, depot, stats, segment_length):
+        improved = True
+
+  del stats["started"], stats["cost"]
+  stats["elapsed"] = time.perf_counter() - start
+  stats["moves_per_second"] = stats["moves_evaluated"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+  count("moves_evaluated", stats["moves_evaluated"])
+  count("improving_moves", stats["improvements"])
+  return cache.routes, stats
+
+
+def improve_location(cache, capacities, u, candidates, moves, depot, stats, segment_length):
+  """
+  Applies the first improving move between u and a candidate location on another route.
+  Returns True if a move was applied
+  """
+  for v in candidates:
+    if v == depot or cache.route_of[v] < 0 or cache.route_of[v] == cache.route_of[u]:
+      continue
+    for operator, move in moves:
+      found = move(cache, capacities, u, v, stats, segment_length)
+      if found is None:
+        continue
+      delta, new_u_route, new_v_route = found
+      ru, rv = cache.route_of[u], cache.route_of[v]
+      cache.routes[ru], cache.routes[rv] = new_u_route, new_v_route
+      cache.refresh(ru)
+      cache.refresh(rv)
+      stats["moves"][operator] += 1
+      record_improvement(stats, delta)
+      return True
+  return False
+
+
+def scalar_distance(matrix):
+  """
+  Returns a function giving the distance between two locations as a Python number
+  """
+  if isinstance(matrix, DistanceOracle):
+    return matrix.distance
+  matrix = np.asarray(matrix)
+  if len(matrix) <= LIST_MAX_LOCATIONS:
+    rows = matrix.tolist()
+    return lambda a, b: rows[a][b]
+  return lambda a, b: matrix[a, b].item()
+
+
+def relocate(cache, capacities, u, v, stats, segment_length):
+  """
+  Moves u from its route to just before or just after v
+  """
+  ru, i = cache.route_of[u], cache.position[u]
+  rv, j = cache.route_of[v], cache.position[v]
+  if cache.load(rv) + cache.demands[u] > capacities[rv]:
+    return None
+  d = cache.distance
+  route_u, route_v = cache.routes[ru], cache.routes[rv]
+  p, n = route_u[i - 1], route_u[i + 1]
+  removal = d(p, n) - d(p, u) - d(u, n)
+  vp, vn = route_v[j - 1], route_v[j + 1]
+  after = removal + d(v, u) + d(u, vn) - d(v, vn)
+  before = removal + d(vp, u) + d(u, v) - d(vp, v)
+  stats["moves_evaluated"] += 2
+  if min(after, before) >= -EPSILON:
+    return None
+  insert_at = j + 1 if after <= before else j
+  return min(after, before), route_u[:i] + route_u[i + 1:], route_v[:insert_at] + [u] + route_v[insert_at:]
+
+
+def swap(cache, capacities, u, v, stats, segment_length):
+  """
+  Exchanges u and v between their routes
+  """
+  ru, i = cache.route_of[u], cache.position[u]
+  rv, j = cache.route_of[v], cache.position[v]
+  demand_change = cache.demands[v] - cache.demands[u]
+  if cache.load(ru) + demand_change > capacities[ru] or cache.load(rv) - demand_change > capacities[rv]:
+    return None
+  d = cache.distance
+  route_u, route_v = cache.routes[ru], cache.routes[rv]
+  p, n = route_u[i - 1], route_u[i + 1]
+  vp, vn = route_v[j - 1], route_v[j + 1]
+  delta = d(p, v) + d(v, n) - d(p, u) - d(u, n) + d(vp, u) + d(u, vn) - d(vp, v) - d(v, vn)
+  stats["moves_evaluated"] += 1
+  if delta >= -EPSILON:
+    return None
+  return delta, route_u[:i] + [v] + route_u[i + 1:], route_v[:j] + [u] + route_v[j + 1:]
+
+
+def two_opt_star(cache, capacities, u, v, stats, segment_length):
+  """
+  Reconnects u to v: u's route continues with v and the rest of its route,
+  v's predecessor continues with the rest of u's route
+  """
+  ru, i = cache.route_of[u], cache.position[u]
+  rv, j = cache.route_of[v], cache.position[v]
+  prefix_u, prefix_v = cache.prefix[ru], cache.prefix[rv]
+  if prefix_u[i] + cache.load(rv) - prefix_v[j - 1] > capacities[ru] or \
+     prefix_v[j - 1] + cache.load(ru) - prefix_u[i] > capacities[rv]:
+    return None
+  d = cache.distance
+  route_u, route_v = cache.routes[ru], cache.routes[rv]
+  n, vp = route_u[i + 1], route_v[j - 1]
+  delta = d(u, v) + d(vp, n) - d(u, n) - d(vp, v)
+  stats["moves_evaluated"] += 1
+  if delta >= -EPSILON:
+    return None
+  return delta, route_u[:i + 1] + route_v[j:], route_v[:j] + route_u[i + 1:]
+
+
+def cross(cache, capacities, u, v, stats, segment_length):
+  """
+  Exchanges the segment of up to segment_length locations after u with the segment of up to
+  segment_length locations starting at v, keeping their orientation, so u is followed by v
+  """
+  ru, i = cache.route_of[u], cache.position[u]
+  rv, j = cache.route_of[v], cache.position[v]
+  route_u, route_v = cache.routes[ru], cache.routes[rv]
+  prefix_u, prefix_v = cache.prefix[ru], cache.prefix[rv]
+  load_u, load_v = cache.load(ru), cache.load(rv)
+  d = cache.distance
+  vp = route_v[j - 1]
+  # the edges into both segments are the same for every length
+  base = d(u, v) + d(vp, route_u[i + 1]) - d(u, route_u[i + 1]) - d(vp, v)
+  best = None
+
+  for a in range(1, min(segment_length, len(route_u) - 2 - i) + 1):
+    segment_u_load = prefix_u[i + a] - prefix_u[i]
+    for b in range(1, min(segment_length, len(route_v) - 1 - j) + 1):
+      segment_v_load = prefix_v[j + b - 1] - prefix_v[j - 1]
+      if load_u - segment_u_load + segment_v_load > capacities[ru] or \
+         load_v - segment_v_load + segment_u_load > capacities[rv]:
+        continue
+      end_u, after_u = route_u[i + a], route_u[i + a + 1]
+      end_v, after_v = route_v[j + b - 1], route_v[j + b]
+      delta = base + d(end_v, after_u) + d(end_u, after_v) - d(end_u, after_u) - d(end_v, after_v)
+      stats["moves_evaluated"] += 1
+      if delta < -EPSILON and (best is None or delta < best[0]):
+        best = (delta, a, b)
+
+  if best is None:
+    return None
+  delta, a, b = best
+  return (delta, route_u[:i + 1] + route_v[j:j + b] + route_u[i + 1 + a:],
+          route_v[:j] + route_u[i + 1:i + 1 + a] + route_v[j + b:])
+
+
+MOVES = {"relocate": relocate, "swap": swap, "two_opt_star": two_opt_star, "cross": cross}
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.nearest_neighbor import nearest_neighbor
+  from algorithms.route_cost import calc_total_distance
+  from algorithms.two_opt import two_opt_search
+  for num_locations, num_vehicles in [(100, 25), (200, 50), (200, 150)]:
+    model, _ = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=0)
+    routes = nearest_neighbor(model)
+    intra, _ = two_opt_search(model, routes)
+    inter, stats = inter_route_search(model, intra, time_limit=1)
+    final, _ = two_opt_search(model, inter)
+    load_ok = all(sum(model["demands"][location] for location in route) <= capacity
+                  for route, capacity in zip(final, model["vehicle_capacities"]))
+    served = sorted(location for route in final for location in route[1:-1])
+    assert load_ok and served == sorted(location for route in routes for location in route[1:-1])
+    print('{}L, {}V: nn {} -> 2-opt {} -> inter-route {} ({:.3f}s, {} moves {}, {:.0f} evaluations/s)'.format(
+      num_locations, num_vehicles, calc_total_distance(routes, model["distance_matrix"]),
+      calc_total_distance(intra, model["distance_matrix"]), calc_total_distance(final, model["distance_matrix"]),
+      stats["elapsed"], stats["improvements"], stats["moves"], stats["moves_per_second"]))
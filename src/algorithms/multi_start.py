@@ -0,0 +1,277 @@
+"""
+Multi-Start
+Builds a population of starting solutions as one array of giant tours, scores them all at once
+and improves the best few
+"""
+
+import math
+import time
+import numpy as np
+from data.models import distance_array
+from algorithms.nearest_neighbor import nearest_neighbor
+from algorithms.route_cost import calc_total_distance
+from runner import run_jobs
+from instrumentation import phase, count
+
+SOURCES = ("nn", "random", "sweep")
+
+
+def multi_start(model, time_limit=1, population=64, num_improve=4, improve="local_search", sources=SOURCES,
+                noise=0.3, workers=1, seed=0, coords=None):
+  """
+  Builds population giant tours (orders of all non-depot locations) shared between the sources:
+  "nn" nearest neighbour tours with each step's distances scaled by up to 1 + noise (the first one is the
+  plain capacity-aware nearest_neighbor solution), "random" shuffles and "sweep" angular orders around the
+  depot from random start angles, which need coords (default model["coords"]).
+  Every tour is cut into vehicle routes by split_tours and scored in one pass; the num_improve best are
+  improved with the registered improve solver on workers processes, sharing what is left of time_limit
+  (starting the worker processes takes a few seconds on top, so workers pay off for long budgets).
+  Returns (routes, stats) with the best solution; stats["distribution"] summarizes the costs of the
+  population before ("start") and of the improved candidates after ("improved") improvement
+  """
+  start = time.perf_counter()
+  rng = np.random.default_rng(seed)
+  if coords is None and "coords" in model:
+    coords = model["coords"]
+  if coords is None:
+    sources = [source for source in sources if source != "sweep"]
+  if not sources:
+    raise ValueError("multi-start needs at least one source of starting solutions")
+
+  counts = [len(part) for part in np.array_split(np.arange(population), len(sources))]
+  tours, labels = [], []
+  with phase("first solution"):
+    for source, size in zip(sources, counts):
+      if size == 0:
+        continue
+      if source == "nn":
+        tours.append(noisy_nearest_neighbor_tours(model, size, noise, rng))
+      elif source == "random":
+        tours.append(random_tours(model, size, rng))
+      elif source == "sweep":
+        tours.append(sweep_tours(model, np.asarray(coords), size, rng))
+      else:
+        raise ValueError("unknown multi-start source: " + str(source))
+      labels += [source] * size
+    tours = np.concatenate(tours)
+
+    visits, route_ids, unserved = split_tours(model, tours)
+    costs = score_tours(model, visits, route_ids)
+  count("starting_solutions", len(tours))
+  # fewest unserved locations first, then the shortest
+  ranking = np.lexsort((costs, unserved))
+  stats = {"population": len(tours), "sources": dict(zip(sources, counts)),
+           "distribution": {"start": quality_distribution(costs[unserved == 0])}}
+  stats["trace"] = [(time.perf_counter() - start, costs[ranking[0]].item())]
+
+  candidates = ranking[:num_improve]
+  remaining = time_limit - (time.perf_counter() - start) if time_limit is not None else None
+  rounds = math.ceil(len(candidates) / max(1, workers))
+  candidate_time_limit = max(0.0, remaining) / rounds if remaining is not None else None
+  jobs = [{"model": model, "routes": tour_routes(model, visits[k], route_ids[k]), "improve": improve,
+           "time_limit": candidate_time_limit} for k in candidates]
+  with phase("improvement"):
+    results = run_jobs(improve_candidate, jobs, workers)
+
+  improved_costs = np.array([result["cost"] for result in results])
+  # the improvement may serve locations the split left out, count them again on the improved routes
+  num_customers = len(model["distance_matrix"]) - 1
+  improved_unserved = np.array([num_customers - len({stop for route in result["routes"] for stop in route[1:-1]})
+                                for result in results])
+  # the same order as the starts: fewest unserved locations first, then the shortest
+  best = int(np.lexsort((improved_costs, improved_unserved))[0])
+  routes = results[best]["routes"]
+  stats["unserved"] = int(improved_unserved[best])
+  stats["best_source"] = labels[candidates[best]]
+  stats["distribution"]["improved"] = quality_distribution(improved_costs)
+  if improved_costs[best] < stats["trace"][-1][1]:
+    stats["trace"].append((time.perf_counter() - start, improved_costs[best].item()))
+  return routes, stats
+
+
+def improve_candidate(job):
+  """
+  Improves one starting solution with a registered solver, keeping it if the solver finds nothing.
+  Run by run_jobs
+  """
+  from algorithms.registry import solve
+  result = solve(job["improve"], job["model"], job["time_limit"], initial_routes=job["routes"])
+  if result.routes is None:
+    return {"routes": job["routes"], "cost": calc_total_distance(job["routes"], job["model"]["distance_matrix"])}
+  return {"routes": result.routes, "cost": result.cost}
+
+
+def random_tours(model, count, rng):
+  """
+  Returns count random orders of the non-depot locations as a (count, locations - 1) array
+  """
+  customers = customer_locations(model)
+  return rng.permuted(np.tile(customers, (count, 1)), axis=1)
+
+
+def sweep_tours(model, coords, count, rng):
+  """
+  Returns count orders of the non-depot locations by angle around the depot, each starting at a random
+  angle and half of them sweeping clockwise
+  """
+  customers = customer_locations(model)
+  offsets = coords[customers].astype(np.float64) - coords[model["depot"]]
+  angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+  starts = rng.uniform(0, 2 * np.pi, size=(count, 1))
+  directions = np.where(np.arange(count) % 2 == 0, 1.0, -1.0)[:, None]
+  return customers[np.argsort(np.mod(directions * angles[None, :] - starts, 2 * np.pi), axis=1)]
+
+
+def noisy_nearest_neighbor_tours(model, count, noise, rng):
+  """
+  Returns count nearest neighbour tours through all non-depot locations, ignoring capacity.
+  All tours advance in lock-step, each step scaling the distances from the current locations by random
+  factors in [1, 1 + noise]. The first tour is the order of the capacity-aware nearest_neighbor routes
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  num_locations = len(distance_matrix)
+  depot = model["depot"]
+  tours = np.empty((count, num_locations - 1), dtype=np.int64)
+  first = [location for route in nearest_neighbor(model) for location in route[1:-1]]
+  # locations nearest_neighbor could not place go at the end of its tour
+  visited = np.zeros(num_locations, dtype=bool)
+  visited[first] = True
+  visited[depot] = True
+  tours[0] = first + np.flatnonzero(~visited).tolist()
+  if count == 1:
+    return tours
+
+  rows = np.arange(count - 1)
+  visited_penalty = np.zeros((count - 1, num_locations))
+  visited_penalty[:, depot] = np.inf
+  curr = np.full(count - 1, depot)
+  for step in range(num_locations - 1):
+    scale = 1 + noise * rng.random((count - 1, num_locations))
+    nearest = (distance_matrix[curr] * scale + visited_penalty).argmin(axis=1)
+    tours[1:, step] = nearest
+    visited_penalty[rows, nearest] = np.inf
+    curr = nearest
+  return tours
+
+
+def customer_locations(model):
+  """
+  Returns the non-depot locations
+  """
+  return np.delete(np.arange(len(model["distance_matrix"])), model["depot"])
+
+
+def split_tours(model, tours):
+  """
+  Cuts every giant tour into vehicle routes: each vehicle in turn takes the first location of the tour it has
+  not visited that still fits, until none fits. All tours advance in lock-step.
+  Returns (visits, route_ids, unserved): the locations of every tour in visiting order, the vehicle of each
+  (num_vehicles for locations no vehicle could take) and the number of such unserved locations per tour
+  """
+  num_vehicles = model["num_vehicles"]
+  num_tours, length = tours.shape
+  demands = np.asarray(model["demands"])[tours].astype(np.int64)
+  capacities = np.append(np.asarray(model["vehicle_capacities"], dtype=np.int64), 0)
+  rows = np.arange(num_tours)
+
+  step_of = np.full((num_tours, length), np.iinfo(np.int64).max)
+  route_of = np.full((num_tours, length), num_vehicles)
+  taken = np.zeros((num_tours, length), dtype=bool)
+  vehicle = np.zeros(num_tours, dtype=np.int64)
+  remaining = np.full(num_tours, capacities[0])
+  served = np.zeros(num_tours, dtype=np.int64)
+  active = np.full(num_tours, num_vehicles > 0)
+
+  step = 0
+  while active.any():
+    fits = ~taken & (demands <= remaining[:, None])
+    position = fits.argmax(axis=1)
+    take = active & fits[rows, position]
+    moved, at = rows[take], position[take]
+    taken[moved, at] = True
+    step_of[moved, at] = step
+    route_of[moved, at] = vehicle[moved]
+    remaining[moved] -= demands[moved, at]
+    served[moved] += 1
+
+    # a vehicle that can take nothing more returns to the depot and the next one starts
+    closed = active & ~take
+    vehicle[closed] += 1
+    remaining[closed] = capacities[vehicle[closed]]
+    active &= (vehicle < num_vehicles) & (served < length)
+    step += 1
+
+  order = np.argsort(step_of, axis=1, kind="stable")
+  return (np.take_along_axis(tours, order, axis=1), np.take_along_axis(route_of, order, axis=1),
+          length - served)
+
+
+def score_tours(model, visits, route_ids):
+  """
+  Returns the total route length of every split tour with one gather over the whole population.
+  Consecutive served locations on the same vehicle are joined directly, the others through the depot
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  depot = model["depot"]
+  served = route_ids < model["num_vehicles"]
+  dtype = np.result_type(distance_matrix.dtype, np.int64)
+  edge = np.ones((len(visits), 1), dtype=bool)
+  changes = route_ids[:, 1:] != route_ids[:, :-1]
+
+  # leaving the depot before the first location of every route and returning after the last one
+  first = served & np.concatenate((edge, changes), axis=1)
+  last = served & np.concatenate((changes, edge), axis=1)
+  same = served[:, 1:] & ~changes
+  return (np.where(first, distance_matrix[depot, visits], 0).sum(axis=1, dtype=dtype)
+          + np.where(last, distance_matrix[visits, depot], 0).sum(axis=1, dtype=dtype)
+          + np.where(same, distance_matrix[visits[:, :-1], visits[:, 1:]], 0).sum(axis=1, dtype=dtype))
+
+
+def tour_routes(model, visits, route_ids):
+  """
+  Returns the routes of one split tour, one per vehicle with the depot at both ends
+  """
+  depot = model["depot"]
+  routes = [[depot] for _ in range(model["num_vehicles"])]
+  for location, vehicle in zip(visits.tolist(), route_ids.tolist()):
+    if vehicle < len(routes):
+      routes[vehicle].append(location)
+  for route in routes:
+    route.append(depot)
+  return routes
+
+
+def quality_distribution(costs):
+  """
+  Returns the count, best, quartiles, mean, worst and standard deviation of a set of solution costs
+  """
+  costs = np.asarray(costs, dtype=np.float64)
+  if costs.size == 0:
+    return {"count": 0}
+  q1, median, q3 = np.percentile(costs, [25, 50, 75])
+  return {"count": int(costs.size), "best": costs.min().item(), "q1": q1.item(), "median": median.item(),
+          "q3": q3.item(), "mean": costs.mean().item(), "worst": costs.max().item(), "std": costs.std().item()}
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.registry import solve
+  for num_locations, fleet_ratio in [(100, 0.25), (200, 0.25), (200, 0.15)]:
+    num_vehicles = int(num_locations * fleet_ratio)
+    model, _ = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=1)
+    begin = time.perf_counter()
+    visits, route_ids, unserved = split_tours(model, random_tours(model, 256, np.random.default_rng(0)))
+    costs = score_tours(model, visits, route_ids)
+    k = int(np.argmin(costs))
+    assert costs[k] == calc_total_distance(tour_routes(model, visits[k], route_ids[k]), model["distance_matrix"])
+    print('{}L, {}V: split and scored 256 tours in {:.3f}s'.format(num_locations, num_vehicles,
+                                                                    time.perf_counter() - begin))
+    single = solve("two_opt", model, time_limit=1)
+    routes, stats = multi_start(model, time_limit=1)
+    served = sorted(location for route in routes for location in route[1:-1])
+    assert len(routes) == num_vehicles and len(served) == len(set(served))
+    assert len(served) == num_locations - 1 - stats["unserved"]
+    print('  two_opt {} vs multi_start {} (best from {}, unserved {}); start median {:.0f}, improved {}'.format(
+      single.cost, calc_total_distance(routes, model["distance_matrix"]), stats["best_source"], stats["unserved"],
+      stats["distribution"]["start"].get("median", float("nan")), stats["distribution"]["improved"]))
@@ -3,8 +3,211 @@ Nearest Neighbor Algorithm
 """
 
 import numpy as np
+from data.models import distance_array
+from algorithms.kernels import compiled_construction, NO_NEIGHBORS
 
-def nearest_neighbor(model):
+# below this many locations a full masked row scan is cheaper than checking the neighbour index first
+CANDIDATE_MIN_LOCATIONS = 1000
+# below this many locations the NumPy loop runs in about a millisecond, less than importing numba would cost
+# a cold `cli.py solve --algo nn` (see check_startup.py), so the compiled construction is only used from here on
+COMPILED_MIN_LOCATIONS = 200
+
+def nearest_neighbor(model, start_node=None):
+  """
+  Builds the routes vehicle by vehicle, always moving to the nearest unvisited location
+  that still fits in the vehicle. Ties go to the lowest location index.
+  If start_node is given the first vehicle visits it first, when it fits; the depot as start_node is ignored,
+  as in nearest_neighbor_batch. From COMPILED_MIN_LOCATIONS on the construction runs compiled by numba when
+  it is installed, otherwise numpy_nearest_neighbor builds the same routes
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  num_locations = len(distance_matrix)
+  demands = np.asarray(model["demands"][:num_locations])
+  build = None
+  if num_locations >= COMPILED_MIN_LOCATIONS and isinstance(distance_matrix, np.ndarray) and demands.dtype.kind in "iu":
+    build = compiled_construction()
+  if build is None:
+    return numpy_nearest_neighbor(model, start_node)
+
+  depot_index = model["depot"]
+  neighbors = model["neighbors"] if "neighbors" in model and num_locations >= CANDIDATE_MIN_LOCATIONS else None
+  stops, route_ends = build(distance_matrix, demands.astype(np.int64),
+                            np.asarray(model["vehicle_capacities"], dtype=np.int64), depot_index, model["num_vehicles"],
+                            -1 if start_node is None or start_node == depot_index else start_node,
+                            NO_NEIGHBORS if neighbors is None else neighbors, neighbors is not None)
+  # plain list slices are cheaper than an array slice and tolist per route
+  stops, route_ends = stops.tolist(), route_ends.tolist()
+  return [[depot_index] + stops[begin:end] + [depot_index] for begin, end in zip([0] + route_ends[:-1], route_ends)]
+
+
+def numpy_nearest_neighbor(model, start_node=None):
+  """
+  The NumPy construction of nearest_neighbor, one masked argmin over the current distance row per step
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  num_locations = len(distance_matrix)
+  demands = np.asarray(model["demands"][:num_locations])
+  vehicle_capacities = model["vehicle_capacities"]
+  depot_index = model["depot"]
+  neighbors = model["neighbors"] if "neighbors" in model and num_locations >= CANDIDATE_MIN_LOCATIONS else None
+  if start_node == depot_index:
+    start_node = None
+
+  # +inf marks a visited location so the masked row is a single addition
+  visited_penalty = np.zeros(num_locations)
+  visited_penalty[depot_index] = np.inf
+  unvisited = num_locations - 1
+  # a vehicle with less room than the smallest unvisited demand can stop without scanning
+  smallest_demand = (demands + visited_penalty).min()
+  routes = []
+
+  for vehicle in range(model["num_vehicles"]):
+    curr_location = depot_index
+    remaining = vehicle_capacities[vehicle]
+    route = [depot_index]
+
+    while unvisited and remaining >= smallest_demand:
+      if vehicle == 0 and start_node is not None and len(route) == 1 and demands[start_node] <= remaining:
+        nearest = start_node
+      elif neighbors is not None:
+        nearest = int(next_locations(distance_matrix, demands, neighbors, visited_penalty[None],
+                                     np.array([curr_location]), np.array([remaining]))[0])
+      else:
+        # feasibility and argmin in one masked pass over the current row
+        masked = distance_matrix[curr_location] + visited_penalty
+        masked[demands > remaining] = np.inf
+        nearest = int(masked.argmin())
+        if masked[nearest] == np.inf:
+          nearest = -1
+      if nearest < 0:
+        break
+
+      route.append(nearest)
+      visited_penalty[nearest] = np.inf
+      unvisited -= 1
+      remaining -= demands[nearest]
+      curr_location = nearest
+      if demands[nearest] == smallest_demand:
+        smallest_demand = (demands + visited_penalty).min()
+
+    route.append(depot_index)
+    routes.append(route)
+
+  return routes
+
+
+def nearest_neighbor_batch(model, depots=None, start_nodes=None):
+  """
+  Builds one nearest neighbour solution per entry of depots and/or start_nodes at once.
+  depots defaults to the model depot; start_nodes (-1 for none) is the first location the first vehicle visits.
+  All solutions advance in lock-step: each step picks the next location of every unfinished solution
+  with one masked argmin over the current distance rows, combining visited, capacity and distance.
+  Returns a list of route lists, one per solution
+  """
+  distance_matrix = distance_array(model["distance_matrix"])
+  num_locations = len(distance_matrix)
+  num_vehicles = model["num_vehicles"]
+  demands = np.asarray(model["demands"][:num_locations])
+  capacities = np.asarray(model["vehicle_capacities"])
+  neighbors = model["neighbors"] if "neighbors" in model and num_locations >= CANDIDATE_MIN_LOCATIONS else None
+
+  batch_size = max(len(x) for x in (depots, start_nodes, [None]) if x is not None)
+  depots = np.broadcast_to(model["depot"] if depots is None else np.asarray(depots), batch_size).astype(np.int64)
+  pending_start = np.broadcast_to(-1 if start_nodes is None else np.asarray(start_nodes), batch_size).astype(np.int64)
+  pending_start = np.where(pending_start == depots, -1, pending_start)
+
+  solutions = np.arange(batch_size)
+  # +inf marks a visited location so masked rows can be built with one addition
+  visited_penalty = np.zeros((batch_size, num_locations))
+  visited_penalty[solutions, depots] = np.inf
+  unvisited = np.full(batch_size, num_locations - 1)
+  vehicle = np.zeros(batch_size, dtype=np.int64)
+  load = np.zeros(batch_size, dtype=demands.dtype)
+  curr = depots.copy()
+  routes = [[] for _ in range(batch_size)]
+  current_route = [[int(depot)] for depot in depots]
+  active = np.full(batch_size, num_vehicles > 0)
+
+  while active.any():
+    idx = np.flatnonzero(active & (unvisited > 0))
+    nearest = np.full(len(idx), -1)
+    if len(idx):
+      remaining = capacities[vehicle[idx]] - load[idx]
+      nearest = next_locations(distance_matrix, demands, neighbors, visited_penalty[idx], curr[idx], remaining)
+
+      # forced first stops of the first vehicle, when they fit
+      forced = pending_start[idx]
+      use_forced = (forced >= 0) & (vehicle[idx] == 0)
+      use_forced[use_forced] &= demands[forced[use_forced]] <= remaining[use_forced]
+      nearest = np.where(use_forced, forced, nearest)
+      pending_start[idx[forced >= 0]] = -1
+
+    found = nearest >= 0
+    for solution, location in zip(idx[found], nearest[found]):
+      current_route[solution].append(int(location))
+    moved, moved_to = idx[found], nearest[found]
+    visited_penalty[moved, moved_to] = np.inf
+    load[moved] += demands[moved_to]
+    curr[moved] = moved_to
+    unvisited[moved] -= 1
+
+    # close the route of every solution that found nothing (or has nothing left) and start the next vehicle
+    stuck = np.ones(batch_size, dtype=bool)
+    stuck[moved] = False
+    for solution in np.flatnonzero(stuck & active):
+      depot = int(depots[solution])
+      current_route[solution].append(depot)
+      routes[solution].append(current_route[solution])
+      vehicle[solution] += 1
+      if vehicle[solution] == num_vehicles:
+        active[solution] = False
+      elif unvisited[solution] == 0:
+        # every location is served, the remaining vehicles stay at the depot
+        routes[solution].extend([depot, depot] for _ in range(num_vehicles - vehicle[solution]))
+        vehicle[solution] = num_vehicles
+        active[solution] = False
+      else:
+        current_route[solution] = [depot]
+        curr[solution] = depot
+        load[solution] = 0
+
+  return routes
+
+
+def next_locations(distance_matrix, demands, neighbors, visited_penalty, curr, remaining):
+  """
+  Returns the nearest feasible location for each row (-1 if there is none).
+  With a neighbour index the candidates are tried first, and only rows whose candidates
+  are all visited or over capacity fall back to the masked scan of the full row
+  """
+  nearest = np.full(len(curr), -1)
+  todo = np.arange(len(curr))
+
+  if neighbors is not None:
+    candidates = neighbors[curr].astype(np.int64)
+    rows = np.arange(len(curr))[:, None]
+    ok = np.isfinite(visited_penalty[rows, candidates]) & (demands[candidates] <= remaining[:, None])
+    first = ok.argmax(axis=1)
+    chosen = candidates[rows[:, 0], first]
+    # a candidate tied with the farthest listed one may hide an equally close, lower indexed location
+    certain = ok.any(axis=1) & (distance_matrix[curr, chosen] < distance_matrix[curr, candidates[:, -1]])
+    nearest[certain] = chosen[certain]
+    todo = np.flatnonzero(~certain)
+
+  if len(todo):
+    rows = distance_matrix[curr[todo]] + visited_penalty[todo]
+    masked = np.where(demands <= remaining[todo, None], rows, np.inf)
+    best = masked.argmin(axis=1)
+    feasible = np.isfinite(masked[np.arange(len(todo)), best])
+    nearest[todo[feasible]] = best[feasible]
+
+  return nearest
+
+
+def nearest_neighbor_reference(model):
+  """
+  The original per-step Python scan, kept as the regression reference for nearest_neighbor
+  """
   distance_matrix = model["distance_matrix"]
   num_vehicles = model["num_vehicles"]
   demands = model["demands"]
@@ -14,32 +217,67 @@ def nearest_neighbor(model):
   num_locations = len(distance_matrix)
   visited = np.zeros(num_locations, dtype=bool)
   routes = []
-  
+
   for vehicle in range(num_vehicles):
     curr_location = depot_index
     capacity = vehicle_capacities[vehicle]
     curr_capacity = 0
     route = [curr_location]
     visited[curr_location] = True
-    
+
     while np.sum(visited) < num_locations:
       min_dist = float('inf')
       nearest = None
-      
+
       for neighbor in np.where(~visited)[0]:
         if demands[neighbor] + curr_capacity <= capacity and distance_matrix[curr_location][neighbor] < min_dist:
           nearest = neighbor
           min_dist = distance_matrix[curr_location][neighbor]
-          
+
       if nearest is None:
         break
-      
+
       route.append(nearest)
       visited[nearest] = True
       curr_capacity += demands[nearest]
       curr_location = nearest
-      
+
     route.append(depot_index)
     routes.append(route)
-    
-  return routes
\ No newline at end of file
+
+  return routes
+
+
+if __name__ == '__main__':
+  print('regression test against the original scan')
+  import time
+  rng = np.random.default_rng(0)
+  # the last two maps are capacity-tight: most vehicles fit one or two stops and some locations stay unserved
+  for num_locations, num_vehicles, min_demand in [(10, 2, 1), (50, 12, 1), (200, 30, 1), (200, 150, 1),
+                                                  (50, 30, 8), (200, 100, 10)]:
+    coords = rng.integers(0, 50, size=(num_locations, 2))
+    model = {
+      "distance_matrix": np.abs(coords[:, None, :] - coords[None, :, :]).sum(axis=2),
+      "num_vehicles": num_vehicles,
+      "demands": [0] + list(rng.integers(min_demand, 19, size=num_locations - 1)),
+      "vehicle_capacities": [20] * num_vehicles,
+      "depot": 0,
+    }
+    # the first call compiles the construction (or loads it from numba's cache)
+    nearest_neighbor(model)
+    start = time.perf_counter()
+    routes = nearest_neighbor(model)
+    elapsed = time.perf_counter() - start
+    assert routes == [[int(x) for x in route] for route in nearest_neighbor_reference(model)]
+    print('{}L, {}V ok in {:.0f} us'.format(num_locations, num_vehicles, elapsed * 1e6))
+    # a start node is visited first by the first vehicle, the same as in the batch; the depot is ignored
+    start_nodes = [0, 1, num_locations // 2, num_locations - 1]
+    for start_node, batch_routes in zip(start_nodes, nearest_neighbor_batch(model, start_nodes=start_nodes)):
+      routes = nearest_neighbor(model, start_node=start_node)
+      assert routes == batch_routes
+      served = [location for route in routes for location in route[1:-1]]
+      assert len(served) == len(set(served)) and 0 not in served
+      assert start_node == 0 or routes[0][1] == start_node or model["demands"][start_node] > 20
+    assert nearest_neighbor(model, start_node=0) == nearest_neighbor(model)
+  batch = nearest_neighbor_batch(model, start_nodes=np.arange(1, 65))
+  print('built {} starting solutions'.format(len(batch)))
@@ -0,0 +1,286 @@
+"""
+OR-Tools Model Compilation
+Builds the routing index manager and routing model shared by the OR-Tools solvers
+"""
+
+from collections import OrderedDict
+import time
+import numpy as np
+from data.models import fingerprint_model, DistanceOracle
+from instrumentation import phase, add_phase, count, recording
+
+# number of compiled instances kept for reuse
+MODEL_CACHE_SIZE = 4
+model_cache = OrderedDict()
+
+# first solution strategies usable on our models (the others need an evaluator, a sweep arranger or optional nodes),
+# listed by name so the registry can offer them without importing OR-Tools, which is only loaded to solve
+FIRST_SOLUTION_STRATEGIES = [
+  "AUTOMATIC", "PATH_CHEAPEST_ARC", "PATH_MOST_CONSTRAINED_ARC", "SAVINGS", "PARALLEL_SAVINGS", "CHRISTOFIDES",
+  "PARALLEL_CHEAPEST_INSERTION", "SEQUENTIAL_CHEAPEST_INSERTION", "LOCAL_CHEAPEST_INSERTION",
+  "LOCAL_CHEAPEST_COST_INSERTION", "GLOBAL_CHEAPEST_ARC", "LOCAL_CHEAPEST_ARC", "FIRST_UNBOUND_MIN_VALUE",
+]
+
+
+def solve_ortools(data, first_solution_strategy="PATH_CHEAPEST_ARC", metaheuristic="AUTOMATIC", time_limit=1,
+                  solution_limit=None, log_search=False, initial_routes=None, trace=None, progress=None):
+  """
+  Solves the model with the named OR-Tools first solution strategy and local search metaheuristic.
+  time_limit is in seconds and solution_limit caps the number of solutions found; metaheuristics other than
+  greedy descent only stop on one of these limits.
+  initial_routes (depot to depot, e.g. from nearest_neighbor or two_opt) warm-start the search so the whole
+  budget goes to improving them; if they are not a feasible assignment the search starts cold.
+  If trace is a list, an (elapsed seconds, cost) pair is appended to it for every solution found.
+  progress, if given, is called as progress(elapsed seconds, cost, routes) for every solution better than
+  all before it.
+  Inside an instrumentation Recording the model build, the search up to the first solution and the
+  improvement after it are timed, and the solutions found and Python transit callbacks invoked are counted.
+  Returns (manager, routing, solution), where solution is None if no solution was found
+  """
+  start = time.perf_counter()
+  with phase("model build"):
+    manager, routing, state = routing_model(data)
+    search_parameters = routing_search_parameters(first_solution_strategy, metaheuristic, time_limit,
+                                                  solution_limit, log_search)
+
+  best = [None]
+  # search start and first solution times, when instrumented
+  found = [None, None]
+  def record_solution():
+    elapsed, cost = time.perf_counter() - start, routing.CostVar().Value()
+    if found[0] is not None:
+      if found[1] is None:
+        found[1] = time.perf_counter()
+      count("solutions_found")
+    if trace is not None:
+      trace.append((elapsed, cost))
+    if progress is not None and (best[0] is None or cost < best[0]):
+      best[0] = cost
+      progress(elapsed, cost, current_routes(manager, routing, data["num_vehicles"]))
+  instrumented = recording()
+  listening = trace is not None or progress is not None or instrumented
+  if listening:
+    state["listeners"].append(record_solution)
+
+  callbacks = state["callbacks"][0]
+  if instrumented:
+    found[0] = time.perf_counter()
+  try:
+    initial_solution = None
+    if initial_routes is not None:
+      # a model is closed by its first solve, reading routes needs it closed beforehand
+      if not state["closed"]:
+        routing.CloseModelWithParameters(search_parameters)
+      initial_solution = routing.ReadAssignmentFromRoutes(
+        [[manager.NodeToIndex(node) for node in route[1:-1]] for route in initial_routes], True)
+    if initial_solution is not None:
+      solution = routing.SolveFromAssignmentWithParameters(initial_solution, search_parameters)
+    else:
+      solution = routing.SolveWithParameters(search_parameters)
+  finally:
+    state["closed"] = True
+    if listening:
+      state["listeners"].remove(record_solution)
+  if instrumented:
+    end = time.perf_counter()
+    add_phase("first solution", (found[1] or end) - found[0])
+    add_phase("improvement", end - (found[1] or end))
+    count("transit_callbacks", state["callbacks"][0] - callbacks)
+  return manager, routing, solution
+
+
+def routing_search_parameters(first_solution_strategy, metaheuristic, time_limit, solution_limit, log_search):
+  """
+  Returns the RoutingSearchParameters for a solve
+  """
+  from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+  search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+  search_parameters.first_solution_strategy = getattr(
+    routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy
+  )
+  search_parameters.local_search_metaheuristic = getattr(
+    routing_enums_pb2.LocalSearchMetaheuristic, metaheuristic
+  )
+  if time_limit is not None:
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+  if solution_limit is not None:
+    search_parameters.solution_limit = solution_limit
+  search_parameters.log_search = log_search
+  return search_parameters
+
+
+def solver_statistics(routing):
+  """
+  Returns the search statistics of the last solve of a routing model
+  """
+  solver = routing.solver()
+  return {
+    "iterations": solver.Solutions(),
+    "branches": solver.Branches(),
+    "failures": solver.Failures(),
+    "solver_wall_time": solver.WallTime() / 1000,
+    "status": routing.status(),
+  }
+
+
+def calc_route_distance_ortools(routing, solution, vehicle_id):
+  """
+  Calculate distance of a route taken by a vehicle
+  For algorithms implemented by OR-Tools
+  """
+  total_dist = 0
+  index = routing.Start(vehicle_id)
+
+  while not routing.IsEnd(index):
+    previous_index = index
+    index = solution.Value(routing.NextVar(index))
+    total_dist += routing.GetArcCostForVehicle(
+        previous_index, index, vehicle_id
+    )
+
+  return total_dist
+
+
+def calc_total_distance_ortools(num_vehicles, routing, solution):
+  """
+  Calculate the total distance travelled by every vehicle
+  For algorithms implemented by OR-Tools
+  """
+  total = 0
+  for vehicle_id in range(num_vehicles):
+    total += calc_route_distance_ortools(routing, solution, vehicle_id)
+  return total
+
+
+def get_routes_ortools(manager, routing, solution, num_vehicles):
+  """
+  Returns routes of OR-Tools algorithms
+  """
+  routes = []
+
+  for vehicle_id in range(num_vehicles):
+    vehicle_route = []
+    index = routing.Start(vehicle_id)
+    while not routing.IsEnd(index):
+      node_index = manager.IndexToNode(index)
+      vehicle_route.append(node_index)
+      index = solution.Value(routing.NextVar(index))
+    vehicle_route.append(manager.IndexToNode(index))
+    routes.append(vehicle_route)
+
+  return routes
+
+
+def current_routes(manager, routing, num_vehicles):
+  """
+  Returns the routes of the solution being reported, read from inside a solution callback
+  """
+  routes = []
+  for vehicle_id in range(num_vehicles):
+    index = routing.Start(vehicle_id)
+    route = [manager.IndexToNode(index)]
+    while not routing.IsEnd(index):
+      index = routing.NextVar(index).Value()
+      route.append(manager.IndexToNode(index))
+    routes.append(route)
+  return routes
+
+
+def routing_model(data, native=True):
+  """
+  Returns the (manager, routing, state) of a data model, see build_routing_model.
+  Models are cached by instance fingerprint, so solving the same instance again skips the build
+  """
+  key = (fingerprint_model(data), native)
+  if key in model_cache:
+    model_cache.move_to_end(key)
+    return model_cache[key]
+
+  compiled = build_routing_model(data, native)
+  model_cache[key] = compiled
+  if len(model_cache) > MODEL_CACHE_SIZE:
+    model_cache.popitem(last=False)
+  return compiled
+
+
+def build_routing_model(data, native=True):
+  """
+  Builds the index manager and routing model, with arc costs from the distance matrix and a capacity
+  dimension from the demands and vehicle capacities.
+  With native set, the matrix and the demand vector are registered as native transits evaluated inside
+  the C++ solver; otherwise as Python callbacks the solver calls back into for every arc.
+  A DistanceOracle is always registered as a callback computing each arc on demand, since a native
+  matrix would materialize every distance.
+  The returned state dict records whether the model is closed, holds the "listeners" called for every
+  solution found (a single callback is registered for them since callbacks cannot be removed between solves)
+  and counts the calls of the Python transit callbacks in "callbacks"
+  """
+  from ortools.constraint_solver import pywrapcp
+  num_locations = len(data["distance_matrix"])
+  manager = pywrapcp.RoutingIndexManager(num_locations, data["num_vehicles"], data["depot"])
+  routing = pywrapcp.RoutingModel(manager)
+
+  distances = data["distance_matrix"]
+  calls = [0]
+  if isinstance(distances, DistanceOracle):
+    def distance_callback(from_index, to_index):
+      calls[0] += 1
+      return distances.distance(manager.IndexToNode(from_index), manager.IndexToNode(to_index))
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+  elif native:
+    transit_callback_index = routing.RegisterTransitMatrix(np.asarray(distances, dtype=np.int64).tolist())
+  else:
+    def distance_callback(from_index, to_index):
+      calls[0] += 1
+      from_node = manager.IndexToNode(from_index)
+      to_node = manager.IndexToNode(to_index)
+      return distances[from_node][to_node]
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+  routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+  if native:
+    # demands can hold an extra trailing entry (see change_fleet_config), the vector needs one per node
+    demand_callback_index = routing.RegisterUnaryTransitVector(
+      np.asarray(data["demands"][:num_locations], dtype=np.int64).tolist())
+  else:
+    def demand_callback(from_index):
+      calls[0] += 1
+      from_node = manager.IndexToNode(from_index)
+      return data["demands"][from_node]
+    demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+  routing.AddDimensionWithVehicleCapacity(
+    demand_callback_index,
+    0,
+    data["vehicle_capacities"],
+    True,
+    "Capacity"
+  )
+
+  state = {"closed": False, "listeners": [], "callbacks": calls}
+  def on_solution():
+    for listener in state["listeners"]:
+      listener()
+  routing.AddAtSolutionCallback(on_solution)
+
+  return manager, routing, state
+
+
+def compare_transit_registration(data, time_limit=1):
+  """
+  Solves the model with guided local search once with native transits and once with Python callbacks.
+  Returns the solutions and search branches explored per second, and the objective, of each
+  """
+  comparison = {}
+  for native in (True, False):
+    manager, routing, _ = build_routing_model(data, native)
+    search_parameters = routing_search_parameters("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH", time_limit, None, False)
+
+    solution = routing.SolveWithParameters(search_parameters)
+    solver = routing.solver()
+    seconds = max(solver.WallTime(), 1) / 1000
+    comparison["native" if native else "callback"] = {
+      "solutions_per_second": solver.Solutions() / seconds,
+      "branches_per_second": solver.Branches() / seconds,
+      "objective": solution.ObjectiveValue() if solution else None,
+    }
+  return comparison
@@ -0,0 +1,199 @@
+"""
+Portfolio Racing
+Runs several solvers and seeds side by side in worker processes under one wall-clock deadline
+and keeps the best routes any of them finds
+"""
+
+import inspect
+import multiprocessing
+import queue
+import time
+import numpy as np
+
+# solvers raced when none are given, each from seed 0
+PORTFOLIO = ("gls", "tabu", "two_opt", "local_search")
+# seconds past the deadline a running solver gets to report its final routes before it is cancelled
+GRACE = 0.2
+# seconds taken off a solver's time limit for building its result and sending it back
+REPORT_MARGIN = 0.1
+
+
+def race(model, time_limit=1, entries=PORTFOLIO, workers=None, target=None, gap=0.0, first=False,
+         grace=GRACE, options=None):
+  """
+  Runs every entry, a registered solver name or a (name, seed) pair, in its own process until time_limit
+  seconds from now (None waits for all of them). At most workers run at once (default all of them, sharing
+  the cores if there are fewer); the others start as they finish. A seed seeds the global NumPy generator of its process (random starts) and is
+  passed to solvers taking a seed. options maps a solver name to extra solver options.
+  All entries share the best cost found so far: OR-Tools searches only send the routes of solutions better
+  than it while running, every entry sends its final routes.
+  The race stops at the deadline, once the best cost is within gap (a fraction) of target, with first set as
+  soon as any entry finishes, or when all have finished; the entries still running are then cancelled.
+  Returns (routes, stats): stats["solver"] and stats["seed"] name the entry the routes come from,
+  stats["entries"] holds the cost, status and time of each and stats["trace"] the (elapsed, cost) improvements
+  """
+  start = time.time()
+  deadline = start + time_limit if time_limit is not None else None
+  entries = [(entry, 0) if isinstance(entry, str) else tuple(entry) for entry in entries]
+  if not entries:
+    raise ValueError("a portfolio needs at least one solver")
+  if workers is None:
+    workers = len(entries)
+  options = options or {}
+
+  context = multiprocessing.get_context("spawn")
+  incumbent = context.Value("d", float("inf"))
+  messages = context.Queue()
+  processes = {}
+  # processes that reported their result and are shutting down
+  exiting = []
+  pending = list(range(len(entries)))
+  status = ["waiting"] * len(entries)
+  costs = [None] * len(entries)
+  times = [None] * len(entries)
+  best = {"cost": None, "routes": None, "entry": None}
+  trace = []
+  stopped = "finished"
+
+  def launch():
+    # no new entries start once the deadline has passed
+    while pending and len(processes) < max(1, workers) and (deadline is None or time.time() < deadline):
+      index = pending.pop(0)
+      name, seed = entries[index]
+      process = context.Process(target=race_entry, daemon=True,
+                                args=(index, name, seed, options.get(name, {}), model, deadline, incumbent, messages))
+      process.start()
+      processes[index] = process
+      status[index] = "running"
+
+  try:
+    launch()
+    while processes:
+      now = time.time()
+      if deadline is not None and now >= deadline + grace:
+        stopped = "deadline"
+        break
+      wait = min(0.1, deadline + grace - now) if deadline is not None else 0.1
+      try:
+        kind, index, at, cost, payload = messages.get(timeout=max(0.0, wait))
+      except queue.Empty:
+        for index, process in list(processes.items()):
+          # a process that died without reporting, e.g. killed by the system
+          if not process.is_alive() and status[index] == "running":
+            status[index] = "failed"
+            del processes[index]
+        launch()
+        continue
+
+      if kind == "failed":
+        status[index] = "failed"
+      elif cost is not None and (best["cost"] is None or cost < best["cost"]):
+        best.update(cost=cost, routes=payload, entry=index)
+        trace.append((at - start, cost))
+      if kind == "progress":
+        costs[index] = cost if costs[index] is None else min(costs[index], cost)
+        continue
+      if kind == "finished":
+        status[index] = "finished"
+        costs[index] = cost
+      times[index] = at - start
+      exiting.append(processes.pop(index))
+
+      if target is not None and best["cost"] is not None and best["cost"] <= target * (1 + gap):
+        stopped = "target"
+        break
+      if first and kind == "finished":
+        stopped = "first"
+        break
+      launch()
+    if pending:
+      stopped = "deadline"
+  finally:
+    for index in processes:
+      status[index] = "cancelled"
+    # cancelled searches and interpreters still shutting down are stopped without waiting for them
+    for process in list(processes.values()) + exiting:
+      if process.is_alive():
+        process.terminate()
+    for process in list(processes.values()) + exiting:
+      process.join()
+    messages.close()
+  for index in pending:
+    status[index] = "skipped"
+
+  stats = {"solver": None, "seed": None, "stopped": stopped, "trace": trace,
+           "entries": [{"solver": name, "seed": seed, "cost": cost, "status": state, "time": elapsed}
+                       for (name, seed), cost, state, elapsed in zip(entries, costs, status, times)]}
+  if best["entry"] is not None:
+    stats["solver"], stats["seed"] = entries[best["entry"]]
+  return best["routes"], stats
+
+
+def race_entry(index, name, seed, options, model, deadline, incumbent, messages):
+  """
+  Solves the model with one portfolio entry in a worker process, sending ("progress" | "finished" | "failed",
+  index, time, cost, routes or error) messages. Run by race
+  """
+  from algorithms.registry import solve, SOLVERS
+  np.random.seed(seed)
+  options = dict(options)
+  parameters = inspect.signature(SOLVERS[name]).parameters
+  if "seed" in parameters or any(p.kind == p.VAR_KEYWORD for p in parameters.values()):
+    options.setdefault("seed", seed)
+  if "progress" in parameters:
+    def progress(elapsed, cost, routes):
+      if improves(incumbent, cost):
+        messages.put(("progress", index, time.time(), int(cost), routes))
+    options["progress"] = progress
+  time_limit = max(0.0, deadline - time.time() - REPORT_MARGIN) if deadline is not None else None
+  try:
+    result = solve(name, model, time_limit, **options)
+  except Exception as error:
+    messages.put(("failed", index, time.time(), None, repr(error)))
+    return
+  if result.routes is None:
+    messages.put(("finished", index, time.time(), None, None))
+    return
+  cost = int(result.cost)
+  improves(incumbent, cost)
+  messages.put(("finished", index, time.time(), cost, [[int(location) for location in route]
+                                                       for route in result.routes]))
+
+
+def improves(incumbent, cost):
+  """
+  Lowers the shared best cost to cost if it is better, returns whether it was
+  """
+  with incumbent.get_lock():
+    if cost < incumbent.value:
+      incumbent.value = cost
+      return True
+  return False
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.registry import solve
+  from algorithms.route_cost import calc_total_distance
+  for num_locations in (50, 200):
+    num_vehicles = num_locations // 4
+    model, _ = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=2)
+    begin = time.perf_counter()
+    routes, stats = race(model, time_limit=3)
+    elapsed = time.perf_counter() - begin
+    served = sorted(location for route in routes for location in route[1:-1])
+    assert served == list(range(1, num_locations))
+    assert calc_total_distance(routes, model["distance_matrix"]) == min(
+      entry["cost"] for entry in stats["entries"] if entry["cost"] is not None)
+    print('{}L: best {} from {} in {:.2f}s, stopped at {}'.format(
+      num_locations, calc_total_distance(routes, model["distance_matrix"]), stats["solver"], elapsed, stats["stopped"]))
+    for entry in stats["entries"]:
+      print('  {solver} (seed {seed}): {cost} {status}'.format(**entry))
+    for name in PORTFOLIO:
+      print('  alone in 3s: {} {}'.format(name, solve(name, model, 3).cost))
+    target = stats["trace"][-1][1]
+    begin = time.perf_counter()
+    routes, stats = race(model, time_limit=3, target=target, gap=0.05)
+    print('  within 5% of {}: {} from {} after {:.2f}s, stopped at {}'.format(
+      target, stats["trace"][-1][1], stats["solver"], time.perf_counter() - begin, stats["stopped"]))
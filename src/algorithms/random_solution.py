@@ -0,0 +1,29 @@
+"""
+Random Solution
+Baseline that assigns the locations to vehicles at random
+"""
+
+import numpy as np
+
+def random_routes(data):
+  """
+  Returns a random assignment of routes to the vehicles
+  """
+  distance_matrix = data["distance_matrix"]
+  num_vehicles = data["num_vehicles"]
+  num_locations = len(distance_matrix)
+  depot_index = data["depot"]
+  routes = [[] for _ in range(num_vehicles)]
+
+  locations = list(range(num_locations))
+  locations.remove(depot_index)
+  np.random.shuffle(locations)
+
+  for i, location in enumerate(locations):
+    routes[i % num_vehicles].append(location)
+
+  for route in routes:
+    route.insert(0, depot_index)
+    route.append(depot_index)
+
+  return routes
@@ -0,0 +1,270 @@
+"""
+Solver Registry
+Every algorithm behind one call with an explicit time budget, returning a common result object
+"""
+
+import copy
+import time
+from algorithms.nearest_neighbor import nearest_neighbor
+from algorithms.random_solution import random_routes
+from algorithms.route_cost import calc_total_distance
+from algorithms.two_opt import two_opt_search, sampled_two_opt
+from algorithms.decomposition import decompose
+from algorithms.local_search import inter_route_search, OPERATORS
+from algorithms.multi_start import multi_start
+from algorithms.portfolio import race
+from algorithms.solution_cache import solution_key, feasible
+from algorithms.ortools_model import (solve_ortools, solver_statistics, get_routes_ortools,
+                                      calc_total_distance_ortools, FIRST_SOLUTION_STRATEGIES)
+from instrumentation import phase
+
+SOLVERS = {}
+
+
+class SolverResult:
+  """
+  Routes, total cost, wall time and solver statistics of one solve.
+  routes and cost are None when the solver found no solution
+  """
+
+  def __init__(self, algorithm, routes, cost, wall_time, stats=None):
+    self.algorithm = algorithm
+    self.routes = routes
+    self.cost = cost
+    self.wall_time = wall_time
+    self.stats = stats or {}
+
+  def __repr__(self):
+    return "SolverResult({}, cost={}, wall_time={:.4f}s)".format(self.algorithm, self.cost, self.wall_time)
+
+
+def register_solver(name):
+  """
+  Decorator adding a solver to the registry. A solver is called as
+  solver(model, time_limit, solution_limit, log_search, **options) and returns (routes, cost, stats)
+  """
+  def decorator(function):
+    SOLVERS[name] = function
+    return function
+  return decorator
+
+
+def solve(name, model, time_limit=1, solution_limit=None, log_search=False, cache=None, **options):
+  """
+  Runs the named solver on the model and returns a SolverResult.
+  time_limit is in seconds (None for no limit) and solution_limit caps the number of improving solutions.
+  stats["trace"] holds the (elapsed seconds, best cost) improvement events; solvers that build a single
+  solution report one point at the end of the run.
+  Inside an instrumentation Recording the solvers time their first solution, improvement and extraction phases.
+  With a SolutionCache, a solve of the same instance with the same solver, limits and options returns the
+  stored solution if it is still feasible, and stats["cache"] is "hit" or "miss". Only feasible solutions are stored.
+  A hit reports the wall time and stats of the solve that found the solution, and the lookup in stats["lookup_time"]
+  """
+  if name not in SOLVERS:
+    raise ValueError("unknown solver: " + str(name))
+  start = time.perf_counter_ns()
+  if cache is not None:
+    key = solution_key(name, model, time_limit, solution_limit, options)
+    cached = cache.get(key, model)
+    if cached is not None:
+      routes, cost, wall_time, stats = cached
+      stats.update(cache="hit", lookup_time=(time.perf_counter_ns() - start) / 1000000000)
+      return SolverResult(name, routes, cost, wall_time, stats)
+  routes, cost, stats = SOLVERS[name](model, time_limit, solution_limit, log_search, **options)
+  wall_time = (time.perf_counter_ns() - start) / 1000000000
+  if "trace" not in stats:
+    stats["trace"] = [(wall_time, cost.item() if hasattr(cost, "item") else cost)] if cost is not None else []
+  if cache is not None:
+    # routes that ignore the capacities (e.g. random) would be rejected on every lookup
+    if routes is not None and feasible(model, routes):
+      cache.put(key, routes, cost, wall_time, stats)
+    stats["cache"] = "miss"
+  return SolverResult(name, routes, cost, wall_time, stats)
+
+
+@register_solver("nn")
+def solve_nearest_neighbor(model, time_limit, solution_limit, log_search):
+  with phase("first solution"):
+    routes = nearest_neighbor(model)
+  with phase("extraction"):
+    return routes, calc_total_distance(routes, model["distance_matrix"]), {}
+
+
+@register_solver("random")
+def solve_random(model, time_limit, solution_limit, log_search):
+  with phase("first solution"):
+    routes = random_routes(model)
+  with phase("extraction"):
+    return routes, calc_total_distance(routes, model["distance_matrix"]), {}
+
+
+def two_opt_solver(start, strategy):
+  """
+  Returns a solver running 2-opt with the given strategy from NN or random routes, or from initial_routes.
+  stats["construction_time"] is the time spent building the starting routes (0 when they are given)
+  """
+  def solver(model, time_limit, solution_limit, log_search, initial_routes=None):
+    initial_routes, construction_time = starting_routes(model, start, initial_routes)
+    with phase("improvement"):
+      routes, stats = two_opt_search(model, copy.deepcopy(initial_routes), strategy, solution_limit, time_limit)
+    stats["iterations"] = stats["improvements"]
+    stats["construction_time"] = construction_time
+    with phase("extraction"):
+      return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+  return solver
+
+
+def starting_routes(model, start, initial_routes=None):
+  """
+  Returns the starting routes of an improvement solver, initial_routes or else built by NN or random routes,
+  and the seconds spent building them
+  """
+  begin = time.perf_counter()
+  with phase("first solution"):
+    if initial_routes is None:
+      initial_routes = nearest_neighbor(model) if start == "nn" else random_routes(model)
+  return initial_routes, time.perf_counter() - begin
+
+
+register_solver("two_opt")(two_opt_solver("nn", "first"))
+register_solver("two_opt_best")(two_opt_solver("nn", "best"))
+register_solver("two_opt_rand")(two_opt_solver("random", "first"))
+register_solver("two_opt_rand_best")(two_opt_solver("random", "best"))
+
+
+def local_search_solver(start):
+  """
+  Returns a solver alternating inter-route moves and 2-opt from NN or random routes, or from initial_routes,
+  until neither improves or the time limit is spent. solution_limit caps the improving inter-route moves.
+  stats["construction_time"] is the time spent building the starting routes
+  """
+  def solver(model, time_limit, solution_limit, log_search, initial_routes=None, operators=OPERATORS):
+    initial_routes, construction_time = starting_routes(model, start, initial_routes)
+    with phase("improvement"):
+      routes, stats = alternate_searches(model, initial_routes, time_limit, solution_limit, operators)
+    stats["construction_time"] = construction_time
+    with phase("extraction"):
+      return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+  return solver
+
+
+def alternate_searches(model, initial_routes, time_limit, solution_limit, operators):
+  """
+  Alternates inter-route moves and 2-opt from the initial routes, see local_search_solver.
+  Returns the routes and their stats
+  """
+  begin = time.perf_counter()
+  routes, stats = two_opt_search(model, copy.deepcopy(initial_routes), "first", None, time_limit)
+  trace = stats["trace"]
+  improvements = 0
+  while True:
+    remaining = time_limit - (time.perf_counter() - begin) if time_limit is not None else None
+    if remaining is not None and remaining <= 0:
+      break
+    offset = time.perf_counter() - begin
+    routes, inter_stats = inter_route_search(model, routes, operators, solution_limit, remaining)
+    trace += [(offset + elapsed, cost) for elapsed, cost in inter_stats["trace"][1:]]
+    improvements += inter_stats["improvements"]
+    if not inter_stats["improvements"] or not inter_stats["local_optimum"]:
+      break
+    remaining = time_limit - (time.perf_counter() - begin) if time_limit is not None else None
+    offset = time.perf_counter() - begin
+    routes, intra_stats = two_opt_search(model, routes, "first", None, remaining)
+    trace += [(offset + elapsed, cost) for elapsed, cost in intra_stats["trace"][1:]]
+    if not intra_stats["improvements"]:
+      break
+  stats = {"iterations": improvements, "trace": trace}
+  return routes, stats
+
+
+register_solver("local_search")(local_search_solver("nn"))
+register_solver("local_search_rand")(local_search_solver("random"))
+
+
+@register_solver("two_opt_sampled")
+def solve_two_opt_sampled(model, time_limit, solution_limit, log_search, initial_routes=None, num_iterations=1000):
+  initial_routes, construction_time = starting_routes(model, "nn", initial_routes)
+  with phase("improvement"):
+    routes, stats = sampled_two_opt(model, copy.deepcopy(initial_routes), num_iterations)
+  stats["iterations"] = stats["improvements"]
+  stats["construction_time"] = construction_time
+  with phase("extraction"):
+    return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+
+
+def ortools_solver(first_solution_strategy, metaheuristic, default_solution_limit=None):
+  """
+  Returns a solver running OR-Tools with the given first solution strategy and metaheuristic,
+  warm-started from initial_routes when they are given, reporting improved solutions to progress (see solve_ortools)
+  """
+  def solver(model, time_limit, solution_limit, log_search, first_solution_strategy=first_solution_strategy,
+             initial_routes=None, progress=None):
+    if solution_limit is None:
+      solution_limit = default_solution_limit
+    trace = []
+    manager, routing, solution = solve_ortools(model, first_solution_strategy, metaheuristic, time_limit,
+                                               solution_limit, log_search, initial_routes, trace, progress)
+    stats = solver_statistics(routing)
+    # metaheuristics also report the worse solutions they move through, keep the best-so-far improvements
+    stats["trace"] = []
+    for elapsed, cost in trace:
+      if not stats["trace"] or cost < stats["trace"][-1][1]:
+        stats["trace"].append((elapsed, cost))
+    if not solution:
+      return None, None, stats
+    with phase("extraction"):
+      routes = get_routes_ortools(manager, routing, solution, model["num_vehicles"])
+      return routes, calc_total_distance_ortools(model["num_vehicles"], routing, solution), stats
+  return solver
+
+
+# OR-Tools metaheuristics, starting from path cheapest arc unless first_solution_strategy is passed
+for short_name, metaheuristic in [("gls", "GUIDED_LOCAL_SEARCH"), ("tabu", "TABU_SEARCH"),
+                                  ("simulated_annealing", "SIMULATED_ANNEALING"),
+                                  ("generic_tabu", "GENERIC_TABU_SEARCH"), ("greedy_descent", "GREEDY_DESCENT")]:
+  register_solver(short_name)(ortools_solver("PATH_CHEAPEST_ARC", metaheuristic))
+# OR-Tools first solution strategies on their own, stopping at the first solution unless given a solution_limit
+for strategy in FIRST_SOLUTION_STRATEGIES:
+  register_solver("first_" + strategy.lower())(ortools_solver(strategy, "GREEDY_DESCENT", default_solution_limit=1))
+
+
+@register_solver("decomposition")
+def solve_decomposition(model, time_limit, solution_limit, log_search, algorithm="gls", **options):
+  """
+  Cluster-first, route-second: solves clusters of the map with algorithm and stitches the routes,
+  see decompose for the options
+  """
+  routes, stats = decompose(model, algorithm, time_limit, **options)
+  if routes is None:
+    return None, None, stats
+  return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+
+
+@register_solver("multi_start")
+def solve_multi_start(model, time_limit, solution_limit, log_search, **options):
+  """
+  Builds a population of starting solutions, scores them at once and improves the best few,
+  see multi_start for the options
+  """
+  routes, stats = multi_start(model, time_limit, **options)
+  return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+
+
+@register_solver("portfolio")
+def solve_portfolio(model, time_limit, solution_limit, log_search, **options):
+  """
+  Races several solvers in parallel processes under the time limit and keeps the best routes,
+  see race for the options
+  """
+  routes, stats = race(model, time_limit, **options)
+  if routes is None:
+    return None, None, stats
+  return routes, calc_total_distance(routes, model["distance_matrix"]), stats
+
+
+def sweep_time_budgets(name, model, time_limits, **options):
+  """
+  Solves the model once per time budget and returns the SolverResults,
+  for finding where more time stops improving the solution on an instance
+  """
+  return [solve(name, model, time_limit, **options) for time_limit in time_limits]
@@ -0,0 +1,32 @@
+"""
+Route Cost
+Distance of routes produced by the algorithms implemented by us
+"""
+
+import numpy as np
+from algorithms.kernels import route_cost, total_cost, edge_total_cost
+
+# below this many stops over all routes, summing edge by edge is cheaper than the padded gather of total_cost
+PADDED_MIN_STOPS = 150
+
+def calc_route_distance(route, dist_matrix):
+  """
+  Calculate distance of a route taken by a vehicle
+  For algorithms implemented by us
+  """
+  if len(route) < 2:
+    return 0
+  # compact (e.g. uint16) distances are summed in 64 bits so long routes cannot overflow
+  return route_cost(route, dist_matrix)
+
+
+def calc_total_distance(routes, distance_matrix):
+  """
+  Calculate the total distance travelled by every vehicle
+  For algorithms implemented by us
+  """
+  if not len(routes):
+    return 0
+  if isinstance(distance_matrix, np.ndarray) and sum(map(len, routes)) < PADDED_MIN_STOPS:
+    return edge_total_cost(routes, distance_matrix)
+  return total_cost(routes, distance_matrix)
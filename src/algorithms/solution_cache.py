@@ -0,0 +1,208 @@
+"""
+Solution Cache
+Remembers the routes, cost, wall time and statistics of solves by instance fingerprint and solver configuration,
+in a size-bounded LRU in memory backed by an optional SQLite file
+"""
+
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+from data.models import fingerprint_model
+
+# solutions kept in memory
+CACHE_SIZE = 256
+# solver options that do not change the solution, left out of the key
+UNKEYED_OPTIONS = ("progress",)
+
+# caches opened by open_cache in this process, by SQLite path
+open_caches = {}
+
+
+def solution_key(name, model, time_limit=1, solution_limit=None, options=None):
+  """
+  Returns the cache key of a solve: the instance fingerprint (distance matrix, demands, capacities, vehicle count
+  and depot, see fingerprint_model) and a digest of the solver name, limits and options
+  """
+  config = {"solver": name, "time_limit": time_limit, "solution_limit": solution_limit,
+            "options": {key: value for key, value in (options or {}).items() if key not in UNKEYED_OPTIONS}}
+  text = json.dumps(config, sort_keys=True, default=config_value)
+  return fingerprint_model(model) + ":" + hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+def config_value(value):
+  """
+  Converts the arrays and NumPy scalars of solver options (e.g. initial_routes) for the key
+  """
+  if isinstance(value, np.ndarray):
+    return value.tolist()
+  if hasattr(value, "item"):
+    return value.item()
+  return repr(value)
+
+
+def feasible(model, routes):
+  """
+  Returns True if routes give every vehicle of the model a route from the depot back to it, visit no location
+  twice and keep every vehicle within its capacity
+  """
+  depot = model["depot"]
+  num_locations = len(model["distance_matrix"])
+  demands = np.asarray(model["demands"][:num_locations], dtype=np.int64)
+  capacities = np.asarray(model["vehicle_capacities"], dtype=np.int64)
+  if len(routes) != model["num_vehicles"]:
+    return False
+  visited = np.zeros(num_locations, dtype=np.int64)
+  for route, capacity in zip(routes, capacities):
+    route = np.asarray(route, dtype=np.int64)
+    if len(route) < 2 or route[0] != depot or route[-1] != depot:
+      return False
+    stops = route[1:-1]
+    if stops.size and (stops.min() < 0 or stops.max() >= num_locations or (stops == depot).any()):
+      return False
+    if demands[stops].sum() > capacity:
+      return False
+    np.add.at(visited, stops, 1)
+  return bool((visited <= 1).all())
+
+
+class SolutionCache:
+  """
+  Routes, cost, wall time and statistics of solves by solution_key, the max_entries most recently used in memory.
+  With a path, every stored solution is also written to a `solutions` table in that SQLite file and looked
+  up there when not in memory, so it outlives the process and is shared by the processes using the file.
+  A solution is checked with feasible before it is returned; one that no longer fits the model is dropped
+  """
+
+  def __init__(self, max_entries=CACHE_SIZE, path=None):
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.connection = None
+    if path is not None:
+      # several benchmark workers can share the file, wait for each other's writes
+      self.connection = sqlite3.connect(path, timeout=30)
+      self.connection.execute("CREATE TABLE IF NOT EXISTS solutions "
+                              "(key TEXT PRIMARY KEY, routes TEXT, cost, wall_time REAL, stats TEXT)")
+      self.connection.commit()
+    self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "rejected": 0, "stores": 0, "evictions": 0}
+
+  def get(self, key, model):
+    """
+    Returns the (routes, cost, wall time, stats) stored under key if the routes are feasible for model,
+    otherwise None
+    """
+    entry = self.entries.get(key)
+    if entry is not None:
+      self.entries.move_to_end(key)
+    elif self.connection is not None:
+      row = self.connection.execute("SELECT routes, cost, wall_time, stats FROM solutions WHERE key = ?",
+                                    (key,)).fetchone()
+      if row is not None:
+        entry = (json.loads(row[0]), row[1], row[2], json.loads(row[3]))
+        self.counters["disk_hits"] += 1
+        self.remember(key, entry)
+    if entry is None:
+      self.counters["misses"] += 1
+      return None
+    if not feasible(model, entry[0]):
+      self.counters["rejected"] += 1
+      self.counters["misses"] += 1
+      self.discard(key)
+      return None
+    self.counters["hits"] += 1
+    routes, cost, wall_time, stats = entry
+    return [list(route) for route in routes], cost, wall_time, json.loads(json.dumps(stats))
+
+  def put(self, key, routes, cost, wall_time=None, stats=None):
+    """
+    Stores the routes, cost, wall time and statistics (e.g. the trace) of a solve under key
+    """
+    routes = [[int(location) for location in route] for route in routes]
+    cost = cost.item() if hasattr(cost, "item") else cost
+    # stored as JSON, so a solution read back from memory matches one read from the file
+    stats = json.dumps(stats or {}, default=config_value)
+    self.remember(key, (routes, cost, wall_time, json.loads(stats)))
+    self.counters["stores"] += 1
+    if self.connection is not None:
+      self.connection.execute("INSERT OR REPLACE INTO solutions (key, routes, cost, wall_time, stats) "
+                              "VALUES (?, ?, ?, ?, ?)", (key, json.dumps(routes), cost, wall_time, stats))
+      self.connection.commit()
+
+  def remember(self, key, entry):
+    self.entries[key] = entry
+    self.entries.move_to_end(key)
+    if len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+      self.counters["evictions"] += 1
+
+  def discard(self, key):
+    self.entries.pop(key, None)
+    if self.connection is not None:
+      self.connection.execute("DELETE FROM solutions WHERE key = ?", (key,))
+      self.connection.commit()
+
+  def statistics(self):
+    """
+    Returns the hit, miss, rejection, store and eviction counts, the hit rate and the entries in memory
+    """
+    lookups = self.counters["hits"] + self.counters["misses"]
+    return dict(self.counters, hit_rate=self.counters["hits"] / lookups if lookups else 0.0, size=len(self.entries))
+
+  def clear(self):
+    """
+    Drops every solution, from the SQLite file too
+    """
+    self.entries.clear()
+    if self.connection is not None:
+      self.connection.execute("DELETE FROM solutions")
+      self.connection.commit()
+
+  def close(self):
+    if self.connection is not None:
+      self.connection.close()
+      self.connection = None
+
+
+def open_cache(path=None, max_entries=CACHE_SIZE):
+  """
+  Returns the SolutionCache of this process for the SQLite file at path (None for memory only),
+  opening it on first use
+  """
+  if path not in open_caches:
+    open_caches[path] = SolutionCache(max_entries, path)
+  return open_caches[path]
+
+
+if __name__ == '__main__':
+  print('quick test')
+  import os
+  import tempfile
+  import time
+  from data.models import create_model
+  from algorithms.registry import solve
+  path = os.path.join(tempfile.mkdtemp(), "solutions.sqlite")
+  model, _ = create_model(1000, 100, 25, [20] * 25, seed=0)
+  cache = SolutionCache(max_entries=2, path=path)
+  first = solve("gls", model, 0.5, cache=cache)
+  again = solve("gls", model, 0.5, cache=cache)
+  assert again.routes == first.routes and again.cost == first.cost and again.stats["cache"] == "hit"
+  # a hit reports the time and trace of the solve that found the solution
+  assert again.wall_time == first.wall_time and again.stats["trace"] == [list(point) for point in first.stats["trace"]]
+  print('gls {:.3f}s, cached {:.6f}s'.format(first.wall_time, again.stats["lookup_time"]))
+  assert solve("gls", model, 0.25, cache=cache).stats["cache"] == "miss"
+  assert solve("two_opt", model, 0.5, cache=cache).stats["cache"] == "miss"
+
+  # a new process finds the solutions in the SQLite file, and the changed instance misses
+  disk = SolutionCache(path=path)
+  start = time.perf_counter()
+  assert solve("gls", model, 0.5, cache=disk).stats["cache"] == "hit"
+  print('from SQLite {:.6f}s'.format(time.perf_counter() - start))
+  model["vehicle_capacities"] = [15] * 25
+  assert solve("gls", model, 0.5, cache=disk).stats["cache"] == "miss"
+  # a stored solution that does not fit the capacities is not returned
+  key = solution_key("gls", model, 0.5)
+  disk.put(key, first.routes, first.cost, first.wall_time, first.stats)
+  assert disk.get(key, model) is None
+  print(cache.statistics())
+  print(disk.statistics())
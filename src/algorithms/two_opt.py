@@ -2,24 +2,152 @@
 Two-Opt Optimization Algorithm
 """
 
+import time
 import numpy as np
+from algorithms.route_cost import calc_route_distance
+from algorithms.kernels import EPSILON, widen, two_opt_move, prepare_two_opt_move, total_cost
+from data.models import distance_array
+from instrumentation import count
+
 
 def two_opt(model, routes, num_iterations):
-  def calc_total_distance(route, dist_matrix):
-    total_dist = 0
-    num_locations = len(route)
-    
-    for i in range(num_locations - 1):
-      curr_location = route[i]
-      next_location = route[i + 1]
-      total_dist += dist_matrix[curr_location][next_location]
-      
-    return total_dist
-  
+  """
+  Compatibility wrapper around two_opt_search using first-improvement.
+  Improves each route in place, applying at most num_iterations improving moves per route.
+  The original two_opt tried num_iterations random (i, j) reversals per route instead (see sampled_two_opt),
+  so the same num_iterations now usually runs to a 2-opt local optimum and takes longer
+  """
+  optimized_routes, _ = two_opt_search(model, routes, max_iterations=num_iterations)
+  for i in range(len(routes)):
+    routes[i] = optimized_routes[i]
+
+  return routes
+
+
+def two_opt_search(model, routes, strategy="first", max_iterations=None, time_limit=None, use_neighbors=True):
+  """
+  Deterministic 2-opt on each route separately.
+  Every pair of positions is swept in order and each move is scored in O(1) from the four edges it changes,
+  which assumes a symmetric distance matrix (true for the Minkowski maps from create_model).
+  strategy is "first" (apply the first improving move found) or "best" (apply the best move of a full sweep).
+  If the model has a neighbour index and use_neighbors is set, only moves creating an edge to one of the
+  k nearest neighbours are considered, so the result is a local optimum of that restricted neighbourhood.
+  Stops at a 2-opt local optimum, after max_iterations improving moves per route, or after time_limit seconds.
+  Returns the new routes and a stats dict with the number of moves evaluated per second and the
+  (elapsed seconds, total cost) trace of every improvement. The compiled move scan is built before the
+  search is timed, stats["compile_time"] holds the seconds that took (about 0 once compiled)
+  """
+  if strategy not in ("first", "best"):
+    raise ValueError("unknown 2-opt strategy: " + str(strategy))
+
+  distance_matrix = distance_array(model["distance_matrix"])
+  neighbors = model["neighbors"] if use_neighbors and "neighbors" in model else None
+  # position of each location in the route being improved, -1 when not on it
+  positions = np.full(len(distance_matrix), -1, dtype=np.int64) if neighbors is not None else None
+  compile_time = prepare_two_opt_move(distance_matrix, neighbors, positions)
+  start = time.perf_counter()
+  deadline = start + time_limit if time_limit is not None else None
+  stats = {"moves_evaluated": 0, "improvements": 0, "local_optimum": True, "started": start,
+           "compile_time": compile_time}
+  stats["cost"] = total_cost(routes, distance_matrix)
+  stats["trace"] = [(0.0, stats["cost"].item() if hasattr(stats["cost"], "item") else stats["cost"])]
+
+  new_routes = []
+  for route in routes:
+    new_routes.append(improve_route(distance_matrix, route, strategy, max_iterations, deadline, stats,
+                                    neighbors, positions))
+
+  del stats["started"], stats["cost"]
+  stats["elapsed"] = time.perf_counter() - start
+  stats["moves_per_second"] = stats["moves_evaluated"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+  count("moves_evaluated", stats["moves_evaluated"])
+  count("improving_moves", stats["improvements"])
+  return new_routes, stats
+
+
+def improve_route(distance_matrix, route, strategy, max_iterations, deadline, stats, neighbors=None, positions=None):
+  """
+  Runs 2-opt on a single route (depot at both ends) and returns the improved route.
+  Updates stats in place
+  """
+  # any route shorter than 5 cannot be optimized (including start and end point)
+  if len(route) < 5:
+    return list(route)
+
+  route = np.array(route, dtype=np.int64)
+  num_locations = len(route)
+  edges = widen(distance_matrix[route[:-1], route[1:]])
+  if neighbors is not None:
+    positions[route[1:-1]] = np.arange(1, num_locations - 1)
+  iterations = 0
+
+  # a "first" sweep resumes after the last applied move and restarts from 1 while it keeps improving
+  start, improved = 1, False
+  while not out_of_budget(iterations, max_iterations, deadline, stats):
+    # reversing route[i..j] replaces edges (i-1, i) and (j, j+1) with (i-1, j) and (i, j+1)
+    i, j, delta, evaluated, finished = two_opt_move(distance_matrix, route, edges, start, strategy,
+                                                    neighbors, positions, deadline)
+    stats["moves_evaluated"] += evaluated
+    if not finished:
+      stats["local_optimum"] = False
+      break
+    if i < 0:
+      if strategy == "best" or not improved:
+        break
+      start, improved = 1, False
+      continue
+    apply_move(distance_matrix, route, edges, i, j, positions)
+    record_improvement(stats, delta)
+    iterations += 1
+    if strategy == "first":
+      start, improved = i + 1, True
+
+  if neighbors is not None:
+    positions[route[1:-1]] = -1
+  return route.tolist()
+
+
+def record_improvement(stats, delta):
+  """
+  Counts an applied move and adds the new total cost to the trace
+  """
+  stats["improvements"] += 1
+  stats["cost"] = stats["cost"] + delta
+  cost = stats["cost"].item() if hasattr(stats["cost"], "item") else stats["cost"]
+  stats["trace"].append((time.perf_counter() - stats["started"], cost))
+
+
+def out_of_budget(iterations, max_iterations, deadline, stats):
+  """
+  Returns True, and marks the search as stopped before a local optimum, once the budget is spent
+  """
+  if (max_iterations is not None and iterations >= max_iterations) or \
+     (deadline is not None and time.perf_counter() > deadline):
+    stats["local_optimum"] = False
+    return True
+  return False
+
+
+def apply_move(distance_matrix, route, edges, i, j, positions=None):
+  """
+  Reverses route[i..j] in place and refreshes the affected edge lengths and positions
+  """
+  route[i:j + 1] = route[i:j + 1][::-1]
+  edges[i - 1:j + 1] = distance_matrix[route[i - 1:j + 1], route[i:j + 2]]
+  if positions is not None:
+    positions[route[i:j + 1]] = np.arange(i, j + 1)
+
+
+def sampled_two_opt(model, routes, num_iterations):
+  """
+  The original random-pair 2-opt sampler, kept for comparison with two_opt_search.
+  Each iteration picks a random (i, j) and recomputes the full route length.
+  Returns the new routes and a stats dict in the same format as two_opt_search
+  """
   def two_opt_solver(model, routes, num_iterations):
     distance_matrix = model["distance_matrix"]
     best_routes = routes.copy()
-    
+
     # first check if there is any optimization possible
     # any route length less than 5 cannot be optimized (including start and end point)
     max_route_length = len(max(routes, key=len))
@@ -33,20 +161,49 @@ def two_opt(model, routes, num_iterations):
         i, j = np.random.randint(1, len(selected_route) - 1, size=2)
         if j < i:
           i, j = j, i
-          
+
         new_route = selected_route.copy()
         new_route[i:j] = selected_route[j - 1: i - 1: -1]
-        
+
         new_routes = routes.copy()
         new_routes[selected_route_index] = new_route
-        
-        if calc_total_distance(new_routes[selected_route_index], distance_matrix) < calc_total_distance(best_routes[selected_route_index], distance_matrix):
+
+        stats["moves_evaluated"] += 1
+        if calc_route_distance(new_routes[selected_route_index], distance_matrix) < calc_route_distance(best_routes[selected_route_index], distance_matrix):
           best_routes = new_routes
+          stats["improvements"] += 1
     return best_routes
-  
+
+  start = time.perf_counter()
+  stats = {"moves_evaluated": 0, "improvements": 0, "local_optimum": False}
+  routes = list(routes)
   for i in range(len(routes)):
     route = routes[i]
     optimized_route = two_opt_solver(model, [route], num_iterations)[0]
     routes[i] = optimized_route
-    
-  return routes
\ No newline at end of file
+
+  stats["elapsed"] = time.perf_counter() - start
+  stats["moves_per_second"] = stats["moves_evaluated"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+  count("moves_evaluated", stats["moves_evaluated"])
+  count("improving_moves", stats["improvements"])
+  return routes, stats
+
+
+if __name__ == '__main__':
+  print('quick test')
+  rng = np.random.default_rng(0)
+  coords = rng.integers(0, 1000, size=(200, 2))
+  matrix = np.abs(coords[:, None, :] - coords[None, :, :]).sum(axis=2)
+  model = {"distance_matrix": matrix}
+  route = [0] + list(rng.permutation(np.arange(1, 200))) + [0]
+
+  def length(r):
+    return int(matrix[r[:-1], r[1:]].sum())
+
+  for strategy in ("first", "best"):
+    new_routes, stats = two_opt_search(model, [route], strategy=strategy)
+    print(strategy, length(np.array(route)), '->', length(np.array(new_routes[0])),
+          '{:.0f} moves/s'.format(stats["moves_per_second"]), 'local optimum:', stats["local_optimum"])
+  new_routes, stats = sampled_two_opt(model, [list(route)], 1000)
+  print('sampled', length(np.array(route)), '->', length(np.array(new_routes[0])),
+        '{:.0f} moves/s'.format(stats["moves_per_second"]))
@@ -1,280 +1,351 @@
-from data.models import create_model, assign_demand
-from data.graphs import draw_solution, draw_map
-from algorithms.nearest_neighbor import nearest_neighbor
-from algorithms.two_opt import two_opt
-from algorithms.guided_local_search import guided_local_search
-from algorithms.tabu_search import tabu_search
-from data.results import save_results
-import time
+from data.models import create_model, assign_demand, fingerprint_model
+from data.instances import load_map, instance_hash, INSTANCE_DIR
+from algorithms.random_solution import random_routes
+from algorithms.route_cost import calc_route_distance, calc_total_distance
+from algorithms.ortools_model import (compare_transit_registration, calc_route_distance_ortools,
+                                      calc_total_distance_ortools, get_routes_ortools, model_cache)
+from algorithms.registry import solve
+from algorithms.solution_cache import open_cache
+from data.results import (ResultsSink, RESULTS_PATH, save_traces, traces_path,
+                          load_traces, save_solutions, load_solutions, solutions_path, runs_path)
+from runner import run_jobs
+from instrumentation import Recording, phase, write_records
+import argparse
 import numpy as np
-import copy
 
-def random_routes(data):
-  """
-  Returns a random assignment of routes to the vehicles
-  """
-  distance_matrix = data["distance_matrix"]
-  num_vehicles = data["num_vehicles"]
-  num_locations = len(distance_matrix)
-  depot_index = data["depot"]
-  routes = [[] for _ in range(num_vehicles)]
-
-  locations = list(range(num_locations))
-  locations.remove(depot_index)
-  np.random.shuffle(locations)
-
-  for i, location in enumerate(locations):
-    routes[i % num_vehicles].append(location)
-
-  for route in routes:
-    route.insert(0, depot_index)
-    route.append(depot_index)
-
-  return routes
-
-
-def calc_route_distance(route, dist_matrix):
+def test_nearest_neighbour(model):
   """
-  Calculate distance of a route taken by a vehicle
-  For algorithms implemented by us
+  Returns routes, total distance and execution time of nearest neighbour algorithm
   """
-  total_dist = 0
-  num_locations = len(route)
-    
-  for i in range(num_locations - 1):
-    curr_location = route[i]
-    next_location = route[i + 1]
-    total_dist += dist_matrix[curr_location][next_location]
-  
-  return total_dist
+  result = solve("nn", model)
+  return result.routes, result.cost, result.wall_time
 
 
-def calc_total_distance(routes, distance_matrix):
+def test_random(model):
   """
-  Calculate the total distance travelled by every vehicle
-  For algorithms implemented by us
+  Returns routes, total distance and execution time of randomized algorithm
   """
-  total = 0
-  for route in routes:
-    total += calc_route_distance(route, distance_matrix)
-  return total
+  result = solve("random", model)
+  return result.routes, result.cost, result.wall_time
 
 
-def calc_route_distance_ortools(routing, solution, vehicle_id):
+def test_two_opt(model, init_routes, iterations):
   """
-  Calculate distance of a route taken by a vehicle
-  For algorithms implemented by OR-Tools
+  Returns routes, total distance and execution time of two-opt algorithm
   """
-  total_dist = 0
-  index = routing.Start(vehicle_id)
-    
-  while not routing.IsEnd(index):
-    previous_index = index
-    index = solution.Value(routing.NextVar(index))
-    total_dist += routing.GetArcCostForVehicle(
-        previous_index, index, vehicle_id
-    )
-  
-  return total_dist
+  result = solve("two_opt", model, time_limit=None, solution_limit=iterations, initial_routes=init_routes)
+  return result.routes, result.cost, result.wall_time
 
 
-def calc_total_distance_ortools(num_vehicles, routing, solution):
+def test_guided_local_search(model, time_limit=1):
   """
-  Calculate the total distance travelled by every vehicle
-  For algorithms implemented by OR-Tools
+  Returns routes, total distance and execution time of guided local search algorithm
   """
-  total = 0
-  for vehicle_id in range(num_vehicles):
-    total += calc_route_distance_ortools(routing, solution, vehicle_id)
-  return total
+  result = solve("gls", model, time_limit)
+  return result.routes, result.cost, result.wall_time
 
 
-def get_routes_ortools(manager, routing, solution, num_vehicles):
+def test_tabu_search(model, time_limit=1):
   """
-  Returns routes of OR-Tools algorithms
+  Returns routes, total distance and execution time of tabu search algorithm
   """
-  routes = []
-
-  for vehicle_id in range(num_vehicles):
-    vehicle_route = []
-    index = routing.Start(vehicle_id)
-    while not routing.IsEnd(index):
-      node_index = manager.IndexToNode(index)
-      vehicle_route.append(node_index)
-      index = solution.Value(routing.NextVar(index))
-    vehicle_route.append(manager.IndexToNode(index))
-    routes.append(vehicle_route)
+  result = solve("tabu", model, time_limit)
+  return result.routes, result.cost, result.wall_time
 
-  return routes
 
-
-def test_nearest_neighbour(model):
+def compare_warm_start(model, algorithm="gls", start="nn", time_limit=1):
   """
-  Returns routes, total distance and execution time of nearest neighbour algorithm
+  Solves the model with an OR-Tools algorithm cold and warm-started from the routes of the start algorithm.
+  Returns the final cost of each and the time each first reached the final cost of the cold start
+  (the quality both can reach); the warm time includes building its starting routes
   """
-  start = time.perf_counter_ns()
-  routes = nearest_neighbor(model)
-  end = time.perf_counter_ns()
-  exec_time = (end - start) / 1000000000
-  distance = calc_total_distance(routes, model['distance_matrix'])
+  def time_to_cost(trace, target, offset):
+    for elapsed, cost in trace:
+      if target is not None and cost <= target:
+        return offset + elapsed
+    return None
 
-  return routes, distance, exec_time
+  # both runs build the routing model from scratch
+  model_cache.clear()
+  cold = solve(algorithm, model, time_limit)
+  model_cache.clear()
+  start_result = solve(start, model, time_limit=None)
+  warm = solve(algorithm, model, time_limit, initial_routes=start_result.routes)
 
+  return {
+    "target": cold.cost,
+    "cold": {"cost": cold.cost, "time_to_target": time_to_cost(cold.stats["trace"], cold.cost, 0)},
+    "warm": {"cost": warm.cost, "time_to_target": time_to_cost(warm.stats["trace"], cold.cost, start_result.wall_time)},
+  }
 
-def test_random(model):
-  """
-  Returns routes, total distance and execution time of randomized algorithm
-  """
-  start = time.perf_counter_ns()
-  routes = random_routes(model)
-  end = time.perf_counter_ns()
-  exec_time = (end - start) / 1000000000
-  distance = calc_total_distance(routes, model['distance_matrix'])
-
-  return routes, distance, exec_time
 
+def change_fleet_config(model, num_vehicles, capacities, num_locations, rng=None):
+  model['num_vehicles'] = num_vehicles
+  model['vehicle_capacities'] = capacities
+  model['demands'] = assign_demand(num_locations, np.sum(capacities), min(capacities), rng)
+  return model
 
-def test_two_opt(model, init_routes, iterations):
-  """
-  Returns routes, total distance and execution time of two-opt algorithm
-  """
-  start = time.perf_counter_ns()
-  routes = two_opt(model, copy.deepcopy(init_routes), iterations)
-  end = time.perf_counter_ns()
-  exec_time = (end - start) / 1000000000
-  distance = calc_total_distance(routes, model['distance_matrix'])
 
-  return routes, distance, exec_time
+# algorithms of a benchmark cell in the column order of the results spreadsheet:
+# figure name, registered solver and solver options (the job time limit applies unless overridden).
+# The Two-Opt solution_limit caps the improving moves per route; the original two_opt made 1000 random tries
+ALGORITHMS = {
+  "nn": ('Nearest Neighbour', "nn", {}),
+  "two_opt_nn": ('Two-Opt (NN)', "two_opt", {"time_limit": None, "solution_limit": 1000}),
+  "random": ('Random Solution', "random", {}),
+  "two_opt_rand": ('Two-Opt (RAND)', "two_opt_rand", {"time_limit": None, "solution_limit": 1000}),
+  "gls": ('Guided Local Search', "gls", {}),
+  "ts": ('Tabu Search', "tabu", {}),
+}
 
 
-def test_guided_local_search(model):
+def derive_seed(*keys):
   """
-  Returns routes, total distance and execution time of guided local search algorithm
+  Returns a 32 bit seed derived from the given integers
   """
-  start = time.perf_counter_ns()
-  manager, routing, solution = guided_local_search(model)
-  end = time.perf_counter_ns()
-  exec_time = (end - start) / 1000000000
-  distance = calc_total_distance_ortools(model["num_vehicles"], routing, solution) if solution else None
-  routes = get_routes_ortools(manager, routing, solution, model["num_vehicles"]) if solution else None
+  return int(np.random.SeedSequence(list(keys)).generate_state(1)[0])
 
-  return routes, distance, exec_time
 
-
-def test_tabu_search(model):
-  """
-  Returns routes, total distance and execution time of tabu search algorithm
+def build_jobs(fleet_ratios, location_counts, vehicle_capacity, seed, time_limit=1, instance_dir=INSTANCE_DIR,
+               instrument=None, cache=None):
   """
-  start = time.perf_counter_ns()
-  manager, routing, solution = tabu_search(model)
-  end = time.perf_counter_ns()
-  exec_time = (end - start) / 1000000000
-  distance = calc_total_distance_ortools(model["num_vehicles"], routing, solution) if solution else None
-  routes = get_routes_ortools(manager, routing, solution, model["num_vehicles"]) if solution else None
-
-  return routes, distance, exec_time
-
-
-def test_small_map():
+  Returns one independent job per (map, fleet ratio, algorithm) cell.
+  Each job carries the explicit seeds needed to rebuild its instance, so results do not depend on
+  which process runs it (apart from the time-limited OR-Tools searches, which stop on wall-clock time).
+  Maps are loaded from the instance store in instance_dir, or generated in memory if it is None.
+  instrument, a dict of Recording options (memory, profile_dir), has every job recorded.
+  cache is the path of a SQLite solution cache the jobs look their solutions up in and store them to
   """
-  Test a series of small maps with 10 points and 2 vehicles with the same capacity
-	"""
-  model, coords = create_model(50,10,2,[5,10])
-  draw_map(coords, 'small', True)
-  test_all_algorithms(model, coords, 'small_map')
+  jobs = []
+  for count_index, num_locations in enumerate(location_counts):
+    for ratio_index, fleet_ratio in enumerate(fleet_ratios):
+      for algorithm in ALGORITHMS:
+        jobs.append({
+          "algorithm": algorithm,
+          "num_locations": num_locations,
+          "fleet_size": int(num_locations * fleet_ratio),
+          "vehicle_capacity": vehicle_capacity,
+          "time_limit": time_limit,
+          "count_index": count_index,
+          "ratio_index": ratio_index,
+          "map_seed": derive_seed(seed, count_index),
+          "fleet_seed": derive_seed(seed, count_index, ratio_index),
+          "instance_dir": instance_dir,
+          "instrument": instrument,
+          "cache": cache,
+        })
+  return jobs
 
 
-def test_all_algorithms(model, coords, config_name, count_index, ratio_index):
+def build_instance(job):
   """
-  Run each algorithm on the given model and save to PNG with the given config name
+  Rebuilds the model and coordinates of a job from its seeds, with a DistanceOracle if the job is lazy
   """
-  nn_routes, nn_distance, nn_time = test_nearest_neighbour(model)
-  to_routes, to_distance, to_time = test_two_opt(model, nn_routes, 1000)
-  rand_routes, rand_distance, rand_time = test_random(model)
-  to_rand_routes, to_rand_distance, to_rand_time = test_two_opt(model, rand_routes, 1000)
-  gls_routes, gls_distance, gls_time = test_guided_local_search(model)
-  ts_routes, ts_distance, ts_time = test_tabu_search(model)
+  model, coords, _ = build_map(job)
+  return set_fleet(job, model), coords
 
-  save_distances(nn_distance, to_distance, rand_distance, to_rand_distance, gls_distance, ts_distance, count_index, ratio_index)
-  save_times(nn_time, to_time, rand_time, to_rand_time, gls_time, ts_time, count_index, ratio_index)
 
-  draw_map(coords, config_name, True)
-  draw_solution(coords, nn_routes, config_name + ' Nearest Neighbour')
-  draw_solution(coords,to_routes, config_name + ' Two-Opt (NN)')
-  draw_solution(coords, rand_routes, config_name + ' Random Solution')
-  draw_solution(coords, to_rand_routes, config_name + ' Two-Opt (RAND)')
-  draw_solution(coords, gls_routes, config_name + ' Guided Local Search')
-  draw_solution(coords, ts_routes, config_name + ' Tabu Search')
-
-
-def test_fleets(model, coords, vehicle_capacity, fleet_ratio, num_locations, count_index):
+def build_map(job):
   """
-  Test different fleet configurations on the same network of locations and demands
+  Returns the (model, coords, map hash) of the map of a job before its fleet is set. The map hash is the
+  fingerprint the instance store recorded for the map (see instance_hash), so results can be traced back to it
   """
-  for i in range(len(fleet_ratio)):
-    fleet_size = int(num_locations * fleet_ratio[i])
-    model = change_fleet_config(model, fleet_size, [vehicle_capacity]*fleet_size, num_locations)
-    test_all_algorithms(model, coords, '{x}L, {y}V, Equal Capacity'.format(x=num_locations, y=fleet_size), count_index, i)
+  num_locations = job["num_locations"]
+  # initially created using 1 vehicle with enough capacity to hit every location, the fleet is set by set_fleet
+  lazy = job.get("lazy", False)
+  if job.get("instance_dir"):
+    model, coords = load_map(1000, num_locations, job["map_seed"], job["instance_dir"], lazy)
+    return model, coords, instance_hash(1000, num_locations, job["map_seed"], job["instance_dir"], lazy)
+  model, coords = create_model(1000, num_locations, 1, [num_locations], seed=job["map_seed"], lazy=lazy)
+  return model, coords, fingerprint_model(model)
 
 
-def test_fleet_configs_on_maps(fleet_ratios, location_counts, vehicle_capacity):
+def set_fleet(job, model):
   """
-  Runs each algorithm on a set of maps. Tests multiple fleet configurations for each map.
-  Each algorithm runs every combination of fleet size and location count.
+  Gives the map of a job its fleet and the demands drawn from its fleet seed
   """
-  for i in range(len(location_counts)):
-    location_count = location_counts[i]
-    print('testing {i} locations'.format(i=location_count))
-    # initially created using 1 vehicle with enough capacity to hit every location. Modified in test_fleets
-    model, coords = create_model(1000, location_count, 1, [location_count])
-    test_fleets(model, coords, vehicle_capacity, fleet_ratios, location_count, i)
+  fleet_size = job["fleet_size"]
+  return change_fleet_config(model, fleet_size, [job["vehicle_capacity"]]*fleet_size, job["num_locations"],
+                             np.random.default_rng(job["fleet_seed"]))
 
 
-def save_distances(nn_dist, to_dist, rand_dist, to_rand_dist, gls_dist, ts_dist, count_index, ratio_index):
+def run_job(job):
   """
-  Saves the distances outputted from the algorithms
+  Runs the algorithm of a single job and returns its routes, distance and execution time,
+  the fingerprint of the instance it solved and the hash of its map in the instance store.
+  If the job has instrument options the run is recorded and its record returned under "record"
   """
-  row = ((count_index * 4) + 4) + ratio_index
+  if not job.get("instrument"):
+    return solve_job(job)
+  name = '{}L_{}V_{}'.format(job["num_locations"], job["fleet_size"], job["algorithm"])
+  with Recording(name, algorithm=job["algorithm"], num_locations=job["num_locations"], fleet_size=job["fleet_size"],
+                 seed=job["fleet_seed"], **job["instrument"]) as run:
+    result = solve_job(job)
+  run.record.update(instance=result["instance"], map=result["map"], map_seed=job["map_seed"],
+                    distance=result["distance"], solver_time=result["time"],
+                    construction_time=result["construction_time"])
+  result["record"] = run.record
+  return result
 
-  save_results(f"C{row}", nn_dist)
-  save_results(f"D{row}", to_dist)
-  save_results(f"E{row}", rand_dist)
-  save_results(f"F{row}", to_rand_dist)
-  save_results(f"G{row}", gls_dist)
-  save_results(f"H{row}", ts_dist)
 
-
-def save_times(nn_time, to_time, rand_time, to_rand_time, gls_time, ts_time, count_index, ratio_index):
+def solve_job(job):
   """
-  Saves the times outputted from the algorithms
+  Builds the instance of a job and solves it, see run_job
   """
-  row = ((count_index * 4) + 27) + ratio_index
-
-  save_results(f"C{row}", nn_time)
-  save_results(f"D{row}", to_time)
-  save_results(f"E{row}", rand_time)
-  save_results(f"F{row}", to_rand_time)
-  save_results(f"G{row}", gls_time)
-  save_results(f"H{row}", ts_time)
-
-
-def change_fleet_config(model, num_vehicles, capacities, num_locations):
-  model['num_vehicles'] = num_vehicles
-  model['vehicle_capacities'] = capacities
-  model['demands'] = assign_demand(num_locations, np.sum(capacities), min(capacities))
-  return model
-
-
-def benchmark_suite():
+  with phase("instance build"):
+    model, coords, map_hash = build_map(job)
+    model = set_fleet(job, model)
+  # random_routes uses the global numpy generator, seeding it per cell gives Random and Two-Opt (RAND) the same start
+  np.random.seed(job["fleet_seed"])
+  _, solver, options = ALGORITHMS[job["algorithm"]]
+  options = dict({"time_limit": job["time_limit"]}, **options)
+  cache = open_cache(job["cache"]) if job.get("cache") else None
+  result = solve(solver, model, cache=cache, **options)
+  # as in the original spreadsheet, the Two-Opt columns time the improvement of their starting routes only,
+  # building the NN or random start is reported apart
+  construction_time = result.stats.get("construction_time", 0.0)
+  return {"job": job, "coords": coords, "routes": result.routes, "distance": result.cost,
+          "time": result.wall_time - construction_time, "construction_time": construction_time,
+          "iterations": result.stats.get("iterations"), "trace": result.stats["trace"],
+          "instance": fingerprint_model(model), "map": map_hash, "cache": result.stats.get("cache")}
+
+
+def benchmark_suite(workers=None, seed=0, threads_per_worker=1, output=RESULTS_PATH, checkpoint_every=None,
+                    time_limit=1, instance_dir=INSTANCE_DIR, plots=True, instrument=None, cache=None):
   """
   Run a series of tests on each algorithm and save the results
+  Every (map, fleet ratio, algorithm) cell runs as its own job on a pool of worker processes.
+  Results are collected in a ResultsSink and written once at the end (or every checkpoint_every rows).
+  The solution improvement trace of every run is saved next to the results, and so are the routes.
+  Once every job is done the maps, solutions and convergence curves are rendered on the pool,
+  unless plots is False (render_saved draws them later from the saved files).
+  time_limit is the budget in seconds of each OR-Tools search.
+  Maps are generated once into instance_dir and memory-mapped by every job (None generates them per job);
+  each result row records the fingerprint of its instance and the hash and seed of its stored map.
+  With instrument (a dict of Recording options, possibly empty) every job is recorded and the records are
+  written as JSON lines to <output>_runs.jsonl, followed by one for writing the results.
+  With cache, the path of a SQLite file, cells solved before with the same settings reuse their solution;
+  a reused solution reports the time and trace of the solve that found it
   """
   print('starting benchmarks...')
   fleet_ratios = [0.75, 0.5, 0.25, 0.15]
   location_counts = [10,50,100,200]
   vehicle_capacity = 20
-  test_fleet_configs_on_maps(fleet_ratios, location_counts, vehicle_capacity)
+  jobs = build_jobs(fleet_ratios, location_counts, vehicle_capacity, seed, time_limit, instance_dir, instrument,
+                    cache)
+  print('running {n} jobs'.format(n=len(jobs)))
+  results = run_jobs(run_job, jobs, workers, threads_per_worker)
+  if cache is not None:
+    hits = sum(result["cache"] == "hit" for result in results)
+    print('solution cache: {h} hits, {m} misses'.format(h=hits, m=len(results) - hits))
+
+  sink = ResultsSink(output, checkpoint_every=checkpoint_every)
+  traces = []
+  solutions = []
+  for cell in range(0, len(results), len(ALGORITHMS)):
+    cell_results = results[cell:cell + len(ALGORITHMS)]
+    job = cell_results[0]["job"]
+    config_name = '{x}L, {y}V, Equal Capacity'.format(x=job["num_locations"], y=job["fleet_size"])
+    for result in cell_results:
+      sink.add(config_name, result["job"]["algorithm"], job["fleet_seed"], result["distance"], result["time"],
+               result["iterations"], count_index=job["count_index"], ratio_index=job["ratio_index"],
+               construction_time=result["construction_time"], instance=result["instance"], map=result["map"],
+               map_seed=job["map_seed"])
+      traces.append({"config": config_name, "algorithm": result["job"]["algorithm"], "seed": job["fleet_seed"],
+                     "trace": result["trace"]})
+    solutions.append({"config": config_name, "coords": np.asarray(cell_results[0]["coords"]).tolist(),
+                      "solutions": {ALGORITHMS[result["job"]["algorithm"]][0]: routes_list(result["routes"])
+                                    for result in cell_results}})
+  with Recording('write results', **(instrument or {})) as writing, phase("result write"):
+    sink.close()
+    save_traces(traces_path(output), traces)
+    save_solutions(solutions_path(output), solutions)
+  if instrument is not None:
+    write_records(runs_path(output), [result["record"] for result in results] + [writing.record], "w")
   print('benchmark suite complete.')
-
-
-benchmark_suite()
\ No newline at end of file
+  if plots:
+    render_saved(output, workers)
+
+
+def render_saved(output=RESULTS_PATH, workers=None):
+  """
+  Renders the map, solution and convergence figures of every configuration from the solutions and traces
+  saved next to the output file, on a pool of worker processes
+  """
+  from data.graphs import render_figures
+  traces = {}
+  for record in load_traces(traces_path(output)):
+    traces.setdefault(record["config"], {})[ALGORITHMS[record["algorithm"]][0]] = record["trace"]
+  figures = [dict(record, traces=traces.get(record["config"], {})) for record in load_solutions(solutions_path(output))]
+  count = render_figures(figures, workers)
+  print('rendered {n} figures'.format(n=count))
+
+
+def routes_list(routes):
+  """
+  Returns routes as lists of ints for saving, None stays None
+  """
+  return [[int(location) for location in route] for route in routes] if routes is not None else None
+
+
+def main(argv=None):
+  """
+  Runs the benchmark command line, argv defaults to the arguments of the process
+  """
+  parser = argparse.ArgumentParser(description='Run the VRP benchmark suite')
+  parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+  parser.add_argument('--seed', type=int, default=0, help='seed the instances are generated from')
+  parser.add_argument('--threads-per-worker', type=int, default=1,
+                      help='threads each solve uses itself, limits the default number of workers')
+  parser.add_argument('--output', default=RESULTS_PATH,
+                      help='results file, the format follows the extension (.xlsx, .csv, .parquet, .sqlite)')
+  parser.add_argument('--checkpoint-every', type=int, default=None, help='write results every N rows')
+  parser.add_argument('--time-limit', type=float, default=1, help='seconds each OR-Tools search may run')
+  parser.add_argument('--instance-dir', default=INSTANCE_DIR, help='directory the generated maps are stored in')
+  parser.add_argument('--no-instance-store', action='store_true',
+                      help='generate the maps in every job instead of storing them')
+  parser.add_argument('--no-plots', action='store_true',
+                      help='skip rendering the figures (the solutions are still saved for --render-only)')
+  parser.add_argument('--render-only', action='store_true',
+                      help='only render the figures of the solutions saved next to --output by an earlier run')
+  parser.add_argument('--instrument', action='store_true',
+                      help='time the phases and count the moves and solutions of every run, into <output>_runs.jsonl')
+  parser.add_argument('--trace-memory', action='store_true',
+                      help='also record the peak Python and NumPy memory of every run (implies --instrument)')
+  parser.add_argument('--profile-dir', default=None,
+                      help='also profile every run with cProfile into this directory (implies --instrument)')
+  parser.add_argument('--cache', default=None, metavar='PATH',
+                      help='reuse the solutions of cells solved before with the same settings, stored in this SQLite file')
+  parser.add_argument('--compare-transits', type=int, metavar='LOCATIONS', default=None,
+                      help='only compare native and callback OR-Tools transits on a map of this size')
+  parser.add_argument('--compare-warm-start', type=int, metavar='LOCATIONS', default=None,
+                      help='only compare cold and warm-started OR-Tools searches on a map of this size')
+  args = parser.parse_args(argv)
+  instrument = None
+  if args.instrument or args.trace_memory or args.profile_dir:
+    instrument = {"memory": args.trace_memory, "profile_dir": args.profile_dir}
+  if args.render_only:
+    render_saved(args.output, args.workers)
+  elif args.compare_warm_start:
+    num_vehicles = args.compare_warm_start // 4
+    model, _ = create_model(1000, args.compare_warm_start, num_vehicles, [20]*num_vehicles, seed=args.seed)
+    for algorithm in ("gls", "tabu"):
+      for start in ("nn", "two_opt"):
+        comparison = compare_warm_start(model, algorithm, start, args.time_limit)
+        times = ['{:.3f}s'.format(t) if t is not None else 'never' for t in
+                 (comparison["cold"]["time_to_target"], comparison["warm"]["time_to_target"])]
+        print('{a} warm-started from {s}: cold cost {c}, warm cost {w}, time to cold cost: cold {ct}, warm {wt}'.format(
+          a=algorithm, s=start, c=comparison["cold"]["cost"], w=comparison["warm"]["cost"], ct=times[0], wt=times[1]))
+  elif args.compare_transits:
+    model, _ = create_model(1000, args.compare_transits, args.compare_transits // 4, [20]*(args.compare_transits // 4), seed=args.seed)
+    for mode, stats in compare_transit_registration(model).items():
+      print('{mode}: {s:.0f} solutions/s, {b:.0f} branches/s, objective {o}'.format(
+        mode=mode, s=stats["solutions_per_second"], b=stats["branches_per_second"], o=stats["objective"]))
+  else:
+    benchmark_suite(args.workers, args.seed, args.threads_per_worker, args.output, args.checkpoint_every,
+                    args.time_limit, None if args.no_instance_store else args.instance_dir, not args.no_plots,
+                    instrument, args.cache)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,85 @@
+"""
+Nearest neighbour regression check - fails when nearest_neighbor, its NumPy fallback and the original
+per-step scan disagree on any of MAPS (with and without a start node), or when the compiled construction
+of the 200-location, 150-vehicle map takes longer than CONSTRUCTION_BUDGET.
+Run it before merging with `python3 src/check_nearest_neighbor.py`
+"""
+
+import time
+import numpy as np
+from algorithms.kernels import compiled_construction
+from algorithms.nearest_neighbor import (nearest_neighbor, numpy_nearest_neighbor, nearest_neighbor_batch,
+                                         nearest_neighbor_reference)
+from data.models import create_model
+
+# (locations, vehicles, smallest demand); the last two are capacity-tight: most vehicles fit one or two stops
+# and some locations stay unserved
+MAPS = [(10, 2, 1), (50, 12, 1), (200, 30, 1), (200, 150, 1), (400, 100, 1), (50, 30, 8), (200, 100, 10)]
+# seconds allowed for the compiled construction of the 200-location, 150-vehicle map
+CONSTRUCTION_BUDGET = 0.0005
+
+
+def grid_model(num_locations, num_vehicles, min_demand, rng):
+  """
+  A random Manhattan map on a small grid, so that many distances tie
+  """
+  coords = rng.integers(0, 50, size=(num_locations, 2))
+  return {
+    "distance_matrix": np.abs(coords[:, None, :] - coords[None, :, :]).sum(axis=2),
+    "num_vehicles": num_vehicles,
+    "demands": [0] + list(rng.integers(min_demand, 19, size=num_locations - 1)),
+    "vehicle_capacities": [20] * num_vehicles,
+    "depot": 0,
+  }
+
+
+def check_routes(name, routes, expected):
+  """
+  Raises AssertionError naming the map if routes differ from expected
+  """
+  if routes != expected:
+    raise AssertionError("{}: nearest_neighbor differs from the reference in vehicle {}".format(
+      name, next(v for v, (a, b) in enumerate(zip(routes + [None], expected + [None])) if a != b)))
+
+
+def check_nearest_neighbor(budget=CONSTRUCTION_BUDGET, runs=20):
+  """
+  Raises AssertionError on the first mismatch or if the compiled construction is over budget.
+  Returns the fastest construction of the 200-location, 150-vehicle map in seconds
+  """
+  rng = np.random.default_rng(0)
+  for num_locations, num_vehicles, min_demand in MAPS:
+    model = grid_model(num_locations, num_vehicles, min_demand, rng)
+    name = "{}L, {}V".format(num_locations, num_vehicles)
+    expected = [[int(x) for x in route] for route in nearest_neighbor_reference(model)]
+    check_routes(name, nearest_neighbor(model), expected)
+    check_routes(name + " (NumPy)", numpy_nearest_neighbor(model), expected)
+    # a start node is visited first by the first vehicle, the same as in the batch; the depot is ignored
+    start_nodes = [0, 1, num_locations // 2, num_locations - 1]
+    for start_node, batch_routes in zip(start_nodes, nearest_neighbor_batch(model, start_nodes=start_nodes)):
+      check_routes("{} from {}".format(name, start_node), nearest_neighbor(model, start_node=start_node), batch_routes)
+      check_routes("{} from {} (NumPy)".format(name, start_node), numpy_nearest_neighbor(model, start_node=start_node),
+                   batch_routes)
+
+  # past CANDIDATE_MIN_LOCATIONS both constructions try the neighbour index first
+  model, _ = create_model(1000, 1000, 250, [20] * 250, seed=0)
+  check_routes("1000L, 250V (neighbour index)", nearest_neighbor(model), numpy_nearest_neighbor(model))
+
+  model = grid_model(200, 150, 1, rng)
+  nearest_neighbor(model)
+  best = float("inf")
+  for _ in range(runs):
+    start = time.perf_counter()
+    nearest_neighbor(model)
+    best = min(best, time.perf_counter() - start)
+  if compiled_construction() is not None and best > budget:
+    raise AssertionError("the 200L, 150V construction takes {:.0f} us, over the {:.0f} us budget".format(
+      best * 1e6, budget * 1e6))
+  return best
+
+
+if __name__ == '__main__':
+  print('quick test')
+  print('200L, 150V construction: {:.0f} us, budget {:.0f} us{}'.format(
+    check_nearest_neighbor() * 1e6, CONSTRUCTION_BUDGET * 1e6,
+    '' if compiled_construction() is not None else ' (numba not installed, NumPy fallback not held to it)'))
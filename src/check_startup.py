@@ -0,0 +1,27 @@
+"""
+Startup budget check - fails when a cold `cli.py solve --algo nn` takes longer than STARTUP_BUDGET or imports
+one of HEAVY_MODULES, so that a module-level import of OR-Tools, numba, matplotlib or pandas does not creep
+back into the light path unnoticed. Run it before merging with `python3 src/check_startup.py`
+"""
+
+import sys
+from cli import startup_report, STARTUP_BUDGET
+
+
+def check_startup(budget=STARTUP_BUDGET, runs=5):
+  """
+  Raises AssertionError if the fastest of runs cold starts is over budget or a heavy module is imported,
+  returns the fastest start in seconds otherwise
+  """
+  best, heavy, slowest = startup_report(runs)
+  if heavy:
+    raise AssertionError("solve --algo nn imports " + ", ".join(heavy))
+  if best > budget:
+    raise AssertionError("solve --algo nn starts in {:.3f}s, over the {:.3f}s budget (slowest imports: {})".format(
+      best, budget, ", ".join("{} {:.0f}ms".format(name, us / 1000) for us, name in slowest[:5])))
+  return best
+
+
+if __name__ == '__main__':
+  print('quick test')
+  print('cold start of solve --algo nn: {:.3f}s, budget {:.3f}s'.format(check_startup(), STARTUP_BUDGET))
@@ -0,0 +1,163 @@
+"""
+Command line entry point - solve a generated instance, run the benchmark suites or render their figures.
+Heavy libraries (OR-Tools, SciPy, matplotlib, openpyxl, numba) are only imported by the commands that need them.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+
+# seconds a cold `solve --algo nn` on a small map may take, process start-up included
+STARTUP_BUDGET = 0.5
+# modules `solve --algo nn` must not import
+HEAVY_MODULES = ["ortools", "scipy", "matplotlib", "openpyxl", "numba", "pyarrow", "pandas"]
+
+
+def solve_command(args):
+  """
+  Generates a map and solves it with a registered algorithm
+  """
+  from data.models import create_model
+  from algorithms.registry import solve
+  from instrumentation import Recording, phase, write_records
+  from algorithms.solution_cache import open_cache
+  num_vehicles = args.vehicles or max(1, args.locations // 4)
+  instrumented = args.instrument or args.trace_memory or args.profile_dir
+  with Recording(args.algo, args.trace_memory, args.profile_dir, algorithm=args.algo, num_locations=args.locations,
+                 fleet_size=num_vehicles, seed=args.seed) if instrumented else nullcontext() as run:
+    with phase("instance build"):
+      model, _ = create_model(1000, args.locations, num_vehicles, [args.capacity] * num_vehicles, seed=args.seed,
+                              lazy=args.lazy)
+    result = solve(args.algo, model, args.time_limit, cache=open_cache(args.cache) if args.cache else None)
+  cached = ''
+  if result.stats.get("cache") == "hit":
+    cached = ' (cached, looked up in {:.4f}s)'.format(result.stats["lookup_time"])
+  print('{}: cost {} in {:.4f}s{}'.format(args.algo, result.cost, result.wall_time, cached))
+  if instrumented:
+    run.record.update(distance=result.cost, solver_time=result.wall_time)
+    write_records(args.instrument or "-", [run.record])
+  if args.routes and result.routes is not None:
+    for route in result.routes:
+      print(' '.join(str(location) for location in route))
+  return 0
+
+
+def bench_command(args, rest):
+  """
+  Runs the benchmark with the remaining arguments, see `bench --help`
+  """
+  from benchmark import main
+  main(rest)
+  return 0
+
+
+def scale_command(args, rest):
+  """
+  Runs the scaling benchmark command in the remaining arguments, see `scale --help`
+  """
+  from scaling import main
+  return main(rest)
+
+
+def plot_command(args):
+  """
+  Renders the figures of the solutions saved by an earlier benchmark run
+  """
+  from benchmark import render_saved
+  from data.results import RESULTS_PATH
+  render_saved(args.output or RESULTS_PATH, args.workers)
+  return 0
+
+
+def startup_report(runs=5):
+  """
+  Times runs cold starts of `solve --algo nn` and records its imports with -X importtime.
+  Returns (fastest start in seconds, heavy modules imported, [(cumulative microseconds, module)] slowest first)
+  """
+  command = [sys.executable, __file__, "solve", "--algo", "nn", "--locations", "10"]
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, capture_output=True)
+    times.append(time.perf_counter() - start)
+
+  # -X importtime reports every module imported on stderr, as "import time: self | cumulative | name"
+  report = subprocess.run([sys.executable, "-X", "importtime"] + command[1:], check=True, capture_output=True,
+                          text=True).stderr
+  imported = [line.rsplit("|", 1)[-1].strip() for line in report.splitlines() if line.startswith("import time:")]
+  heavy = sorted({name.split(".")[0] for name in imported if name.split(".")[0] in HEAVY_MODULES})
+  cumulative = sorted((int(line.split("|")[1]), line.rsplit("|", 1)[-1].strip())
+                      for line in report.splitlines()[1:] if line.startswith("import time:"))
+  return min(times), heavy, cumulative[::-1]
+
+
+def startup_check_command(args):
+  """
+  Prints the cold start time of `solve --algo nn` and the heavy modules it imports.
+  Returns 1 if the fastest run is over budget or a heavy module was imported
+  """
+  best, heavy, slowest = startup_report(args.runs)
+  print('cold start of solve --algo nn: {:.3f}s (best of {}), budget {:.3f}s'.format(best, args.runs, args.budget))
+  print('slowest imports: ' + ', '.join('{} {:.0f}ms'.format(name, us / 1000) for us, name in slowest[:5]))
+  if heavy:
+    print('heavy modules imported: ' + ', '.join(heavy))
+  return 0 if best <= args.budget and not heavy else 1
+
+
+def build_parser():
+  parser = argparse.ArgumentParser(description='Vehicle routing solvers and benchmark')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  solve = commands.add_parser('solve', help='solve a generated map with one algorithm')
+  solve.add_argument('--algo', default='nn', help='registered solver name (default nn)')
+  solve.add_argument('--locations', type=int, default=100, help='locations including the depot')
+  solve.add_argument('--vehicles', type=int, default=None, help='vehicles (default a quarter of the locations)')
+  solve.add_argument('--capacity', type=int, default=20, help='capacity of every vehicle')
+  solve.add_argument('--seed', type=int, default=0, help='seed the map is generated from')
+  solve.add_argument('--time-limit', type=float, default=1, help='search budget in seconds')
+  solve.add_argument('--lazy', action='store_true', help='compute distances on demand instead of a matrix')
+  solve.add_argument('--routes', action='store_true', help='print the routes')
+  solve.add_argument('--cache', default=None, metavar='PATH', help='reuse solutions stored in this SQLite file')
+  solve.add_argument('--instrument', nargs='?', const='-', default=None, metavar='FILE',
+                     help='append the phase times and counters of the run to FILE as a JSON line (default: print)')
+  solve.add_argument('--trace-memory', action='store_true', help='also record the peak memory (implies --instrument)')
+  solve.add_argument('--profile-dir', default=None, help='also profile the run with cProfile into this directory')
+
+  commands.add_parser('bench', help='run the benchmark suite, the other arguments go to benchmark.py',
+                      add_help=False)
+
+  commands.add_parser('scale', help='scaling benchmark with repetitions (run, compare, show), see scaling.py',
+                      add_help=False)
+
+  plot = commands.add_parser('plot', help='render the figures of a finished benchmark run')
+  plot.add_argument('--output', default=None, help='results file the benchmark wrote')
+  plot.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+
+  check = commands.add_parser('check-startup', help='check the cold start time of solve --algo nn')
+  check.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='seconds allowed')
+  check.add_argument('--runs', type=int, default=5, help='cold starts timed, the fastest counts')
+  return parser
+
+
+def main(argv=None):
+  """
+  Runs a command, argv defaults to the arguments of the process. Returns the exit status
+  """
+  args, rest = build_parser().parse_known_args(argv)
+  if args.command == 'bench':
+    return bench_command(args, rest)
+  if args.command == 'scale':
+    return scale_command(args, rest)
+  if rest:
+    build_parser().error('unrecognized arguments: ' + ' '.join(rest))
+  if args.command == 'solve':
+    return solve_command(args)
+  if args.command == 'plot':
+    return plot_command(args)
+  return startup_check_command(args)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
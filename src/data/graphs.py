@@ -1,31 +1,92 @@
+import matplotlib
+# figures are only ever written to files, the non-interactive backend needs no display and starts fastest
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+import numpy as np
 
-def draw_solution(coords, routes, title):
+FIGURE_DIR = './src/data/figures'
+
+
+def draw_solution(coords, routes, title, directory=FIGURE_DIR):
   """
-  Draw the map with routes taken by vehicles as determined by a routing algorithm
+  Draw the map with routes taken by vehicles as determined by a routing algorithm.
+  All routes are drawn as one LineCollection, a colour per route
   """
-  x,y = draw_map(coords, title, False)
-  # routes have location index, the graph location is x[loc_index], y[loc_index]
-  # i have several plot calls to make (each route), but it looks like multiple things can be plotted at once
+  fig, ax = plt.subplots()
+  draw_locations(ax, coords, title)
   if routes:
-    for route in routes:
-      route_coords = [[x[index], y[index]] for index in route]
-      route_x, route_y = zip(*route_coords)
-      plt.plot(route_x, route_y)
-  plt.savefig('./src/data/figures/' + title + '.png')
-  plt.close()
+    coords = np.asarray(coords)
+    segments = [coords[np.asarray(route)] for route in routes if len(route) > 1]
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    ax.add_collection(LineCollection(segments, colors=[colors[i % len(colors)] for i in range(len(segments))]))
+  fig.savefig(directory + '/' + title + '.png')
+  plt.close(fig)
 
 
-def draw_map(coords, title, save):
+def draw_map(coords, title, save, directory=FIGURE_DIR):
   """
   Draw the empty map showing the depot and locations. Saves to png if save parameter is True
   """
-  x, y = zip(*coords)
-  plt.scatter(x[:1], y[:1], marker = 's', color = 'red', label='depot')
-  plt.scatter(x[1:],y[1:], label='location')
-  plt.title(title)
-  plt.legend()
+  fig, ax = plt.subplots()
+  draw_locations(ax, coords, title)
   if save:
-    plt.savefig('./src/data/figures/' + title + '_map.png')
-    plt.close()
-  return x, y
\ No newline at end of file
+    fig.savefig(directory + '/' + title + '_map.png')
+  plt.close(fig)
+  coords = np.asarray(coords)
+  return coords[:, 0], coords[:, 1]
+
+
+def draw_locations(ax, coords, title):
+  """
+  Scatter the depot and the locations on ax
+  """
+  coords = np.asarray(coords)
+  ax.scatter(coords[:1, 0], coords[:1, 1], marker='s', color='red', label='depot')
+  ax.scatter(coords[1:, 0], coords[1:, 1], label='location')
+  ax.set_title(title)
+  ax.legend()
+
+
+def draw_convergence(traces, title, directory=FIGURE_DIR):
+  """
+  Draw the best cost found over time by each algorithm, from their (elapsed seconds, cost) traces.
+  traces maps an algorithm name to its trace. Saves to png
+  """
+  fig, ax = plt.subplots()
+  for name, trace in traces.items():
+    if trace:
+      elapsed, cost = zip(*trace)
+      ax.step(elapsed, cost, where='post', marker='.', label=name)
+  ax.set_xlabel('time (s)')
+  ax.set_ylabel('total distance')
+  ax.set_title(title)
+  ax.legend()
+  fig.savefig(directory + '/' + title + '_convergence.png')
+  plt.close(fig)
+
+
+def render_config(figure):
+  """
+  Draws the map, the solution of every algorithm and the convergence curves of one configuration.
+  figure holds the config name, coords, {algorithm name: routes} solutions, {algorithm name: trace} traces
+  and the output directory. Run by render_figures. Returns the number of images saved
+  """
+  directory = figure.get('directory', FIGURE_DIR)
+  draw_map(figure['coords'], figure['config'], True, directory)
+  for name, routes in figure['solutions'].items():
+    draw_solution(figure['coords'], routes, figure['config'] + ' ' + name, directory)
+  saved = 1 + len(figure['solutions'])
+  if figure.get('traces'):
+    draw_convergence(figure['traces'], figure['config'], directory)
+    saved += 1
+  return saved
+
+
+def render_figures(figures, workers=None):
+  """
+  Renders every configuration's figures (see render_config) on a pool of worker processes.
+  Returns the number of images written
+  """
+  from runner import run_jobs
+  return sum(run_jobs(render_config, figures, workers))
@@ -0,0 +1,122 @@
+"""
+Instance store - generated maps saved once as .npy files and memory-mapped on every later load,
+so repeated and parallel runs share the same pages instead of rebuilding the distance matrix.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from data.models import create_model, fingerprint_model, Instance, DistanceOracle
+
+INSTANCE_DIR = "./src/data/instances"
+
+# array fields stored as one .npy file each
+ARRAY_FIELDS = ["coords", "distance_matrix", "neighbors", "demands", "vehicle_capacities"]
+
+
+def instance_path(directory, distance_scale, num_locations, seed, lazy=False):
+  """
+  Returns the directory holding the stored map of a (distance scale, location count, seed).
+  A lazy map (a DistanceOracle instead of a dense matrix) is stored apart from the dense one, since the two
+  solve and fingerprint differently
+  """
+  return os.path.join(directory, "{}_{}_{}{}".format(distance_scale, num_locations, seed, "_lazy" if lazy else ""))
+
+
+def load_map(distance_scale, num_locations, seed, directory=INSTANCE_DIR, lazy=False):
+  """
+  Returns the (data, coords) of create_model(distance_scale, num_locations, 1, [num_locations], seed),
+  the single vehicle base map the benchmark changes the fleet of, generating and storing it on first use.
+  Stored arrays are opened read-only with np.load(mmap_mode='r')
+  """
+  if seed is None:
+    raise ValueError("stored maps need a seed")
+  path = instance_path(directory, distance_scale, num_locations, seed, lazy)
+  if not os.path.isdir(path):
+    data, _ = create_model(distance_scale, num_locations, 1, [num_locations], seed=seed, lazy=lazy)
+    save_instance(path, data, {"distance_scale": distance_scale, "num_locations": num_locations, "seed": seed})
+  data = load_instance(path)
+  return data, data["coords"]
+
+
+def save_instance(path, data, meta=None):
+  """
+  Saves an Instance as one .npy file per array plus a meta.json with the scalar fields and its fingerprint.
+  The files are written to a temporary directory that is renamed into place, so a concurrent writer of the
+  same map either wins the rename or leaves the other's files untouched
+  """
+  meta = dict(meta or {}, num_vehicles=int(data["num_vehicles"]), depot=int(data["depot"]),
+              hash=fingerprint_model(data))
+  parent = os.path.dirname(os.path.abspath(path))
+  os.makedirs(parent, exist_ok=True)
+  staging = tempfile.mkdtemp(dir=parent)
+  try:
+    for key in ARRAY_FIELDS:
+      if key not in data:
+        continue
+      if isinstance(data[key], DistanceOracle):
+        # an oracle is rebuilt from the coordinates on load
+        meta["oracle_p"] = data[key].p
+        continue
+      np.save(os.path.join(staging, key + ".npy"), np.asarray(data[key]))
+    with open(os.path.join(staging, "meta.json"), "w") as file:
+      json.dump(meta, file, indent=1)
+    try:
+      os.rename(staging, path)
+    except OSError:
+      # another process stored the map first
+      if not os.path.isdir(path):
+        raise
+  finally:
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def load_instance(path, mmap=True):
+  """
+  Loads an Instance written by save_instance, memory-mapping its arrays unless mmap is False
+  """
+  meta = read_meta(path)
+  data = Instance(num_vehicles=meta["num_vehicles"], depot=meta["depot"])
+  for key in ARRAY_FIELDS:
+    file = os.path.join(path, key + ".npy")
+    if os.path.exists(file):
+      # saved with their compact dtypes already, so set directly to keep them mapped
+      setattr(data, key, np.load(file, mmap_mode="r" if mmap else None))
+  if "oracle_p" in meta:
+    data["distance_matrix"] = DistanceOracle(data["coords"], p=meta["oracle_p"])
+  return data
+
+
+def read_meta(path):
+  """
+  Returns the meta.json of a stored instance
+  """
+  with open(os.path.join(path, "meta.json")) as file:
+    return json.load(file)
+
+
+def instance_hash(distance_scale, num_locations, seed, directory=INSTANCE_DIR, lazy=False):
+  """
+  Returns the fingerprint of a stored map, as recorded when it was saved
+  """
+  return read_meta(instance_path(directory, distance_scale, num_locations, seed, lazy))["hash"]
+
+
+if __name__ == '__main__':
+  print('quick test')
+  import time
+  directory = tempfile.mkdtemp()
+  for attempt in ("generate", "load"):
+    start = time.perf_counter()
+    data, coords = load_map(1000, 2000, 0, directory)
+    print(attempt, '{:.3f}s'.format(time.perf_counter() - start), type(data["distance_matrix"]).__name__)
+  fresh, _ = create_model(1000, 2000, 1, [2000], seed=0)
+  assert fingerprint_model(data) == fingerprint_model(fresh) == instance_hash(1000, 2000, 0, directory)
+  # the lazy and dense forms of a map are stored apart, each load returns the form asked for
+  lazy, _ = load_map(1000, 2000, 0, directory, lazy=True)
+  assert isinstance(lazy["distance_matrix"], DistanceOracle)
+  assert isinstance(load_map(1000, 2000, 0, directory)[0]["distance_matrix"], np.ndarray)
+  assert fingerprint_model(lazy) == instance_hash(1000, 2000, 0, directory, lazy=True) != fingerprint_model(data)
+  shutil.rmtree(directory)
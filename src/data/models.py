@@ -1,14 +1,19 @@
 """
 Data models - serve as inputs to routing algorithms.
 Each model contains a distance matrix, number of vehicles, and the depot location.
+Generated models are compact Instance objects that are read like the dict models.
+Generated models also carry a k-nearest neighbour index used to restrict the heuristic searches.
 """
 
+import hashlib
 import math
 import random
-from scipy.spatial import distance_matrix
-import matplotlib.pyplot as plt
+from collections import OrderedDict
 import numpy as np
 
+# number of nearest locations kept per node in the neighbour index
+NUM_NEIGHBORS = 16
+
 def create_4L1V_data_model():
   """ 
   Returns a simple data model with 4 locations and 1 vehicle 
@@ -73,30 +78,298 @@ def create_6L2V_capacity_data_model():
   data["depot"] = 0
   return data
 
-def create_model(distance_scale, num_locations, num_vehicles, vehicle_capacities):
+class Instance:
+  """
+  A generated data model with a fixed set of fields, supporting the same data["key"] access as the dict models.
+  The distance matrix uses the smallest integer type that holds every distance (see compact_dtype),
+  demands and capacities are integer arrays
+  """
+  __slots__ = ("coords", "distance_matrix", "neighbors", "demands", "vehicle_capacities", "num_vehicles", "depot")
+
+  def __init__(self, **fields):
+    for key, value in fields.items():
+      self[key] = value
+
+  def __getitem__(self, key):
+    if key not in self.__slots__:
+      raise KeyError(key)
+    try:
+      return getattr(self, key)
+    except AttributeError:
+      raise KeyError(key) from None
+
+  def __setitem__(self, key, value):
+    if key not in self.__slots__:
+      raise KeyError(key)
+    if key in ("demands", "vehicle_capacities"):
+      value = np.asarray(value, dtype=np.int64)
+      value = value.astype(compact_dtype(value.max() if value.size else 0, signed=True))
+    setattr(self, key, value)
+
+  def __contains__(self, key):
+    return key in self.__slots__ and hasattr(self, key)
+
+  def get(self, key, default=None):
+    return getattr(self, key, default) if key in self.__slots__ else default
+
+  def keys(self):
+    return [key for key in self.__slots__ if hasattr(self, key)]
+
+  def nbytes(self):
+    """
+    Returns the memory held by the array fields in bytes
+    """
+    return sum(self[key].nbytes for key in self.keys() if isinstance(self[key], np.ndarray))
+
+
+def compact_dtype(max_value, signed=False):
+  """
+  Returns the smallest of uint16 (unless signed), int32 and int64 that holds values from 0 to max_value.
+  Code doing arithmetic on uint16 distances must widen them first, differences would wrap around
+  """
+  if not signed and max_value <= np.iinfo(np.uint16).max:
+    return np.dtype(np.uint16)
+  if max_value <= np.iinfo(np.int32).max:
+    return np.dtype(np.int32)
+  return np.dtype(np.int64)
+
+
+def minkowski_distances(a, b, p=1):
+  """
+  Returns the rounded Minkowski distances between the broadcast coordinate arrays a and b (last axis x, y).
+  The p = 1 distances of integer coordinates are computed exactly in integers
+  """
+  a, b = np.asarray(a), np.asarray(b)
+  if a.dtype.kind == "u" or b.dtype.kind == "u":
+    # unsigned differences would wrap around
+    a, b = a.astype(np.int64), b.astype(np.int64)
+  # one axis at a time, a reduction over the short coordinate axis is much slower
+  differences = [np.abs(a[..., axis] - b[..., axis]) for axis in range(a.shape[-1])]
+  if p == 1:
+    distances = sum(differences)
+  elif p == np.inf:
+    distances = np.maximum.reduce(differences)
+  else:
+    distances = sum(difference.astype(np.float64) ** p for difference in differences) ** (1 / p)
+  return np.rint(distances) if distances.dtype.kind == "f" else distances
+
+
+def minkowski_distance_matrix(coords, p=1, block_size=None):
   """
-  Returns a capacitated data model of n randomized locations and demands
+  Returns the rounded Minkowski distances between all coordinates as an integer matrix of compact_dtype.
+  Rows are computed in blocks written straight into the result, so no full float or list copy is made
+  """
+  coords = np.asarray(coords)
+  num_locations = len(coords)
+  # no Minkowski distance (p >= 1) exceeds the Manhattan distance across the bounding box
+  bound = np.ptp(coords, axis=0).sum() if num_locations else 0
+  matrix = np.empty((num_locations, num_locations), dtype=compact_dtype(bound))
+  if block_size is None:
+    # a few tens of MB of temporaries per block
+    block_size = max(1, 2000000 // max(num_locations, 1))
+  for start in range(0, num_locations, block_size):
+    matrix[start:start + block_size] = minkowski_distances(coords[start:start + block_size, None], coords, p)
+  return matrix
+
+
+class DistanceOracle:
+  """
+  Distances computed on demand from the coordinates instead of a dense matrix, for maps too large to hold one.
+  Indexed like the matrix it replaces, with the same rounded values and compact_dtype:
+  oracle[i, j] (scalars or arrays of pairs) is computed directly, oracle[i], oracle[rows] and oracle[start:stop]
+  return full rows, which are computed block_size rows at a time and kept in an LRU cache of at most max_bytes
+  """
+
+  def __init__(self, coords, p=1, block_size=32, max_bytes=256 * 2**20):
+    self.coords = np.asarray(coords)
+    self.p = p
+    # plain floats for the scalar lookups of solver callbacks, where NumPy call overhead dominates
+    self.points = self.coords.astype(np.float64).tolist()
+    self.block_size = block_size
+    bound = np.ptp(self.coords, axis=0).sum() if len(self.coords) else 0
+    self.dtype = compact_dtype(bound)
+    self.shape = (len(self.coords), len(self.coords))
+    self.ndim = 2
+    block_bytes = block_size * len(self.coords) * self.dtype.itemsize
+    self.max_blocks = max(1, max_bytes // max(block_bytes, 1))
+    self.blocks = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return self.shape[0]
+
+  def __getitem__(self, key):
+    if isinstance(key, tuple):
+      rows, cols = key
+      if isinstance(rows, slice) or isinstance(cols, slice):
+        return self.rows(rows)[..., cols]
+      return self.pairs(rows, cols)
+    return self.rows(key)
+
+  def pairs(self, rows, cols):
+    """
+    Returns the distances between the (broadcast) location index arrays rows and cols
+    """
+    return minkowski_distances(self.coords[rows], self.coords[cols], self.p).astype(self.dtype)
+
+  def distance(self, i, j):
+    """
+    Returns the distance between two locations as an int, computed in plain Python
+    """
+    a, b = self.points[i], self.points[j]
+    if self.p == 1:
+      return int(round(abs(a[0] - b[0]) + abs(a[1] - b[1])))
+    if self.p == np.inf:
+      return int(round(max(abs(x - y) for x, y in zip(a, b))))
+    return int(round(sum(abs(x - y) ** self.p for x, y in zip(a, b)) ** (1 / self.p)))
+
+  def rows(self, key):
+    """
+    Returns full distance rows for an index, an index array or a slice, through the block cache
+    """
+    if isinstance(key, slice):
+      key = np.arange(*key.indices(len(self)))
+    indices = np.asarray(key)
+    flat = indices.reshape(-1)
+    result = np.empty((len(flat), len(self)), dtype=self.dtype)
+    block_ids = flat // self.block_size
+    for block_id in np.unique(block_ids):
+      selected = np.flatnonzero(block_ids == block_id)
+      result[selected] = self.block(int(block_id))[flat[selected] - block_id * self.block_size]
+    return result.reshape(indices.shape + (len(self),))
+
+  def block(self, block_id):
+    """
+    Returns the rows of one block, computing and caching it on a miss
+    """
+    if block_id in self.blocks:
+      self.hits += 1
+      self.blocks.move_to_end(block_id)
+      return self.blocks[block_id]
+    self.misses += 1
+    start = block_id * self.block_size
+    block = minkowski_distances(self.coords[start:start + self.block_size, None], self.coords, self.p)
+    block = block.astype(self.dtype)
+    self.blocks[block_id] = block
+    if len(self.blocks) > self.max_blocks:
+      self.blocks.popitem(last=False)
+    return block
+
+  def __getstate__(self):
+    # the cache is not sent to worker processes
+    return {"coords": self.coords, "p": self.p, "block_size": self.block_size,
+            "max_bytes": self.max_blocks * self.block_size * len(self.coords) * self.dtype.itemsize}
+
+  def __setstate__(self, state):
+    self.__init__(**state)
+
+  @property
+  def nbytes(self):
+    return sum(block.nbytes for block in self.blocks.values())
+
+
+def distance_array(matrix):
+  """
+  Returns a distance matrix as a NumPy array, or unchanged if it is a DistanceOracle
+  (which answers the same indexing without materializing the matrix)
+  """
+  return matrix if isinstance(matrix, DistanceOracle) else np.asarray(matrix)
+
+
+def create_model(distance_scale, num_locations, num_vehicles, vehicle_capacities, seed=None, lazy=False):
+  """
+  Returns a capacitated data model of n randomized locations and demands, as an Instance, and its coordinates
   The vehicle count and capacities are passed as input, as these are commonly known ahead of time.
+  Passing a seed makes the coordinates and demands reproducible.
+  With lazy set the distance matrix is a DistanceOracle computing distances on demand.
   Gets the distance matrix from random coordinates using Manhatthan distance (Minkowski distance with p-norm = 1)
   see: https://en.wikipedia.org/wiki/Minkowski_distance
   and https://en.wikipedia.org/wiki/Taxicab_geometry
   """
-  data = {}
-  coords = generate_random_coordinates(distance_scale, num_locations)
-  dist_matrix = distance_matrix(coords, coords, p=1, threshold=1000000).tolist()
-  data["distance_matrix"] = np.rint(dist_matrix).astype(int)
-  data["num_vehicles"] = num_vehicles
-  demands = assign_demand(num_locations-1, int(np.sum(vehicle_capacities)*0.8), min(vehicle_capacities))
-  data["demands"] = demands
-  data["vehicle_capacities"] = vehicle_capacities
-  data["depot"] = 0
-  
+  rng = np.random.default_rng(seed) if seed is not None else None
+  coords = np.asarray(generate_random_coordinates(distance_scale, num_locations, rng))
+  coords = coords.astype(compact_dtype(distance_scale, signed=True))
+  data = Instance(coords=coords, num_vehicles=num_vehicles, vehicle_capacities=vehicle_capacities, depot=0)
+  data["distance_matrix"] = DistanceOracle(coords, p=1) if lazy else minkowski_distance_matrix(coords, p=1)
+  if lazy:
+    data["neighbors"] = build_coordinate_neighbor_index(coords, p=1)
+  else:
+    data["neighbors"] = build_neighbor_index(data["distance_matrix"])
+  data["demands"] = assign_demand(num_locations-1, int(np.sum(vehicle_capacities)*0.8), min(vehicle_capacities), rng)
+
   return data, coords
 
-def generate_random_coordinates(distance_scale, num_locations):
+def build_neighbor_index(distance_matrix, num_neighbors=NUM_NEIGHBORS, block_size=1024):
+  """
+  Returns an (n, k) array with the k nearest other locations of every location, closest first.
+  Ties are ordered by location index. Rows are processed in blocks to bound temporary memory
+  """
+  distance_matrix = distance_array(distance_matrix)
+  num_locations = len(distance_matrix)
+  k = min(num_neighbors, num_locations - 1)
+  neighbors = np.empty((num_locations, max(k, 0)), dtype=np.min_scalar_type(max(num_locations - 1, 0)))
+  if k <= 0:
+    return neighbors
+
+  for start in range(0, num_locations, block_size):
+    block = np.array(distance_matrix[start:start + block_size], dtype=np.float64)
+    rows = np.arange(len(block))
+    # a location is never its own neighbour
+    block[rows, start + rows] = np.inf
+    candidates = np.argpartition(block, k - 1, axis=1)[:, :k]
+    candidate_dists = np.take_along_axis(block, candidates, axis=1)
+    order = np.lexsort((candidates, candidate_dists), axis=1)
+    neighbors[start:start + len(block)] = np.take_along_axis(candidates, order, axis=1)
+
+  return neighbors
+
+def build_coordinate_neighbor_index(coords, p=1, num_neighbors=NUM_NEIGHBORS):
+  """
+  Returns the same (n, k) neighbour index as build_neighbor_index from the coordinates, using a k-d tree
+  instead of scanning every distance. Neighbours are ordered by rounded distance then location index
+  """
+  from scipy.spatial import cKDTree
+  coords = np.asarray(coords)
+  num_locations = len(coords)
+  k = min(num_neighbors, num_locations - 1)
+  if k <= 0:
+    return np.empty((num_locations, max(k, 0)), dtype=np.min_scalar_type(max(num_locations - 1, 0)))
+
+  rows = np.arange(num_locations)[:, None]
+  _, found = cKDTree(coords).query(coords, k=k + 1, p=p)
+  # drop each location from its own list (it may not come first when coordinates repeat)
+  found = np.take_along_axis(found, np.argsort(found == rows, axis=1, kind="stable"), axis=1)[:, :k]
+  distances = minkowski_distances(coords[rows], coords[found], p)
+  order = np.lexsort((found, distances), axis=1)
+  return np.take_along_axis(found, order, axis=1).astype(np.min_scalar_type(num_locations - 1))
+
+def fingerprint_model(data):
+  """
+  Returns a hex digest identifying a model by its distance matrix, demands, vehicle capacities,
+  vehicle count and depot
+  """
+  digest = hashlib.blake2b(digest_size=16)
+  for key in ("distance_matrix", "demands", "vehicle_capacities"):
+    if key in data:
+      array = data[key]
+      if isinstance(array, DistanceOracle):
+        # an oracle is identified by the coordinates and norm it computes the distances from
+        digest.update("p={}".format(array.p).encode())
+        array = array.coords
+      array = np.ascontiguousarray(array)
+      digest.update("{}{}{}".format(key, array.dtype, array.shape).encode())
+      digest.update(array.tobytes())
+  digest.update("{}:{}".format(data["num_vehicles"], data["depot"]).encode())
+  return digest.hexdigest()
+
+def generate_random_coordinates(distance_scale, num_locations, rng=None):
   """
   Returns a list of num_locations coordinates
+  Uses the given numpy Generator if there is one, otherwise the global random module
   """
+  if rng is not None:
+    return rng.integers(0, distance_scale + 1, size=(num_locations, 2)).tolist()
   coords = []
   for _ in range(0,num_locations):
     x = random.randint(0,distance_scale)
@@ -104,28 +377,83 @@ def generate_random_coordinates(distance_scale, num_locations):
     coords.append([x,y])
   return coords
 
-def assign_demand(num_locations, total_capacity, vehicle_capacity):
+def assign_demand(num_locations, total_capacity, vehicle_capacity, rng=None):
+  """
+  Returns an array of demands corresponding to each location, with the depot's 0 demand first.
+  Each location is guaranteed to have 1 demand and at most vehicle_capacity-1, the rest (up to 80% of the
+  total capacity) are assigned at random.
+  rng is a numpy Generator or a seed, see demand_scenarios
+  """
+  demand = demand_scenarios(num_locations, total_capacity, vehicle_capacity, 1, rng)[0]
+  return np.concatenate(([0], demand))
+
+def demand_scenarios(num_locations, total_capacity, vehicle_capacity, num_scenarios=1, rng=None):
+  """
+  Returns a (num_scenarios, num_locations) array of independent demand assignments for the same map,
+  without the depot, each following the rules of assign_demand.
+  Instead of placing one unit at a time, the units of every scenario are drawn in one multinomial step and
+  those over a location's cap are drawn again over the locations with room left, until all are placed.
+  rng is a numpy Generator, a seed, or None for fresh entropy
+  """
+  rng = np.random.default_rng(rng)
+  cap = vehicle_capacity - 1
+  demand = np.ones((num_scenarios, num_locations), dtype=np.int64)
+  target = int(total_capacity*0.8) if total_capacity > num_locations else num_locations
+  extra = max(target - num_locations, 0)
+  if extra > num_locations * max(cap - 1, 0):
+    raise ValueError("{} demand does not fit in {} locations with at most {} each".format(target, num_locations, cap))
+
+  remaining = np.full(num_scenarios, extra)
+  while remaining.any():
+    # scenarios with every unit placed can have no room left, only the others are drawn again
+    open_rows = np.flatnonzero(remaining)
+    has_room = demand[open_rows] < cap
+    draws = rng.multinomial(remaining[open_rows], has_room / has_room.sum(axis=1, keepdims=True))
+    demand[open_rows] += draws
+    over = np.maximum(demand[open_rows] - cap, 0)
+    demand[open_rows] -= over
+    remaining[open_rows] = over.sum(axis=1)
+  return demand
+
+def assign_demand_reference(num_locations, total_capacity, vehicle_capacity, rng=None):
   """
-  Returns a list of demands corresponding to each location, equal to total vehicle capacity.
-  Each location is guaranteed to have 1 demand, the rest are assigned at random
+  The original unit-at-a-time assignment with rejection sampling, kept as the reference for assign_demand
+  Uses the given numpy Generator if there is one, otherwise the global random module
   """
+  randint = (lambda low, high: int(rng.integers(low, high + 1))) if rng is not None else random.randint
   demand = [1]*num_locations
   if total_capacity > num_locations:
     for _ in range(num_locations, int(total_capacity*0.8)):
       index = -1
       # ensure demand at a single location does not exceed total vehicle capacity
       while index < 0 or demand[index] >= vehicle_capacity-1:
-        index = random.randint(0,num_locations-1)
+        index = randint(0,num_locations-1)
       demand[index] += 1
   demand.insert(0, 0)
   return demand
 
-
 if __name__ == '__main__':
   print('quick test')
-  data, coords = create_model(10,5,5,[1,2,3,4,5])
+  data, coords = create_model(10,5,5,[10,10,10,10,10])
   print(data['distance_matrix'])
+  # the vectorized demands should match the unit-at-a-time reference in distribution
+  import time
+  rng = np.random.default_rng(0)
+  start = time.perf_counter()
+  scenarios = demand_scenarios(199, 150 * 20, 20, 2000, rng)
+  vectorized = time.perf_counter() - start
+  start = time.perf_counter()
+  reference = np.array([assign_demand_reference(199, 150 * 20, 20, rng)[1:] for _ in range(200)])
+  looped = (time.perf_counter() - start) * 10
+  assert (scenarios.sum(axis=1) == reference.sum(axis=1)[0]).all() and scenarios.min() >= 1 and scenarios.max() <= 19
+  print('2000 scenarios in {:.3f}s vs {:.1f}s, mean {:.3f}/{:.3f}, std {:.3f}/{:.3f}, at cap {:.4f}/{:.4f}'.format(
+    vectorized, looped, scenarios.mean(), reference.mean(), scenarios.std(), reference.std(),
+    (scenarios == 19).mean(), (reference == 19).mean()))
+  # demand that fills every location to its cap, some scenarios finish while others still draw
+  full = demand_scenarios(3, 12, 4, 50, 0)
+  assert (full == 3).all()
   # get the coordinate arrays and show them on a graph
+  import matplotlib.pyplot as plt
   x, y = zip(*coords)
   plt.scatter(x,y)
   plt.show()
\ No newline at end of file
@@ -1,12 +1,263 @@
-import openpyxl as op
+"""
+Results output - collects benchmark rows in memory and writes them in batches.
+"""
 
-def save_results(cell_id, new_value):
+import csv
+import json
+import os
+import sqlite3
+
+RESULTS_PATH = "./src/data/results.xlsx"
+
+# columns every row has, extra keyword columns follow in the order they are first seen
+COLUMNS = ["config", "algorithm", "seed", "distance", "time", "iterations"]
+
+# spreadsheet column of each benchmark algorithm in results.xlsx
+XLSX_COLUMNS = {"nn": "C", "two_opt_nn": "D", "random": "E", "two_opt_rand": "F", "gls": "G", "ts": "H"}
+
+
+def distance_row(count_index, ratio_index):
+  """
+  Returns the spreadsheet row holding the distances of a (location count, fleet ratio) configuration
+  """
+  return ((count_index * 4) + 4) + ratio_index
+
+
+def time_row(count_index, ratio_index):
+  """
+  Returns the spreadsheet row holding the execution times of a (location count, fleet ratio) configuration
+  """
+  return ((count_index * 4) + 27) + ratio_index
+
+
+def traces_path(results_path):
+  """
+  Returns the path of the solution traces stored next to a results file
+  """
+  return os.path.splitext(results_path)[0] + "_traces.json"
+
+
+def save_traces(path, records):
+  """
+  Saves solution improvement traces as JSON. Each record holds config, algorithm, seed and
+  trace, a list of (elapsed seconds, best cost) pairs
+  """
+  with open(path, "w") as file:
+    json.dump(records, file, indent=1)
+
+
+def load_traces(path):
+  """
+  Loads the trace records written by save_traces
+  """
+  with open(path) as file:
+    return json.load(file)
+
+
+def runs_path(results_path):
+  """
+  Returns the path of the instrumentation records of the runs stored next to a results file
+  """
+  return os.path.splitext(results_path)[0] + "_runs.jsonl"
+
+
+def solutions_path(results_path):
+  """
+  Returns the path of the solutions stored next to a results file for rendering
+  """
+  return os.path.splitext(results_path)[0] + "_solutions.json"
+
+
+def save_solutions(path, records):
+  """
+  Saves the solutions of every configuration as JSON. Each record holds config, coords and solutions,
+  a dict from algorithm name to its routes
+  """
+  with open(path, "w") as file:
+    json.dump(records, file)
+
+
+def load_solutions(path):
+  """
+  Loads the solution records written by save_solutions
+  """
+  with open(path) as file:
+    return json.load(file)
+
+
+class ResultsSink:
+  """
+  Collects result rows in memory and writes them with a pluggable writer.
+  Rows are written once on flush/close, or every checkpoint_every rows when checkpointing.
+  The format is one of WRITERS and defaults to the one matching the file extension
+  """
+
+  def __init__(self, path=RESULTS_PATH, format=None, checkpoint_every=None):
+    self.path = path
+    self.format = format or format_from_path(path)
+    if self.format not in WRITERS:
+      raise ValueError("unknown results format: " + str(self.format))
+    self.checkpoint_every = checkpoint_every
+    self.columns = list(COLUMNS)
+    self.pending = []
+    self.writer = None
+    self.rows_written = 0
+
+  def add(self, config, algorithm, seed, distance, time, iterations=None, **extra):
+    """
+    Queues one result row, flushing if a checkpoint is due
+    """
+    row = dict(config=config, algorithm=algorithm, seed=seed, distance=distance, time=time,
+               iterations=iterations, **extra)
+    # numpy scalars are stored as plain Python numbers
+    row = {key: value.item() if hasattr(value, "item") else value for key, value in row.items()}
+    for key in row:
+      if key not in self.columns:
+        self.columns.append(key)
+    self.pending.append(row)
+    if self.checkpoint_every and len(self.pending) >= self.checkpoint_every:
+      self.flush()
+
+  def flush(self):
+    """
+    Writes the queued rows
+    """
+    if not self.pending:
+      return
+    if self.writer is None:
+      self.writer = WRITERS[self.format](self.path, self.columns)
+    self.writer.write(self.pending)
+    self.rows_written += len(self.pending)
+    self.pending = []
+
+  def close(self):
+    """
+    Writes the queued rows and closes the output
+    """
+    self.flush()
+    if self.writer is not None:
+      self.writer.close()
+      self.writer = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def format_from_path(path):
+  """
+  Returns the results format matching a file extension
+  """
+  extension = os.path.splitext(path)[1].lower()
+  return {".csv": "csv", ".parquet": "parquet", ".arrow": "parquet", ".db": "sqlite",
+          ".sqlite": "sqlite", ".xlsx": "xlsx"}.get(extension, "csv")
+
+
+class CsvWriter:
+  """
+  Writes rows to a CSV file, one column per field. The columns are fixed by the first write
+  """
+
+  def __init__(self, path, columns):
+    self.file = open(path, "w", newline="")
+    self.writer = csv.DictWriter(self.file, fieldnames=list(columns), extrasaction="ignore")
+    self.writer.writeheader()
+
+  def write(self, rows):
+    self.writer.writerows(rows)
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
+
+
+class ParquetWriter:
+  """
+  Writes rows to a Parquet file through Arrow, one row group per flush. Requires pyarrow
+  """
+
+  def __init__(self, path, columns):
+    try:
+      import pyarrow
+      import pyarrow.parquet
+    except ImportError as error:
+      raise ImportError("the parquet results format requires pyarrow") from error
+    self.pyarrow = pyarrow
+    self.path = path
+    self.columns = list(columns)
+    self.writer = None
+
+  def write(self, rows):
+    table = self.pyarrow.Table.from_pydict({column: [row.get(column) for row in rows] for column in self.columns})
+    if self.writer is None:
+      self.writer = self.pyarrow.parquet.ParquetWriter(self.path, self.schema(table.schema))
+    self.writer.write_table(table.cast(self.writer.schema))
+
+  def schema(self, inferred):
+    """
+    Returns the file schema: numbers as float64 (distance can be missing or fractional) and columns
+    that were all empty in the first batch as float64 rather than null
+    """
+    pa = self.pyarrow
+    fields = []
+    for field in inferred:
+      if pa.types.is_null(field.type) or (pa.types.is_integer(field.type) and field.name in ("distance", "time")):
+        field = field.with_type(pa.float64())
+      fields.append(field)
+    return pa.schema(fields)
+
+  def close(self):
+    if self.writer is not None:
+      self.writer.close()
+
+
+class SqliteWriter:
   """
-  Saves and updates a cell with the new value in `results.xlsx`
+  Appends rows to a `results` table in an SQLite database
   """
-  workbook = op.load_workbook("./src/data/results.xlsx")
-  sheet = workbook.worksheets[0]
 
-  sheet[cell_id] = new_value
+  def __init__(self, path, columns):
+    self.columns = list(columns)
+    self.connection = sqlite3.connect(path)
+    self.connection.execute("CREATE TABLE IF NOT EXISTS results ({})".format(
+      ", ".join('"{}"'.format(column) for column in self.columns)))
+
+  def write(self, rows):
+    self.connection.executemany("INSERT INTO results ({}) VALUES ({})".format(
+      ", ".join('"{}"'.format(column) for column in self.columns), ", ".join("?" * len(self.columns))),
+      [[row.get(column) for column in self.columns] for row in rows])
+    self.connection.commit()
+
+  def close(self):
+    self.connection.close()
+
+
+class XlsxWriter:
+  """
+  Writes rows into the existing results.xlsx layout: one cell per (configuration, algorithm)
+  in the distance and time tables. Rows need count_index and ratio_index columns.
+  The workbook is loaded and saved once per flush
+  """
+
+  def __init__(self, path, columns):
+    self.path = path
+
+  def write(self, rows):
+    import openpyxl as op
+    workbook = op.load_workbook(self.path)
+    sheet = workbook.worksheets[0]
+    for row in rows:
+      column = XLSX_COLUMNS.get(row["algorithm"])
+      if column is None or row.get("count_index") is None:
+        continue
+      sheet[column + str(distance_row(row["count_index"], row["ratio_index"]))] = row["distance"]
+      sheet[column + str(time_row(row["count_index"], row["ratio_index"]))] = row["time"]
+    workbook.save(self.path)
+
+  def close(self):
+    pass
+
 
-  workbook.save("./src/data/results.xlsx")
\ No newline at end of file
+WRITERS = {"csv": CsvWriter, "parquet": ParquetWriter, "sqlite": SqliteWriter, "xlsx": XlsxWriter}
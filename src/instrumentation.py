@@ -0,0 +1,201 @@
+"""
+Run instrumentation - named phase timers, counters, peak memory and an optional cProfile dump per run,
+collected into one JSON record. Phases and counters cost a global lookup when no run is being recorded.
+"""
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# the Recording in progress in this process, None when runs are not instrumented
+active = None
+# returned by phase when nothing is recorded
+NO_PHASE = nullcontext()
+
+
+class Recording:
+  """
+  Records the phases, counters and memory of one run while active (use it as a context manager).
+  memory traces Python and NumPy allocations with tracemalloc for the peak, which slows allocation-heavy code.
+  With profile_dir set the run is profiled with cProfile and the stats are dumped to <profile_dir>/<name>.prof,
+  with the top functions by cumulative time in <name>.txt.
+  labels (e.g. algorithm, config, seed) are copied into the record
+  """
+
+  def __init__(self, name, memory=False, profile_dir=None, **labels):
+    self.name = name
+    self.memory = memory
+    self.profile_dir = profile_dir
+    self.labels = labels
+    self.phases = {}
+    # phases being timed, a phase entered again inside itself (e.g. by a nested solve) is only timed once
+    self.open_phases = set()
+    self.counters = {}
+    self.record = None
+    self.profiler = None
+    self.previous = None
+
+  def __enter__(self):
+    global active
+    self.previous, active = active, self
+    if self.memory:
+      tracemalloc.start()
+    if self.profile_dir is not None:
+      self.profiler = cProfile.Profile()
+      self.profiler.enable()
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    global active
+    wall_time = time.perf_counter() - self.started
+    profile = None
+    if self.profiler is not None:
+      self.profiler.disable()
+      profile = self.dump_profile()
+    peak_memory = None
+    if self.memory:
+      peak_memory = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+    active = self.previous
+    self.record = dict({"run": self.name}, **self.labels)
+    self.record.update({"wall_time": wall_time, "phases": self.phases, "counters": self.counters,
+                        "peak_memory": peak_memory, "max_rss": max_rss(), "profile": profile})
+    return False
+
+  def phase(self, name):
+    return PhaseTimer(self, name)
+
+  def add_phase(self, name, seconds):
+    """
+    Adds seconds to a phase, phases entered several times add up
+    """
+    self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+  def dump_profile(self):
+    """
+    Writes the profile stats and their summary, returns the path of the stats
+    """
+    os.makedirs(self.profile_dir, exist_ok=True)
+    path = os.path.join(self.profile_dir, "".join(c if c.isalnum() or c in "-_." else "_" for c in self.name))
+    self.profiler.dump_stats(path + ".prof")
+    summary = io.StringIO()
+    pstats.Stats(self.profiler, stream=summary).sort_stats("cumulative").print_stats(30)
+    with open(path + ".txt", "w") as file:
+      file.write(summary.getvalue())
+    return path + ".prof"
+
+
+class PhaseTimer:
+  """
+  Adds the time spent inside a with block to a phase of a recording
+  """
+
+  def __init__(self, recording, name):
+    self.recording = recording
+    self.name = name
+
+  def __enter__(self):
+    self.nested = self.name in self.recording.open_phases
+    self.recording.open_phases.add(self.name)
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    if not self.nested:
+      self.recording.open_phases.discard(self.name)
+      self.recording.add_phase(self.name, time.perf_counter() - self.started)
+    return False
+
+
+def phase(name):
+  """
+  Returns a context manager timing a with block as the named phase of the active recording.
+  Does nothing when no run is being recorded
+  """
+  if active is None:
+    return NO_PHASE
+  return active.phase(name)
+
+
+def add_phase(name, seconds):
+  """
+  Adds seconds measured elsewhere to the named phase of the active recording, if any
+  """
+  if active is not None:
+    active.add_phase(name, seconds)
+
+
+def count(name, amount=1):
+  """
+  Adds amount to the named counter of the active recording, if any
+  """
+  if active is not None:
+    active.counters[name] = active.counters.get(name, 0) + amount
+
+
+def recording():
+  """
+  Returns whether a run is being recorded, for instrumentation that needs more than a counter
+  """
+  return active is not None
+
+
+def max_rss():
+  """
+  Returns the peak resident memory of this process in bytes, including memory allocated by OR-Tools
+  """
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def json_value(value):
+  """
+  Converts the NumPy scalars of a record for JSON
+  """
+  return value.item() if hasattr(value, "item") else str(value)
+
+
+def write_records(path, records, mode="a"):
+  """
+  Appends (or with mode "w", writes) records as JSON lines, "-" prints them
+  """
+  lines = "".join(json.dumps(record, default=json_value) + "\n" for record in records)
+  if path == "-":
+    print(lines, end="")
+    return
+  with open(path, mode) as file:
+    file.write(lines)
+
+
+if __name__ == '__main__':
+  print('quick test')
+  from data.models import create_model
+  from algorithms.registry import solve
+  # the solvers record into the imported module, not into this script
+  from instrumentation import Recording, phase, count
+  model, _ = create_model(1000, 100, 25, [20] * 25, seed=0)
+  for name in ("nn", "two_opt", "local_search", "gls"):
+    solve(name, model, 0.2)
+    with Recording(name, memory=True, algorithm=name) as run:
+      solve(name, model, 0.2)
+    write_records("-", [run.record])
+
+  # overhead of the instrumentation calls of a solve when nothing is recorded
+  calls = 1000000
+  start = time.perf_counter()
+  for _ in range(calls):
+    with phase("x"):
+      count("y")
+  print('disabled phase + count: {:.0f} ns'.format((time.perf_counter() - start) / calls * 1e9))
+  for name in ("nn", "two_opt"):
+    runs = 200
+    start = time.perf_counter()
+    for _ in range(runs):
+      solve(name, model, None)
+    print('{} solve: {:.3f} ms'.format(name, (time.perf_counter() - start) / runs * 1000))
@@ -0,0 +1,46 @@
+"""
+Process pool runner - fans independent jobs out over worker processes and collects the results in order.
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# thread pools of the numeric libraries, capped so workers * threads does not exceed the cores
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def default_workers(threads_per_worker=1):
+  """
+  Returns how many workers fit on this machine when every worker uses threads_per_worker threads
+  """
+  return max(1, (os.cpu_count() or 1) // max(1, threads_per_worker))
+
+
+def run_jobs(function, jobs, workers=None, threads_per_worker=1):
+  """
+  Runs function(job) for every job and returns the results in job order.
+  function must be importable at module level so it can be sent to a worker process.
+  workers defaults to the number of cores divided by threads_per_worker, which should be set to the number
+  of threads each job uses itself (e.g. a multithreaded solver) to avoid oversubscribing the CPU.
+  With a single worker the jobs run in this process
+  """
+  jobs = list(jobs)
+  if workers is None:
+    workers = default_workers(threads_per_worker)
+  if workers <= 1 or len(jobs) <= 1:
+    return [function(job) for job in jobs]
+
+  # worker processes inherit the environment at start-up, before they import numpy
+  saved_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+  os.environ.update({name: str(threads_per_worker) for name in THREAD_ENV_VARS})
+  try:
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=context) as executor:
+      return list(executor.map(function, jobs))
+  finally:
+    for name, value in saved_env.items():
+      if value is None:
+        os.environ.pop(name, None)
+      else:
+        os.environ[name] = value
@@ -0,0 +1,273 @@
+"""
+Scaling benchmark - runs solvers on maps of growing size, repeated over several seeds per cell, and summarizes
+runtime, peak memory and solution cost with confidence intervals. A run is saved as a baseline file that
+later runs are compared against to flag runtime and quality regressions.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from benchmark import build_instance, derive_seed
+from data.instances import INSTANCE_DIR
+from runner import run_jobs
+
+SIZES = [100, 500, 1000, 2000, 5000, 10000]
+FLEET_RATIOS = [0.25]
+ALGORITHMS = ["nn", "two_opt", "local_search", "gls"]
+SEEDS = 5
+BASELINE_PATH = "./src/data/scaling_baseline.json"
+# maps above this many locations use a DistanceOracle, a dense matrix of 10,000 locations takes 200 MB
+DENSE_MAX_LOCATIONS = 2000
+# resamples of the bootstrap confidence intervals
+RESAMPLES = 1000
+# a slower median runtime is only flagged if it is also this many seconds slower, below it timings are noise
+MIN_RUNTIME_CHANGE = 0.005
+
+# (algorithm, array kinds) solved once in this process, see warm_up
+warmed_up = set()
+
+
+def build_jobs(sizes=SIZES, fleet_ratios=FLEET_RATIOS, algorithms=ALGORITHMS, seeds=SEEDS, seed=0, time_limit=1,
+               vehicle_capacity=20, memory_seeds=1, instance_dir=INSTANCE_DIR):
+  """
+  Returns one job per (size, fleet ratio, algorithm, repetition). Every repetition solves a different map,
+  generated from seed and its index, and all algorithms of a repetition solve the same map.
+  The first memory_seeds repetitions of each cell also measure the peak memory, in a second solve
+  """
+  jobs = []
+  for num_locations in sizes:
+    for ratio_index, fleet_ratio in enumerate(fleet_ratios):
+      for algorithm in algorithms:
+        for repetition in range(seeds):
+          jobs.append({
+            "algorithm": algorithm,
+            "num_locations": num_locations,
+            "fleet_ratio": fleet_ratio,
+            "fleet_size": max(1, int(num_locations * fleet_ratio)),
+            "vehicle_capacity": vehicle_capacity,
+            "time_limit": time_limit,
+            "repetition": repetition,
+            "map_seed": derive_seed(seed, num_locations, repetition),
+            "fleet_seed": derive_seed(seed, num_locations, repetition, ratio_index),
+            "instance_dir": instance_dir,
+            "lazy": num_locations > DENSE_MAX_LOCATIONS,
+            "memory": repetition < memory_seeds,
+          })
+  return jobs
+
+
+def run_job(job):
+  """
+  Solves the map of one job and returns its runtime, cost, phase times and counters, and peak memory
+  if the job measures it. Peak memory is measured in a separate solve since tracing allocations slows it down
+  """
+  from algorithms.registry import solve
+  from algorithms.ortools_model import model_cache
+  from instrumentation import Recording
+  model, _ = build_instance(job)
+  warm_up(job["algorithm"], model)
+  # random_routes uses the global numpy generator
+  np.random.seed(job["fleet_seed"])
+  with Recording(job["algorithm"]) as run:
+    result = solve(job["algorithm"], model, job["time_limit"])
+  row = {key: job[key] for key in ("algorithm", "num_locations", "fleet_ratio", "fleet_size", "repetition",
+                                   "map_seed", "time_limit")}
+  row.update(runtime=result.wall_time, cost=result.cost.item() if hasattr(result.cost, "item") else result.cost,
+             phases=run.record["phases"], counters=run.record["counters"], peak_memory=None)
+  if job["memory"]:
+    # the second solve builds its OR-Tools model again, so that it is counted too
+    model_cache.clear()
+    np.random.seed(job["fleet_seed"])
+    with Recording(job["algorithm"], memory=True) as run:
+      solve(job["algorithm"], model, job["time_limit"])
+    row["peak_memory"] = run.record["peak_memory"]
+  return row
+
+
+def warm_up(algorithm, model):
+  """
+  Solves the model briefly the first time the algorithm meets its kind of distance matrix and neighbour index
+  in this process, so that imports and numba compilation (once per array dtype and writability) are not timed
+  """
+  from algorithms.registry import solve
+  from algorithms.ortools_model import model_cache
+  key = (algorithm,) + tuple((type(model[field]).__name__, str(getattr(model[field], "dtype", None)),
+                              getattr(getattr(model[field], "flags", None), "writeable", None))
+                             for field in ("distance_matrix", "neighbors"))
+  if key in warmed_up:
+    return
+  solve(algorithm, model, 0.05)
+  model_cache.clear()
+  warmed_up.add(key)
+
+
+def cell_key(row):
+  """
+  Returns the name of the (size, fleet ratio, algorithm) cell of a run
+  """
+  return '{}L x{} {}'.format(row["num_locations"], row["fleet_ratio"], row["algorithm"])
+
+
+def confidence_interval(values, statistic=np.median, level=0.95, seed=0):
+  """
+  Returns the bootstrap confidence interval of statistic over values, as [low, high]
+  """
+  values = np.asarray(values, dtype=np.float64)
+  rng = np.random.default_rng(seed)
+  resamples = statistic(values[rng.integers(0, len(values), size=(RESAMPLES, len(values)))], axis=1)
+  low, high = np.percentile(resamples, [(1 - level) / 2 * 100, (1 + level) / 2 * 100])
+  return [low.item(), high.item()]
+
+
+def summarize(rows):
+  """
+  Returns {cell: summary} with the run count, failures (runs without a solution), the median, 95th percentile
+  and median confidence interval of the runtime, the median and confidence interval of the cost and the
+  median peak memory of every cell
+  """
+  cells = {}
+  for row in rows:
+    cells.setdefault(cell_key(row), []).append(row)
+  summaries = {}
+  for key, runs in cells.items():
+    runtimes = [run["runtime"] for run in runs]
+    costs = [run["cost"] for run in runs if run["cost"] is not None]
+    memory = [run["peak_memory"] for run in runs if run["peak_memory"] is not None]
+    summaries[key] = {
+      "num_locations": runs[0]["num_locations"], "fleet_ratio": runs[0]["fleet_ratio"],
+      "algorithm": runs[0]["algorithm"], "runs": len(runs), "failures": len(runs) - len(costs),
+      "runtime": {"median": np.median(runtimes).item(), "p95": np.percentile(runtimes, 95).item(),
+                  "ci": confidence_interval(runtimes)},
+      "cost": {"median": np.median(costs).item(), "ci": confidence_interval(costs)} if costs else None,
+      "peak_memory": {"median": np.median(memory).item()} if memory else None,
+    }
+  return summaries
+
+
+def run_suite(output=BASELINE_PATH, workers=1, seed=0, **options):
+  """
+  Runs the scaling jobs (see build_jobs for the options) and saves the runs, their summaries and the
+  environment to output as JSON. workers defaults to 1 so solves do not compete for cores and skew runtimes.
+  Returns the summaries
+  """
+  jobs = build_jobs(seed=seed, **options)
+  print('running {n} jobs'.format(n=len(jobs)))
+  start = time.perf_counter()
+  rows = run_jobs(run_job, jobs, workers)
+  summaries = summarize(rows)
+  meta = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": seed, "workers": workers,
+          "elapsed": time.perf_counter() - start, "python": platform.python_version(), "numpy": np.__version__,
+          "platform": platform.platform(), "cpu_count": os.cpu_count(), "options": options}
+  directory = os.path.dirname(os.path.abspath(output))
+  os.makedirs(directory, exist_ok=True)
+  with open(output, "w") as file:
+    json.dump({"meta": meta, "cells": summaries, "runs": rows}, file, indent=1)
+  return summaries
+
+
+def load(path):
+  """
+  Loads a file written by run_suite
+  """
+  with open(path) as file:
+    return json.load(file)
+
+
+def compare(baseline, current, runtime_threshold=0.1, quality_threshold=0.02, min_runtime_change=MIN_RUNTIME_CHANGE):
+  """
+  Compares the cells of two run_suite files. A cell regresses if its median runtime grew by more than
+  runtime_threshold (a fraction) and min_runtime_change seconds, its median cost by more than quality_threshold,
+  or it failed more often. Returns (regressions, notes), lists of messages
+  """
+  regressions, notes = [], []
+  for key, before in baseline["cells"].items():
+    after = current["cells"].get(key)
+    if after is None:
+      notes.append('{}: not in the current run'.format(key))
+      continue
+    old, new = before["runtime"]["median"], after["runtime"]["median"]
+    if new > old * (1 + runtime_threshold) and new - old > min_runtime_change:
+      regressions.append('{}: median runtime {:.4f}s -> {:.4f}s ({:+.1%})'.format(key, old, new, new / old - 1))
+    if before["cost"] and after["cost"]:
+      old, new = before["cost"]["median"], after["cost"]["median"]
+      if new > old * (1 + quality_threshold):
+        regressions.append('{}: median cost {:.0f} -> {:.0f} ({:+.1%})'.format(key, old, new, new / old - 1))
+    if after["failures"] > before["failures"]:
+      regressions.append('{}: {} of {} runs without a solution, was {} of {}'.format(
+        key, after["failures"], after["runs"], before["failures"], before["runs"]))
+  for key in current["cells"]:
+    if key not in baseline["cells"]:
+      notes.append('{}: not in the baseline'.format(key))
+  return regressions, notes
+
+
+def print_summaries(summaries):
+  print('{:<28} {:>4} {:>9} {:>9} {:>21} {:>10} {:>21} {:>10}'.format(
+    'cell', 'runs', 'median s', 'p95 s', 'runtime 95% CI', 'cost', 'cost 95% CI', 'peak MB'))
+  for key, cell in summaries.items():
+    cost = cell["cost"]
+    memory = cell["peak_memory"]
+    print('{:<28} {:>4} {:>9.4f} {:>9.4f} {:>21} {:>10} {:>21} {:>10}'.format(
+      key, cell["runs"], cell["runtime"]["median"], cell["runtime"]["p95"],
+      '[{:.4f}, {:.4f}]'.format(*cell["runtime"]["ci"]),
+      '{:.0f}'.format(cost["median"]) if cost else 'none', '[{:.0f}, {:.0f}]'.format(*cost["ci"]) if cost else '',
+      '{:.1f}'.format(memory["median"] / 2**20) if memory else ''))
+
+
+def main(argv=None):
+  """
+  Runs the scaling command line, argv defaults to the arguments of the process. Returns the exit status
+  """
+  parser = argparse.ArgumentParser(description='Scaling benchmark with repetitions and regression checks')
+  commands = parser.add_subparsers(dest='command', required=True)
+  run = commands.add_parser('run', help='run the suite and save it as a baseline file')
+  run.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='location counts')
+  run.add_argument('--fleet-ratios', type=float, nargs='+', default=FLEET_RATIOS, help='vehicles per location')
+  run.add_argument('--algorithms', nargs='+', default=ALGORITHMS, help='registered solver names')
+  run.add_argument('--seeds', type=int, default=SEEDS, help='repetitions of every cell, each on its own map')
+  run.add_argument('--seed', type=int, default=0, help='seed the maps are derived from')
+  run.add_argument('--time-limit', type=float, default=1, help='seconds each solve may run')
+  run.add_argument('--memory-seeds', type=int, default=1,
+                   help='repetitions of every cell that also measure peak memory, in a second solve')
+  run.add_argument('--workers', type=int, default=1, help='worker processes, more than 1 skews the runtimes')
+  run.add_argument('--instance-dir', default=INSTANCE_DIR, help='directory the generated maps are stored in')
+  run.add_argument('--output', default=BASELINE_PATH, help='file the runs and summaries are saved to')
+
+  check = commands.add_parser('compare', help='flag the regressions of a run against a baseline')
+  check.add_argument('baseline', help='baseline file')
+  check.add_argument('current', help='file of the run to check')
+  check.add_argument('--runtime-threshold', type=float, default=0.1, help='allowed median runtime growth')
+  check.add_argument('--quality-threshold', type=float, default=0.02, help='allowed median cost growth')
+  check.add_argument('--min-runtime-change', type=float, default=MIN_RUNTIME_CHANGE,
+                     help='seconds a runtime must grow by to be flagged')
+
+  show = commands.add_parser('show', help='print the summaries of a saved run')
+  show.add_argument('path', help='file written by run')
+  args = parser.parse_args(argv)
+
+  if args.command == 'run':
+    summaries = run_suite(args.output, args.workers, args.seed, sizes=args.sizes, fleet_ratios=args.fleet_ratios,
+                          algorithms=args.algorithms, seeds=args.seeds, time_limit=args.time_limit,
+                          memory_seeds=args.memory_seeds, instance_dir=args.instance_dir)
+    print_summaries(summaries)
+    print('saved to ' + args.output)
+    return 0
+  if args.command == 'show':
+    print_summaries(load(args.path)["cells"])
+    return 0
+  regressions, notes = compare(load(args.baseline), load(args.current), args.runtime_threshold,
+                               args.quality_threshold, args.min_runtime_change)
+  for note in notes:
+    print('note: ' + note)
+  for regression in regressions:
+    print('regression: ' + regression)
+  print('{} regressions'.format(len(regressions)))
+  return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,419 @@
+"""
+Solve service - a long-running asyncio server taking solve requests as JSON lines on a local socket.
+Requests wait in a bounded queue for a pool of worker processes that keep the solvers imported, and every
+improved solution of an OR-Tools search is streamed back to the client while it runs.
+"""
+
+import argparse
+import asyncio
+import collections
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from runner import default_workers
+
+SOCKET_PATH = "/tmp/vrp-solve.sock"
+# requests waiting for a worker; further requests are rejected until the queue drains
+MAX_QUEUE = 64
+# seconds a solve may run past its time limit (model building, process start-up) before it is given up on
+DEADLINE_GRACE = 5.0
+# longest search a request may ask for, longer time limits are shortened to it
+MAX_TIME_LIMIT = 300.0
+# longest JSON line accepted, enough for the distance matrix of a few hundred locations
+LINE_LIMIT = 2**26
+# completed requests the latency percentiles are computed over
+LATENCY_WINDOW = 1000
+TERMINAL_EVENTS = ("result", "rejected", "expired", "timeout", "error", "metrics")
+
+# queue the solves in a worker process report progress to, set by warm_worker
+progress_queue = None
+
+
+def warm_worker(queue):
+  """
+  Process pool initializer: imports the solvers and solves a tiny model once, so that the first request
+  of every worker does not pay for imports, native library loading or JIT compilation
+  """
+  global progress_queue
+  progress_queue = queue
+  from algorithms.registry import solve
+  from data.models import create_model
+  model, _ = create_model(100, 20, 4, [20] * 4, seed=0)
+  solve("gls", model, time_limit=0.05)
+  solve("local_search", model, time_limit=0.05)
+
+
+def build_model(request):
+  """
+  Returns the Instance described by a request: "coords" (whose Manhattan distances are used) or a
+  "distance_matrix", the "demands" of every location, the "vehicle_capacities" and optionally the "depot"
+  """
+  from data.models import Instance, minkowski_distance_matrix, build_neighbor_index, compact_dtype
+  capacities = np.asarray(request["vehicle_capacities"], dtype=np.int64)
+  if "distance_matrix" in request:
+    matrix = np.asarray(request["distance_matrix"], dtype=np.int64)
+    matrix = matrix.astype(compact_dtype(matrix.max(initial=0)))
+  else:
+    matrix = minkowski_distance_matrix(np.asarray(request["coords"], dtype=np.int64), p=request.get("p", 1))
+  demands = np.asarray(request["demands"], dtype=np.int64)
+  if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1] or len(demands) != len(matrix):
+    raise ValueError("the request needs a square distance matrix (or coords) and one demand per location")
+  model = Instance(distance_matrix=matrix, neighbors=build_neighbor_index(matrix), demands=demands,
+                   vehicle_capacities=capacities, num_vehicles=len(capacities), depot=int(request.get("depot", 0)))
+  if "coords" in request:
+    model["coords"] = np.asarray(request["coords"])
+  return model
+
+
+def accepts_progress(algorithm):
+  """
+  Returns True if the registered solver can report improved solutions while it runs
+  """
+  from algorithms.registry import SOLVERS
+  return "progress" in inspect.signature(SOLVERS[algorithm]).parameters
+
+
+def solve_request(job):
+  """
+  Builds and solves the model of one request in a worker process, sending improved solutions to the
+  progress queue. Returns the routes, cost and wall time as plain JSON types
+  """
+  from algorithms.registry import solve, SOLVERS
+  request = job["request"]
+  algorithm = request.get("algorithm", "gls")
+  if algorithm not in SOLVERS:
+    raise ValueError("unknown solver: " + str(algorithm))
+  model = build_model(request)
+  options = dict(request.get("options", {}))
+  if progress_queue is not None and accepts_progress(algorithm):
+    def progress(elapsed, cost, routes):
+      progress_queue.put((job["id"], elapsed, int(cost), routes))
+    options["progress"] = progress
+  result = solve(algorithm, model, job["time_limit"], **options)
+  routes = [[int(location) for location in route] for route in result.routes] if result.routes is not None else None
+  cost = result.cost.item() if hasattr(result.cost, "item") else result.cost
+  return {"routes": routes, "cost": cost, "wall_time": result.wall_time}
+
+
+def summary(values):
+  """
+  Returns the count, mean, median and 95th percentile of a list of durations
+  """
+  if not values:
+    return {"count": 0}
+  values = np.asarray(values)
+  return {"count": len(values), "mean": values.mean().item(), "p50": np.percentile(values, 50).item(),
+          "p95": np.percentile(values, 95).item()}
+
+
+class SolveService:
+  """
+  Accepts connections on a Unix socket or a local TCP port. Every line a client sends is a JSON request:
+  {"op": "solve", ...instance, "algorithm", "time_limit", "deadline"} or {"op": "metrics"}.
+  A solve request is answered with JSON lines: "accepted" (or "rejected" when max_queue requests are
+  waiting), "started", a "progress" line with the routes of every improved solution, and finally "result",
+  "expired" (its deadline passed while queued), "timeout" or "error". deadline is the number of seconds
+  after arrival the result is needed by; the search time limit is shortened to fit it.
+  time_limit must be a positive number of seconds (default 1), at most max_time_limit, so that every solve
+  ends and frees its worker; other requests are rejected
+  """
+
+  def __init__(self, workers=None, max_queue=MAX_QUEUE, max_time_limit=MAX_TIME_LIMIT):
+    self.workers = workers or default_workers()
+    self.max_time_limit = max_time_limit
+    self.queue = asyncio.Queue(max_queue)
+    self.running = {}
+    self.ids = itertools.count(1)
+    self.counters = collections.Counter()
+    self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+    self.queue_waits = collections.deque(maxlen=LATENCY_WINDOW)
+    self.server = None
+
+  async def start(self, path=None, host="127.0.0.1", port=0):
+    """
+    Starts the worker pool and listens on the Unix socket path, or on host:port if path is None.
+    Returns the socket path or the (host, port) listened on
+    """
+    self.loop = asyncio.get_running_loop()
+    context = multiprocessing.get_context("spawn")
+    self.progress = context.Queue()
+    self.pool = ProcessPoolExecutor(self.workers, mp_context=context, initializer=warm_worker,
+                                    initargs=(self.progress,))
+    # start and warm every worker before accepting requests
+    await asyncio.gather(*[self.loop.run_in_executor(self.pool, time.sleep, 0.1) for _ in range(self.workers)])
+    self.pump = threading.Thread(target=self.pump_progress, daemon=True)
+    self.pump.start()
+    self.dispatchers = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+    if path is not None:
+      if os.path.exists(path):
+        os.unlink(path)
+      self.server = await asyncio.start_unix_server(self.handle, path, limit=LINE_LIMIT)
+      return path
+    self.server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+    return self.server.sockets[0].getsockname()[:2]
+
+  async def close(self):
+    """
+    Stops listening, drops the waiting requests and shuts the worker pool down
+    """
+    self.server.close()
+    await self.server.wait_closed()
+    for task in self.dispatchers:
+      task.cancel()
+    self.pool.shutdown(wait=True, cancel_futures=True)
+    self.progress.put(None)
+    self.pump.join()
+
+  def metrics(self):
+    """
+    Returns the queue depth, running solves, request counters and latency percentiles
+    """
+    return {"queue_depth": self.queue.qsize(), "running": len(self.running), "workers": self.workers,
+            "counters": dict(self.counters), "latency": summary(list(self.latencies)),
+            "queue_wait": summary(list(self.queue_waits))}
+
+  async def handle(self, reader, writer):
+    """
+    Serves the requests of one connection in turn
+    """
+    async def send(event):
+      writer.write(json.dumps(event).encode() + b"\n")
+      await writer.drain()
+
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        try:
+          message = json.loads(line)
+        except ValueError:
+          await send({"event": "error", "error": "request is not valid JSON"})
+          continue
+        if message.get("op", "solve") == "metrics":
+          await send(dict(self.metrics(), event="metrics"))
+        else:
+          await self.submit(message, send)
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def submit(self, request, send):
+    """
+    Queues a solve request and forwards its events to the client until the last one
+    """
+    job = {"id": next(self.ids), "request": request, "received": time.perf_counter(),
+           "events": asyncio.Queue(), "cancelled": False}
+    time_limit = request.get("time_limit", 1)
+    deadline = request.get("deadline")
+    reason = None
+    if not positive_number(time_limit):
+      reason = "time_limit must be a positive number of seconds"
+    elif deadline is not None and not positive_number(deadline):
+      reason = "deadline must be a positive number of seconds"
+    if reason is not None:
+      self.counters["rejected"] += 1
+      await send({"event": "rejected", "id": job["id"], "reason": reason})
+      return
+    job["time_limit"] = min(time_limit, self.max_time_limit)
+    job["deadline"] = job["received"] + deadline if deadline is not None else None
+    if self.queue.full():
+      self.counters["rejected"] += 1
+      await send({"event": "rejected", "id": job["id"], "reason": "queue full", "queue_depth": self.queue.qsize()})
+      return
+    self.queue.put_nowait(job)
+    self.counters["accepted"] += 1
+    try:
+      await send({"event": "accepted", "id": job["id"], "queue_depth": self.queue.qsize()})
+      while True:
+        event = await job["events"].get()
+        await send(event)
+        if event["event"] in TERMINAL_EVENTS:
+          break
+    except ConnectionError:
+      # a request still waiting is skipped, a running solve finishes unreported
+      job["cancelled"] = True
+      raise
+
+  async def dispatch(self):
+    """
+    Takes requests off the queue and runs them on the pool, one at a time per worker
+    """
+    while True:
+      job = await self.queue.get()
+      if job["cancelled"]:
+        self.counters["cancelled"] += 1
+        continue
+      started = time.perf_counter()
+      events = job["events"]
+      time_limit = job["time_limit"]
+      if job["deadline"] is not None:
+        remaining = job["deadline"] - started
+        if remaining <= 0:
+          self.counters["expired"] += 1
+          events.put_nowait({"event": "expired", "id": job["id"], "queue_time": started - job["received"]})
+          continue
+        time_limit = min(time_limit, remaining)
+
+      self.queue_waits.append(started - job["received"])
+      self.running[job["id"]] = job
+      events.put_nowait({"event": "started", "id": job["id"], "time_limit": time_limit})
+      future = self.loop.run_in_executor(self.pool, solve_request,
+                                         {"id": job["id"], "request": job["request"], "time_limit": time_limit})
+      try:
+        result = await asyncio.wait_for(future, time_limit + DEADLINE_GRACE)
+        self.counters["completed"] += 1
+        self.latencies.append(time.perf_counter() - job["received"])
+        events.put_nowait(dict(result, event="result", id=job["id"], queue_time=started - job["received"]))
+      except asyncio.TimeoutError:
+        # the worker cannot be interrupted, its late result is dropped
+        self.counters["timeout"] += 1
+        events.put_nowait({"event": "timeout", "id": job["id"]})
+      except Exception as error:
+        self.counters["failed"] += 1
+        events.put_nowait({"event": "error", "id": job["id"], "error": "{}: {}".format(type(error).__name__, error)})
+      finally:
+        del self.running[job["id"]]
+
+  def pump_progress(self):
+    """
+    Thread moving the progress reports of the workers onto the event loop
+    """
+    while True:
+      item = self.progress.get()
+      if item is None:
+        return
+      self.loop.call_soon_threadsafe(self.report_progress, *item)
+
+  def report_progress(self, job_id, elapsed, cost, routes):
+    job = self.running.get(job_id)
+    if job is not None:
+      job["events"].put_nowait({"event": "progress", "id": job_id, "elapsed": elapsed, "cost": cost, "routes": routes})
+
+
+def positive_number(value):
+  """
+  Returns whether a request field is a finite number of seconds above zero (JSON true and false are not)
+  """
+  return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < float("inf")
+
+
+async def request(message, path=None, host="127.0.0.1", port=None):
+  """
+  Stand-in client: sends one message to a running service and yields its events up to the last one
+  """
+  if path is not None:
+    reader, writer = await asyncio.open_unix_connection(path, limit=LINE_LIMIT)
+  else:
+    reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+  try:
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    while True:
+      line = await reader.readline()
+      if not line:
+        break
+      event = json.loads(line)
+      yield event
+      if event["event"] in TERMINAL_EVENTS:
+        break
+  finally:
+    writer.close()
+    await writer.wait_closed()
+
+
+def random_request(num_locations, seed, algorithm="gls", time_limit=1, deadline=None):
+  """
+  Returns a solve request for a generated map with a quarter as many vehicles as locations
+  """
+  from data.models import create_model
+  num_vehicles = max(1, num_locations // 4)
+  model, coords = create_model(1000, num_locations, num_vehicles, [20] * num_vehicles, seed=seed)
+  message = {"op": "solve", "coords": coords.tolist(), "demands": np.asarray(model["demands"]).tolist(),
+             "vehicle_capacities": [20] * num_vehicles, "algorithm": algorithm, "time_limit": time_limit}
+  if deadline is not None:
+    message["deadline"] = deadline
+  return message
+
+
+async def run_client(message, path=None, host="127.0.0.1", port=None, verbose=True):
+  """
+  Sends a request and returns its events, printing a line per event if verbose
+  """
+  events = []
+  async for event in request(message, path, host, port):
+    events.append(event)
+    if verbose:
+      shown = {key: value for key, value in event.items() if key != "routes"}
+      print(json.dumps(shown))
+  return events
+
+
+async def demo(workers, num_requests, max_queue):
+  """
+  Starts a service and sends it num_requests concurrent requests through the stand-in client, including one
+  whose deadline is too short to wait for a worker, then prints the service metrics
+  """
+  service = SolveService(workers, max_queue)
+  path = await service.start(SOCKET_PATH + ".demo")
+  algorithms = ["gls", "tabu", "local_search"]
+  messages = [random_request(50 + 25 * (k % 3), k, algorithms[k % 3], time_limit=0.5) for k in range(num_requests)]
+  messages.append(random_request(50, 99, "gls", time_limit=0.5, deadline=0.1))
+  # a search without a time limit would never free its worker and is rejected
+  messages.append(random_request(50, 98, "gls", time_limit=None))
+  start = time.perf_counter()
+  results = await asyncio.gather(*[run_client(message, path, verbose=False) for message in messages])
+  for events in results:
+    counts = collections.Counter(event["event"] for event in events)
+    last = events[-1]
+    print('{:<8} cost {} after {} progress events'.format(last["event"], last.get("cost"), counts["progress"]))
+  print('{} requests in {:.2f}s'.format(len(messages), time.perf_counter() - start))
+  metrics = [event async for event in request({"op": "metrics"}, path)][0]
+  print(json.dumps(metrics, indent=1))
+  await service.close()
+  os.unlink(path)
+
+
+async def serve(path, host, port, workers, max_queue, max_time_limit=MAX_TIME_LIMIT):
+  service = SolveService(workers, max_queue, max_time_limit)
+  address = await service.start(path, host, port)
+  print('solve service listening on {}'.format(address))
+  try:
+    await asyncio.Event().wait()
+  finally:
+    await service.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Run the solve service or send requests to it')
+  parser.add_argument('command', choices=['serve', 'client', 'metrics', 'demo'])
+  parser.add_argument('--socket', default=None, help='Unix socket path (default {} unless --port)'.format(SOCKET_PATH))
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=None, help='listen on / connect to a local TCP port')
+  parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+  parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help='waiting requests before rejecting')
+  parser.add_argument('--max-time-limit', type=float, default=MAX_TIME_LIMIT,
+                      help='longest search a request may ask for, in seconds')
+  parser.add_argument('--locations', type=int, default=50, help='map size of a client request')
+  parser.add_argument('--algorithm', default='gls', help='registered solver of a client request')
+  parser.add_argument('--time-limit', type=float, default=1, help='search time of a client request')
+  parser.add_argument('--deadline', type=float, default=None, help='seconds a client request may take in total')
+  parser.add_argument('--requests', type=int, default=8, help='concurrent requests of the demo')
+  args = parser.parse_args()
+  path = args.socket if args.socket or args.port is not None else SOCKET_PATH
+  if args.command == 'serve':
+    asyncio.run(serve(path, args.host, args.port or 0, args.workers, args.max_queue, args.max_time_limit))
+  elif args.command == 'client':
+    message = random_request(args.locations, 0, args.algorithm, args.time_limit, args.deadline)
+    asyncio.run(run_client(message, path, args.host, args.port))
+  elif args.command == 'metrics':
+    asyncio.run(run_client({"op": "metrics"}, path, args.host, args.port))
+  else:
+    asyncio.run(demo(args.workers, args.requests, args.max_queue))